@@ -32,6 +32,12 @@ from . import nvb_animnode
 from . import nvb_mtr
 from . import nvb_props
 from . import nvb_material
+from . import nvb_cache
+from . import nvb_compiler
+from . import nvb_rotation
+from . import nvb_writer
+from . import nvb_manifest
+from . import nvb_meshdata
 
 from . import nvb_ops
 from . import nvb_ops_io
@@ -61,6 +67,12 @@ if 'bpy' in locals():
         importlib.reload(nvb_mtr)
         importlib.reload(nvb_props)
         importlib.reload(nvb_material)
+        importlib.reload(nvb_cache)
+        importlib.reload(nvb_compiler)
+        importlib.reload(nvb_rotation)
+        importlib.reload(nvb_writer)
+        importlib.reload(nvb_manifest)
+        importlib.reload(nvb_meshdata)
         # reload operators
         importlib.reload(nvb_ops)
         importlib.reload(nvb_ops_io)
@@ -113,6 +125,7 @@ neverblender_classes = (
     nvb_props.NVB_PG_emitter,
 
     nvb_props.NVB_OT_decompile_detect_options,
+    nvb_props.NVB_OT_cache_clear,
     
     nvb_ops_io.NVB_OT_mdlexport,
     nvb_ops_io.NVB_OT_mdlimport,
@@ -147,6 +160,7 @@ neverblender_classes = (
     nvb_ops_anim.NVB_OT_anim_crop,
     nvb_ops_anim.NVB_OT_anim_pad,
     nvb_ops_anim.NVB_OT_anim_focus,
+    nvb_ops_anim.NVB_OT_anim_load,
     nvb_ops_anim.NVB_OT_anim_new,
     nvb_ops_anim.NVB_OT_anim_delete,
     nvb_ops_anim.NVB_OT_anim_moveback,
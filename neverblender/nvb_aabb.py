@@ -1,210 +1,87 @@
 """TODO: DOC."""
 
-import mathutils
+import math
 
+import numpy as np
 
-def generate_tree_new(aabb_tree, face_data, rlevel=0):
-    """TODO: DOC."""
-    if (rlevel > 255):
-        print('Neverblender - ERROR: Could not generate aabb.\
-              Recursion level exceeds 255')
-        aabb_tree = []
-        return
 
-    if not face_data:
-        # We are finished with the generation
-        return
-
-    # Calculate Bounding box centers and min/max coordinates
-    vec_list = [face_verts for _, face_verts, _ in face_data]
-    vec_list = [v for vecs in vec_list for v in vecs]  # flatten
-    bot_left = mathutils.Vector([min([v[i] for v in vec_list]) for i in range(3)])
-    top_right = mathutils.Vector([max([v[i] for v in vec_list]) for i in range(3)])
-    avg_centroid = sum([face_centroid for _, _, face_centroid in face_data]) / len(face_data)
-
-    if (len(face_data) == 1):
-        # This aabb node is a leaf
-        face_idx = face_data[0][0]  # Save the face idx in the leaf
-        aabb_treenode = [*bot_left, *top_right, face_idx]
-        aabb_tree.append(aabb_treenode)
-    else:
-        # This is a node in the tree
-        face_idx = -1  # -1 indicates nodes
-        aabb_treenode = [*bot_left, *top_right, face_idx]
-        aabb_tree.append(aabb_treenode)
-
-        # Size of bounding box to get the longest axis
-        bb_size = top_right - bot_left
-        split_axis = 0  # x
-        if (bb_size.y > bb_size.x):
-            split_axis = 1  # y
-        if (bb_size.z > bb_size.y):
-            split_axis = 2  # z
-
-        # Change axis in case points are coplanar with
-        # the split plane
-        change_axis = True
-        for _, _, face_centroid in face_data:
-            change_axis = change_axis and \
-                (face_centroid[split_axis] == avg_centroid[split_axis])
-
-        # Switch to the "next" axis
-        if change_axis:
-            split_axis = (split_axis+1) % 3
-
-        # Put items on the left- and rightside of the splitplane
-        # into sperate lists
-        left_list = []
-        right_list = []
-        found_split = False
-        tested_axes = 1
-        while not found_split:
-            # Sort faces by side
-            left_list = []
-            right_list = []
-            for fd in face_data:
-                face_centroid = fd[2]
-                if (face_centroid[split_axis] < avg_centroid[split_axis]):
-                    left_list.append(fd)
-                else:
-                    right_list.append(fd)
-
-            # Try to prevent tree degeneration
-            if (left_list) and (right_list):
-                # Neither list is empty, this split will do just fine
-                found_split = True
-            else:
-                # At least one of the list is empty
-                # Try another axis to prevent degeneration
-                tested_axes += 1
-                split_axis = (split_axis+1) % 3
-
-                if (tested_axes > 3):
-                    # We have tried all axes, but
-                    # the tree degenerates with each of them
-                    print('WARNING: Error generating aabb. Split problem.')
-                    aabb_tree = []
-                    return
-
-        generate_tree(aabb_tree, left_list, rlevel+1)
-        generate_tree(aabb_tree, right_list, rlevel+1)
-
-
-def generate_tree(aabb_tree, face_list, rlevel=0):
-    """TODO: DOC."""
-    if (rlevel > 255):
-        print('Neverblender - ERROR: Could not generate aabb.\
-              Recursion level exceeds 255')
-        aabb_tree = []
-        return
-
-    if not face_list:
-        # We are finished with the generation
-        return
-
-    # Calculate Bounding box centers and min/max coordinates
-    bb_min = mathutils.Vector((100000.0,  100000.0,  100000.0))
-    bb_max = mathutils.Vector((-100000.0, -100000.0, -100000.0))
-    bb_avgcentroid = mathutils.Vector((0.0, 0.0, 0.0))
-    for face in face_list:
-        face_vertices = face[1]
-        # Every vertex in the face
-        for vertex in face_vertices:
-            # We have to check 2x3 coordinates (min and max)
-            for ax in range(3):
-                # First the min
-                if bb_min[ax] > vertex[ax]:
-                    bb_min[ax] = vertex[ax]
-                # Then the max
-                if bb_max[ax] < vertex[ax]:
-                    bb_max[ax] = vertex[ax]
-
-        face_centroid = face[2]
-        bb_avgcentroid = bb_avgcentroid + face_centroid
-
-    bb_avgcentroid = bb_avgcentroid / len(face_list)
-
-    # bb_centroid = (bb_min + bb_max) / 2
-
-    if (len(face_list) == 1):
-        # Only one face left in face list
-        # This node is a leaf, save the face in the leaf
-        linked_face_idx = face_list[0][0]
-        aabb_treenode = [bb_min.x, bb_min.y, bb_min.z,
-                         bb_max.x, bb_max.y, bb_max.z,
-                         linked_face_idx]
-        aabb_tree.append(aabb_treenode)
-    else:
-        # This is a node in the tree
-        linked_face_idx = -1  # -1 indicates nodes
-        aabb_treenode = [bb_min.x, bb_min.y, bb_min.z,
-                         bb_max.x, bb_max.y, bb_max.z,
-                         linked_face_idx]
-        aabb_tree.append(aabb_treenode)
-
-        # Size of bounding box
+def split_faces_sah(face_ids, face_min, face_max, face_centroids, bin_cnt):
+    """Split faces into two lists using a binned surface area heuristic."""
+    def surface_area(bb_min, bb_max):
         bb_size = bb_max - bb_min
-
-        # Longest axis of bounding box
-        split_axis = 0  # x
-        if (bb_size.y > bb_size.x):
-            split_axis = 1  # y
-        if (bb_size.z > bb_size.y):
-            split_axis = 2  # z
-
-        # Change axis in case points are coplanar with
-        # the split plane
-        change_axis = True
-        for face in face_list:
-            face_centroid = face[2]
-            change_axis = change_axis and \
-                (face_centroid[split_axis] == bb_avgcentroid[split_axis])
-
-        if (change_axis):
-            split_axis += 1
-            if (split_axis >= 3):
-                split_axis = 0
-
-        # Put items on the left- and rightside of the splitplane
-        # into sperate lists
-        face_list_left = []
-        face_list_right = []
-        found_split = False
-        tested_axes = 1
-        while not found_split:
-            # Sort faces by side
-            face_list_left = []
-            face_list_right = []
-            leftside = True
-            for face in face_list:
-                face_centroid = face[2]
-
-                leftside = \
-                    (face_centroid[split_axis] < bb_avgcentroid[split_axis])
-                if leftside:
-                    face_list_left.append(face)
-                else:
-                    face_list_right.append(face)
-
-            # Try to prevent tree degeneration
-            if (face_list_left) and (face_list_right):
-                # Neither list is empty, this split will do just fine
-                found_split = True
-            else:
-                # At least one of the list is empty
-                # Try another axis to prevent degeneration
-                tested_axes += 1
-
-                split_axis += 1
-                if (split_axis >= 3):
-                    split_axis = 0
-                if (tested_axes > 3):
-                    # We have tried all axes, but
-                    # the tree degenerates with each of them
-                    # Just take the degenerate one
-                    print('WARNING: Error generating aabb. Split problem.')
-                    aabb_tree = []
-                    return
-
-        generate_tree(aabb_tree, face_list_left, rlevel+1)
-        generate_tree(aabb_tree, face_list_right, rlevel+1)
+        return bb_size[:, 0] * bb_size[:, 1] + \
+            bb_size[:, 1] * bb_size[:, 2] + \
+            bb_size[:, 2] * bb_size[:, 0]
+
+    face_cnt = len(face_ids)
+    if face_cnt == 2:
+        return face_ids[:1], face_ids[1:]
+    centroids = face_centroids[face_ids]
+    centroid_min = centroids.min(axis=0)
+    centroid_size = centroids.max(axis=0) - centroid_min
+    best_cost = math.inf
+    best_split = None
+    for split_axis in range(3):
+        if centroid_size[split_axis] <= 0.0:
+            continue  # All centroids are coplanar with the split plane
+        bins = (centroids[:, split_axis] - centroid_min[split_axis]) * \
+            (bin_cnt / centroid_size[split_axis])
+        bins = np.minimum(bins.astype(np.int32), bin_cnt - 1)
+        order = np.argsort(bins, kind='stable')
+        bins = bins[order]
+        # Bounds and face count of all non-empty bins
+        bin_start = np.flatnonzero(
+            np.concatenate(([True], bins[1:] != bins[:-1])))
+        bin_min = np.minimum.reduceat(face_min[face_ids[order]], bin_start)
+        bin_max = np.maximum.reduceat(face_max[face_ids[order]], bin_start)
+        # Cost of splitting after each bin, left and right side
+        left_cnt = bin_start[1:]
+        left_area = surface_area(
+            np.minimum.accumulate(bin_min, axis=0)[:-1],
+            np.maximum.accumulate(bin_max, axis=0)[:-1])
+        right_area = surface_area(
+            np.minimum.accumulate(bin_min[::-1], axis=0)[-2::-1],
+            np.maximum.accumulate(bin_max[::-1], axis=0)[-2::-1])
+        cost = left_cnt * left_area + (face_cnt - left_cnt) * right_area
+        idx = int(np.argmin(cost))
+        if cost[idx] < best_cost:
+            best_cost = cost[idx]
+            best_split = (order, left_cnt[idx])
+    if best_split:
+        order, left_cnt = best_split
+        return face_ids[order[:left_cnt]], face_ids[order[left_cnt:]]
+    # Identical centroids, any split will do
+    return face_ids[:face_cnt // 2], face_ids[face_cnt // 2:]
+
+
+def generate_tree_sah(face_verts, bin_cnt=16):
+    """Generate an aabb tree from an array of triangles (face_cnt x 3 x 3).
+
+    Returns a list of nodes [min x, y, z, max x, y, z, face_idx] in
+    pre-order, face_idx is -1 for inner nodes and the face for leaves.
+    """
+    face_verts = np.asarray(face_verts)
+    if not len(face_verts):
+        return []
+    face_min = face_verts.min(axis=1)
+    face_max = face_verts.max(axis=1)
+    face_centroids = face_verts.mean(axis=1, dtype=np.float64)
+
+    aabb_tree = []
+    # Explicit stack, right side is pushed first to get pre-order
+    stack = [np.arange(len(face_verts))]
+    while stack:
+        face_ids = stack.pop()
+        bb_min = face_min[face_ids].min(axis=0).tolist()
+        bb_max = face_max[face_ids].max(axis=0).tolist()
+        if len(face_ids) == 1:
+            # This node is a leaf, save the face in the leaf
+            aabb_tree.append([*bb_min, *bb_max, int(face_ids[0])])
+        else:
+            # This is a node in the tree (-1 indicates nodes)
+            aabb_tree.append([*bb_min, *bb_max, -1])
+            left_ids, right_ids = split_faces_sah(
+                face_ids, face_min, face_max, face_centroids, bin_cnt)
+            stack.append(right_ids)
+            stack.append(left_ids)
+    return aabb_tree
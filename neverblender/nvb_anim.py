@@ -1,12 +1,18 @@
 """TODO: DOC."""
 
+from . import nvb_def
 from . import nvb_utils
+from . import nvb_parse
+from . import nvb_binmdl
 from . import nvb_animnode
 
 
 class Animation():
     """TODO: DOC."""
 
+    # Keys scaled by the animation scale of lazy animations
+    scaled_keys = {'positionkey', 'positionbezierkey'}
+
     def __init__(self, name='UNNAMED'):
         """TODO: DOC."""
         self.name = name
@@ -15,6 +21,10 @@ class Animation():
         self.animroot = ''
         self.events = []
         self.nodes = []
+        # Location of the animation in its file, for loading it lazily
+        self.source = ''
+        self.source_offset = -1
+        self.source_binary = False
 
     @staticmethod
     def createRestPose(obj, frame=1):
@@ -41,7 +51,17 @@ class Animation():
             newEvent = new_anim.eventList.add()
             newEvent.name = ev_name
             newEvent.frame = round(fps * ev_time, 0) + new_anim.frameStart
-        # Load the animation into the objects/actions
+        # Keyframes of lazy animations are loaded on demand
+        if self.source:
+            new_anim.lazy_source = self.source
+            new_anim.lazy_offset = self.source_offset
+            new_anim.lazy_binary = self.source_binary
+            new_anim.lazy_scale = options.anim_scale or 1.0
+            return
+        self.create_keyframes(new_anim, noderesolver, options)
+
+    def create_keyframes(self, new_anim, noderesolver, options):
+        """Load the animation into the objects/actions."""
         for node in self.nodes:
             obj = noderesolver.get_obj(node.name, node.nodeidx)
             if obj:
@@ -49,47 +69,130 @@ class Animation():
                 if options.anim_restpose:
                     Animation.createRestPose(obj, new_anim.frameStart-5)
 
-    def loadAsciiAnimHeader(self, ascii_data):
+    @staticmethod
+    def create_lazy(anim_item, noderesolver, options):
+        """Load the keyframes of a lazily imported animation."""
+        anim = Animation()
+        try:
+            anim.loadSource(anim_item.lazy_source, anim_item.lazy_offset,
+                            anim_item.lazy_binary)
+        except (OSError, nvb_def.MalformedMdlFile) as e:
+            print('Neverblender: ERROR - Unable to load animation ' +
+                  anim_item.name + ': ' + str(e))
+            return False
+        options.anim_scale = None
+        if round(anim_item.lazy_scale, 3) != 1.0:
+            options.anim_scale = anim_item.lazy_scale
+        anim.create_keyframes(anim_item, noderesolver, options)
+        anim_item.lazy_source = ''
+        return True
+
+    def loadAsciiAnimHeader(self, line):
         """TODO: DOC."""
-        ascii_lines = [l.strip().split() for l in ascii_data.splitlines()]
-        for line in ascii_lines:
+        label = line[0].lower()
+        if (label == 'newanim'):
+            self.name = nvb_utils.str2identifier(line[1])
+        elif (label == 'length'):
+            self.length = float(line[1])
+        elif (label == 'transtime'):
+            self.transtime = float(line[1])
+        elif (label == 'animroot'):
             try:
-                label = line[0].lower()
-            except (IndexError, AttributeError):
-                continue  # Probably empty line, skip it
-            if (label == 'newanim'):
-                self.name = nvb_utils.str2identifier(line[1])
-            elif (label == 'length'):
-                self.length = float(line[1])
-            elif (label == 'transtime'):
-                self.transtime = float(line[1])
-            elif (label == 'animroot'):
-                try:
-                    self.animroot = line[1].lower()
-                except (ValueError, IndexError):
-                    self.animroot = ''
-            elif (label == 'event'):
-                self.events.append((float(line[1]), line[2]))
-
-    def loadAsciiAnimNodes(self, ascii_data):
+                self.animroot = line[1].lower()
+            except (ValueError, IndexError):
+                self.animroot = ''
+        elif (label == 'event'):
+            self.events.append((float(line[1]), line[2]))
+
+    def loadAsciiAnimNode(self, record, itrecords, node_idx):
         """TODO: DOC."""
-        dlm = 'node '
-        node_list = [dlm + s for s in ascii_data.split(dlm) if s != '']
-        for idx, ascii_node in enumerate(node_list):
-            ascii_lines = [l.strip().split() for l in ascii_node.splitlines()]
-            node = nvb_animnode.Animnode()
-            node.load_ascii(ascii_lines, idx)
-            self.nodes.append(node)
-
-    def loadAscii(self, ascii_data):
-        """Load an animation from a block from an ascii mdl file."""
-        animNodesStart = ascii_data.find('node ')
-        if (animNodesStart > -1):
-            self.loadAsciiAnimHeader(ascii_data[:animNodesStart-1])
-            self.loadAsciiAnimNodes(ascii_data[animNodesStart:])
-        else:
+        node = nvb_animnode.Animnode()
+        node.load_ascii(nvb_parse.ascii_block(record, itrecords), node_idx)
+        self.nodes.append(node)
+
+    def loadAscii(self, record, itrecords, header_only=False):
+        """Load an animation from the records of an ascii mdl file.
+
+        Starts with the 'newanim' record and consumes all records up to and
+        including the matching 'doneanim' (or the first node, if only the
+        header is needed).
+        """
+        self.loadAsciiAnimHeader(record[1])
+        node_idx = 0  # Position in the file, including skipped nodes
+        for record in itrecords:
+            record_type = record[0]
+            if record_type == nvb_parse.Recordtype.NODE:
+                if header_only:
+                    return
+                self.loadAsciiAnimNode(record, itrecords, node_idx)
+                node_idx += 1
+            elif record_type == nvb_parse.Recordtype.SKIPNODE:
+                node_idx += 1
+            elif record_type == nvb_parse.Recordtype.DONEANIM:
+                break
+            elif not self.nodes:
+                self.loadAsciiAnimHeader(record[1])
+        if not self.nodes and not header_only:
             print('Neverblender - WARNING: Failed to load an animation.')
 
+    def loadSource(self, filepath, offset, binary, header_only=False):
+        """Load a single animation from a (binary) mdl file at an offset."""
+        if binary:
+            records = nvb_binmdl.read_anim_records(filepath, offset,
+                                                   not header_only)
+        else:
+            records = nvb_parse.ascii_anim_records(filepath, offset)
+        itrecords = iter(records)
+        record = next(itrecords, None)
+        if not record or record[0] != nvb_parse.Recordtype.NEWANIM:
+            raise nvb_def.MalformedMdlFile('No animation at offset ' +
+                                           str(offset))
+        self.loadAscii(record, itrecords, header_only)
+        if header_only:
+            self.source = filepath
+            self.source_offset = offset
+            self.source_binary = binary
+
+    @staticmethod
+    def generate_ascii_source(anim_item):
+        """Ascii lines of the nodes of a lazy animation, from its source.
+
+        Keyframes of lazily imported animations are not in the blend file,
+        they are copied from the source mdl without loading them.
+        """
+        if anim_item.lazy_binary:
+            records = nvb_binmdl.read_anim_records(anim_item.lazy_source,
+                                                   anim_item.lazy_offset)
+        else:
+            records = nvb_parse.ascii_anim_records(anim_item.lazy_source,
+                                                   anim_item.lazy_offset)
+        scale = 1.0
+        if round(anim_item.lazy_scale, 3) != 1.0:
+            scale = anim_item.lazy_scale
+        node_lines = []
+        in_node = False
+        for record_type, tokens, rows in records:
+            if record_type == nvb_parse.Recordtype.NODE:
+                in_node = True
+                node_lines.append('  ' + ' '.join(tokens))
+            elif record_type == nvb_parse.Recordtype.ENDNODE:
+                in_node = False
+                node_lines.append('  endnode')
+            elif record_type == nvb_parse.Recordtype.DONEANIM:
+                break
+            elif in_node:
+                label = tokens[0].lower()
+                if scale != 1.0 and label in Animation.scaled_keys:
+                    # Applied to the keys on import, same as for loaded anims
+                    rows = [[r[0]] + [float(v) * scale for v in r[1:]]
+                            for r in rows]
+                node_lines.append('    ' + ' '.join(tokens))
+                # Rows of compiled mdls hold numbers instead of strings
+                node_lines.extend(['      ' + ' '.join(
+                    [v if isinstance(v, str) else str(round(float(v), 7))
+                     for v in r]) for r in rows])
+        return node_lines
+
     @staticmethod
     def generateAsciiNodes(obj, anim, ascii_lines, options):
         """TODO: Doc."""
@@ -108,6 +211,14 @@ class Animation():
         """TODO: Doc."""
         if anim.mute:  # Don't export mute animations
             return
+        node_lines = None
+        if anim.lazy_source:
+            try:
+                node_lines = Animation.generate_ascii_source(anim)
+            except (OSError, nvb_def.MalformedMdlFile) as e:
+                print('Neverblender: ERROR - Unable to export animation ' +
+                      anim.name + ': ' + str(e))
+                return
         fps = options.scene.render.fps
         anim_length = (anim.frameEnd - anim.frameStart)/fps
         ascii_lines.append('newanim ' + anim.name + ' ' + mdl_base.name)
@@ -141,7 +252,10 @@ class Animation():
             ascii_lines.append('  event ' + str(round(event_time, 3)) + ' ' +
                                event.name)
 
-        Animation.generateAsciiNodes(mdl_base, anim, ascii_lines, options)
+        if node_lines is None:
+            Animation.generateAsciiNodes(mdl_base, anim, ascii_lines, options)
+        else:
+            ascii_lines.extend(node_lines)
 
         ascii_lines.append('doneanim ' + anim.name + ' ' + mdl_base.name)
         ascii_lines.append('')
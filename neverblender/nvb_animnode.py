@@ -1,10 +1,15 @@
 """TODO: DOC."""
 
+import numpy as np
+
 import mathutils
-from bpy_extras.io_utils import unpack_list
 
 from . import nvb_def
 from . import nvb_utils
+from . import nvb_parse
+from . import nvb_meshdata
+from . import nvb_rotation
+from . import nvb_writer
 from . import nvb_node
 from .nvb_materialnode import Materialnode
 
@@ -40,6 +45,8 @@ class Animnode():
         self.name = name
         self.parent = nvb_def.null
 
+        # Controllers: name => [keys, data path, dimension], keys is a
+        # (number of keys, 1 + dimension) array, time in the first column
         self.emitter_data = dict()
         self.material_data = dict()
         self.object_data = dict()
@@ -47,8 +54,8 @@ class Animnode():
         # Animesh Data
         self.sampleperiod = 0.0
         self.facedef = []
-        self.animtverts = []
-        self.animverts = []
+        self.animtverts = np.empty((0, 2), dtype=np.float32)
+        self.animverts = np.empty((0, 3), dtype=np.float32)
 
         self.uvdata = False  # Animmesh, uv animations present
         self.shapedata = False  # Animmesh, vertex animations present
@@ -60,45 +67,25 @@ class Animnode():
     @staticmethod
     def insert_kfp(frames, values, action, dp, dp_dim, action_group=None):
         """TODO: DOC."""
-        if frames and values:
+        if len(frames) and len(values):
             fcu = [nvb_utils.get_fcurve(action, dp, i, action_group)
                    for i in range(dp_dim)]
-            kfp_list = [fcu[i].keyframe_points for i in range(dp_dim)]
-            kfp_cnt = list(map(lambda x: len(x), kfp_list))
-            list(map(lambda x: x.add(len(values)), kfp_list))
-            for i, (frm, val) in enumerate(zip(frames, values)):
-                for d in range(dp_dim):
-                    p = kfp_list[d][kfp_cnt[d]+i]
-                    p.co = frm, val[d]
-                    p.interpolation = 'LINEAR'
-            list(map(lambda c: c.update(), fcu))
-
-    def load_ascii(self, ascii_lines, nodeidx=-1):
-        """TODO: DOC."""
-        def find_end(ascii_lines):
-            """Find the end of a key list.
+            nvb_utils.insert_keyframes(fcu, frames, values)
 
-            We don't know when a list of keys of keys will end. We'll have to
-            search for the first non-numeric value
-            """
-            l_isNumber = nvb_utils.isNumber
-            return next((i for i, v in enumerate(ascii_lines)
-                         if not l_isNumber(v[0])), -1)
+    @staticmethod
+    def get_frames(keys, fps, frame_start):
+        """Convert the key times (first column) to frames."""
+        return np.round(fps * keys[:, 0].astype(np.float64), 3) + frame_start
 
+    def load_ascii(self, ascii_records, nodeidx=-1):
+        """TODO: DOC."""
         self.nodeidx = nodeidx
         properties_list = [  # For easier parsing
             [type(self).emitter_properties, self.emitter_data],
             [type(self).material_properties, self.material_data],
             [type(self).object_properties, self.object_data]]
-        l_isNumber = nvb_utils.isNumber
-        for i, line in enumerate(ascii_lines):
-            try:
-                label = line[0].lower()
-            except (IndexError, AttributeError):
-                continue  # Probably empty line, skip it
-            else:
-                if l_isNumber(label):
-                    continue
+        for _, line, rows in ascii_records:
+            label = line[0].lower()
             if label == 'node':
                 self.nodetype = line[1].lower()
                 self.name = nvb_utils.str2identifier(line[2])
@@ -113,18 +100,16 @@ class Animnode():
                 if not self.facedef:
                     valcnt = int(line[1])
                     self.facedef = [list(map(int, v))
-                                    for v in ascii_lines[i+1:i+valcnt+1]]
+                                    for v in rows[:valcnt]]
             elif label == 'animverts':
-                if not self.animverts:
+                if not self.shapedata:
                     valcnt = int(line[1])
-                    self.animverts = [list(map(float, v))
-                                      for v in ascii_lines[i+1:i+valcnt+1]]
+                    self.animverts = nvb_parse.ascii_array(rows, valcnt, 3)
                     self.shapedata = True
             elif label == 'animtverts':
-                if not self.animtverts:
+                if not self.uvdata:
                     valcnt = int(line[1])
-                    self.animtverts = [(float(v[0]), float(v[1]))
-                                       for v in ascii_lines[i+1:i+valcnt+1]]
+                    self.animtverts = nvb_parse.ascii_array(rows, valcnt, 2)
                     self.uvdata = True
             else:  # Check for keys
                 key_name = label
@@ -138,15 +123,14 @@ class Animnode():
                         data_dim = key_def[key_name][1]
                         # key_converter = key_def[key_name][2]
                         if key_is_single:
-                            data = [[0.0] + list(map(float,
-                                    line[1:data_dim+1]))]
+                            data = np.zeros((1, data_dim+1), dtype=np.float32)
+                            data[:, 1:] = nvb_parse.ascii_array(
+                                [line[1:data_dim+1]], 1, data_dim)
                         else:
-                            keycnt = find_end(ascii_lines[i+1:])
-                            data = [list(map(float, v[:data_dim+1]))
-                                    for v in ascii_lines[i+1:i+keycnt+1]]
-                        # values = \
-                        # [[float(v[0])] + list(map(key_converter, v[1:]))
-                        #  for v in values]
+                            # The key list is the block of numeric rows
+                            # following the label
+                            data = nvb_parse.ascii_array(rows, len(rows),
+                                                         data_dim+1)
                         key_data[key_name] = [data, data_path, data_dim]
                         break
 
@@ -176,12 +160,12 @@ class Animnode():
         frame_start = anim.frameStart
         action = nvb_utils.get_action(blen_mat.node_tree, blen_mat.name)
         for label, (data, data_path, data_dim) in self.material_data.items():
-            frames = [round(fps * d[0], 3) + frame_start for d in data]
+            frames = Animnode.get_frames(data, fps, frame_start)
             if not data_path:  # Needs conversion
                 values, dp, dp_dim = data_conversion(
-                    label, blen_mat_out, [d[1:data_dim+1] for d in data])
+                    label, blen_mat_out, data[:, 1:data_dim+1])
             else:
-                values = [d[1:data_dim+1] for d in data]
+                values = data[:, 1:data_dim+1]
                 dp = data_path
                 dp_dim = data_dim
             Animnode.insert_kfp(frames, values, action, dp, dp_dim)
@@ -193,37 +177,29 @@ class Animnode():
                 if obj.rotation_mode == 'AXIS_ANGLE':
                     dp = 'rotation_axis_angle'
                     dp_dim = 4
-                    new_values = [[v[3], v[0], v[1], v[2]] for v in vals]
+                    new_values = vals[:, [3, 0, 1, 2]]
                 elif obj.rotation_mode == 'QUATERNION':
                     dp = 'rotation_quaternion'
                     dp_dim = 4
-                    quats = [mathutils.Quaternion(v[0:3], v[3]) for v in vals]
-                    new_values = [[q.w, q.x, q.y, q.z] for q in quats]
+                    new_values = nvb_rotation.axisangle_to_quat(vals)
                 else:
                     dp = 'rotation_euler'
                     dp_dim = 3
-                    # Run an euler filer
-                    prev_eul = mathutils.Euler()
-                    new_values = []
-                    for v in vals:
-                        quat = mathutils.Quaternion(v[0:3], v[3])
-                        eul = quat.to_euler('XYZ', prev_eul)
-                        #  eul = nvb_utils.eulerFilter(quat.to_euler(),
-                        #  prev_eul)
-                        new_values.append(eul)
-                        prev_eul = eul
+                    # Run an euler filter
+                    new_values = nvb_rotation.quat_to_euler(
+                        nvb_rotation.axisangle_to_quat(vals))
             elif label == 'position':
                 scl = options.anim_scale
                 dp = 'location'
                 dp_dim = 3
                 if scl:
-                    new_values = [[l * scl for l in loc] for loc in vals]
+                    new_values = vals * scl
                 else:
                     new_values = vals
             elif label == 'scale':
                 dp = 'scale'
                 dp_dim = 3
-                new_values = [v*dp_dim for v in vals]
+                new_values = np.repeat(vals[:, :1], dp_dim, axis=1)
 
             return new_values, dp, dp_dim
 
@@ -231,12 +207,12 @@ class Animnode():
         frame_start = anim.frameStart
         action = nvb_utils.get_action(obj, options.mdlname + '.' + obj.name)
         for label, (data, data_path, data_dim) in self.object_data.items():
-            frames = [round(fps * d[0], 3) + frame_start for d in data]
+            frames = Animnode.get_frames(data, fps, frame_start)
             if not data_path:  # Needs conversion
                 values, dp, dp_dim = data_conversion(
-                    label, obj, [d[1:data_dim+1] for d in data], options)
+                    label, obj, data[:, 1:data_dim+1], options)
             else:
-                values = [d[1:data_dim+1] for d in data]
+                values = data[:, 1:data_dim+1]
                 dp = data_path
                 dp_dim = data_dim
             Animnode.insert_kfp(frames, values, action, dp, dp_dim)
@@ -254,8 +230,8 @@ class Animnode():
         frame_start = anim.frameStart
         action = nvb_utils.get_action(part_settings, part_settings.name)
         for label, (data, data_path, data_dim) in self.emitter_data.items():
-            frames = [round(fps * d[0], 3) + frame_start for d in data]
-            values = [d[1:data_dim+1] for d in data]
+            frames = Animnode.get_frames(data, fps, frame_start)
+            values = data[:, 1:data_dim+1]
             dp = data_path
             dp_dim = data_dim
             if dp.startswith('nvb'):  # Group custom properties
@@ -269,10 +245,14 @@ class Animnode():
         sample_cnt = int(animlength / self.sampleperiod) + 1
         vert_cnt = len(obj.data.vertices)
         # Sanity Check
-        if len(self.animtverts) % sample_cnt > 0.0:
+        if len(self.animverts) % sample_cnt > 0.0 or \
+                len(self.animverts) < sample_cnt * vert_cnt:
             print("Neverblender: WARNING - animvert sample size mismatch: " +
                   obj.name)
             return
+        # (samples, verts * 3) view, each row can be passed to foreach_set
+        anim_verts = self.animverts[:sample_cnt * vert_cnt].reshape(
+            sample_cnt, vert_cnt * 3)
 
         fps = options.scene.render.fps
         frame_start = anim.frameStart
@@ -289,19 +269,15 @@ class Animnode():
             sk_name = anim.name + str(idx)
             sk = obj.shape_key_add(name=sk_name, from_mix=False)
             sk_frame_list.append(sk.frame)
-            sk_values = self.animverts[idx*vert_cnt:(idx+1)*vert_cnt]
-            sk_values = [c for coords in sk_values for c in coords]
-            sk.data.foreach_set('co', sk_values)
+            sk.data.foreach_set('co', anim_verts[idx])
         # Get action, create one if necessary
         action = nvb_utils.get_action(shape_keys, shape_keys.name)
         # Insert keyframes
-        kfOptions = {'FAST'}
         sample_dist = fps * self.sampleperiod
         fcu = nvb_utils.get_fcurve(action, 'eval_time', 0)
-        for idx, eval_time in enumerate(sk_frame_list):
-            kfp_frame = frame_start + (idx * sample_dist)
-            fcu.keyframe_points.insert(kfp_frame, eval_time, options=kfOptions)
-        fcu.update()
+        frames = [frame_start + (idx * sample_dist)
+                  for idx in range(len(sk_frame_list))]
+        nvb_utils.insert_keyframes([fcu], frames, sk_frame_list)
 
     def create_data_uv(self, obj, anim, animlength, options):
         """Import animated texture coordinates."""
@@ -312,18 +288,18 @@ class Animnode():
                   obj.name)
             return
         sample_size = int(len(self.animtverts) / num_samples)
+        samples = self.animtverts.reshape(num_samples, sample_size, 2)
+        # Gather the uvs of all face corners for all samples at once
+        face_uv_indices = np.array([f[4:7] for f in self.facedef],
+                                   dtype=np.int64).reshape(-1)
+        face_uv_coords = samples[:, face_uv_indices].reshape(num_samples, -1)
         # Create uv layers
-        face_uv_indices = [tuple(f[4:7]) for f in self.facedef]
-        face_uv_indices = unpack_list(face_uv_indices)
         sample_fstr = 'animtverts.'+anim.name+'.{:d}'
-        sampler = enumerate(zip(*[iter(self.animtverts)] * sample_size))
-        for sample_idx, sample in sampler:
-            face_uv_coords = [sample[i] for i in face_uv_indices]
-            face_uv_coords = unpack_list(face_uv_coords)
+        for sample_idx, sample_coords in enumerate(face_uv_coords):
             uv_layer = obj.data.uv_layers.new(do_init=False)
             uv_layer.name = sample_fstr.format(sample_idx)
             uv_layer.data.foreach_set(
-                'uv', face_uv_coords[:2*len(uv_layer.data)])
+                'uv', sample_coords[:2*len(uv_layer.data)])
 
     @staticmethod
     def create_restpose(obj, frame=1):
@@ -529,31 +505,26 @@ class Animnode():
             return exports
 
         def convert_loc(obj, kfvalues):
-            pinv = obj.matrix_parent_inverse
-            return [(pinv @ mathutils.Matrix.Translation(v)).to_translation()
-                    for v in kfvalues]
+            pinv = np.array(obj.matrix_parent_inverse)
+            return nvb_rotation.apply_parent_inverse_loc(pinv, kfvalues)
+
+        def convert_rot(obj, mats):
+            pinv = np.array(obj.matrix_parent_inverse)
+            # Like mathutils Matrix.to_quaternion() (w >= 0), then the
+            # axis and angle of that quaternion
+            return nvb_rotation.quat_to_axisangle(nvb_rotation.canonical_quat(
+                nvb_rotation.apply_parent_inverse_rot(pinv, mats)))
 
         def convert_eul(obj, kfvalues):
-            pinv = obj.matrix_parent_inverse
-            mats = [pinv @ mathutils.Euler(v, 'XYZ').to_matrix().to_4x4()
-                    for v in kfvalues]
-            return [[*q.axis, q.angle] for q in
-                    [m.to_quaternion() for m in mats]]
+            return convert_rot(obj, nvb_rotation.euler_to_matrix(kfvalues))
 
         def convert_axan(obj, kfvalues):
-            pinv = obj.matrix_parent_inverse
-            mats = \
-                [pinv @ mathutils.Quaternion(v[1:], v[0]).to_matrix().to_4x4()
-                 for v in kfvalues]
-            return [[*q.axis, q.angle] for q in
-                    [m.to_quaternion() for m in mats]]
+            axisangles = nvb_rotation.as_rows(kfvalues, 4)[:, [1, 2, 3, 0]]
+            return convert_rot(obj, nvb_rotation.quat_to_matrix(
+                nvb_rotation.axisangle_to_quat(axisangles)))
 
         def convert_quat(obj, kfvalues):
-            pinv = obj.matrix_parent_inverse
-            mats = [pinv @ mathutils.Quaternion(v).to_matrix().to_4x4()
-                    for v in kfvalues]
-            return [[*q.axis, q.angle] for q in
-                    [m.to_quaternion() for m in mats]]
+            return convert_rot(obj, nvb_rotation.quat_to_matrix(kfvalues))
 
         # Get the action from which to export from
         try:
@@ -611,13 +582,17 @@ class Animnode():
                                       key_data,
                                       options)
         # Add keys to ascii lines
-        time_fstr = '{:> 6.3f}'
+        time_fstr = '% 6.3f'
         for key_name, keys, val_fstr in key_data:
             num_keys = len(keys)
             if num_keys > 0:  # Create a key list
                 asciiLines.append('    ' + key_name + 'key ' + str(num_keys))
-                fstr = '      ' + time_fstr + val_fstr
-                asciiLines.extend([fstr.format(k[0], *k[1]) for k in keys])
+                fstr = '      ' + time_fstr + \
+                    nvb_writer.percent_format(val_fstr)
+                # Time + values per row
+                key_rows = np.column_stack(([k[0] for k in keys],
+                                            [k[1] for k in keys]))
+                nvb_writer.extend_rows(asciiLines, fstr, key_rows)
                 asciiLines.append('    endlist')
 
     @staticmethod
@@ -647,31 +622,26 @@ class Animnode():
         anim_end = anim.frameEnd
         fps = options.scene.render.fps
 
-        eval_times = [k.co[1] for k in fcu.keyframe_points
-                      if anim_start <= round(k.co[0], 5) <= anim_end]
-        if not eval_times:
+        eval_times = np.array([k.co[1] for k in fcu.keyframe_points
+                               if anim_start <= round(k.co[0], 5) <= anim_end])
+        if not len(eval_times):
             return -1
-            
-        # rel_kb = [(kb.frame, kb.data) for kb in key_blocks if not kb.mute]
-        anim_verts = []
-        for et in eval_times:
-            # Each eval time is influenced by two shape keys max
-            shape_key0 = next((kb for kb in reversed(key_blocks)
-                               if kb.frame <= et), None)
-            shape_key1 = next((kb for kb in key_blocks
-                               if kb.frame >= et), shape_key0)
-            interval = [shape_key0.frame, shape_key1.frame]
-            factor = [et/sum(interval), 1.0-et/sum(interval)]
-            values = [(factor[0] * d0.co) + (factor[1] * d1.co) for d0, d1 in
-                      zip(shape_key0.data, shape_key1.data)]
-            anim_verts.append(values)
 
-        # Misc data for export
-        if not anim_verts:
-            return -1 
+        # Each eval time is influenced by two shape keys max, the last one
+        # at or before and the first one at or after the eval time
+        kb0, kb1, factor = nvb_meshdata.absolute_key_weights(
+            [kb.frame for kb in key_blocks], eval_times)
+        # Read the coordinates of the required key blocks only once
+        used_kbs = np.unique(np.concatenate((kb0, kb1)))
+        num_verts = len(key_blocks[0].data)
+        kb_coords = np.empty((len(used_kbs), num_verts * 3), dtype=np.float32)
+        for idx, kb_idx in enumerate(used_kbs):
+            key_blocks[int(kb_idx)].data.foreach_get('co', kb_coords[idx])
+        co0 = kb_coords[np.searchsorted(used_kbs, kb0)]
+        co1 = kb_coords[np.searchsorted(used_kbs, kb1)]
+        anim_verts = co0 + factor[:, None].astype(np.float32) * (co1 - co0)
 
         num_samples = len(eval_times)
-        num_verts = len(anim_verts[0])
         if required_samples > 0:
             # Not necessary to add meta data
             # BUT: Sanity check
@@ -692,9 +662,8 @@ class Animnode():
                             str(round(sample_period, 3)))
         # Create ascii representation and add it to the output
         ascii_lines.append('    animverts ' + str(num_samples * num_verts))
-        fstr = '     ' + 3 * ' {: 8.5f}'
-        for av in anim_verts:
-            ascii_lines.extend([fstr.format(*v) for v in av])
+        fstr = '     ' + 3 * ' % 8.5f'
+        nvb_writer.extend_rows(ascii_lines, fstr, anim_verts.reshape(-1, 3))
         ascii_lines.append('    endlist')
 
         return num_samples
@@ -739,11 +708,13 @@ class Animnode():
                                str(round(sample_period, 3)))
         # Create ascii representation and add it to the output
         ascii_lines.append('    animtverts ' + str(num_samples * num_tverts))
-        fstr = '      {: 7.4f} {: 7.4f}  0'
-        uv_coord_list = [[tuple(map(lambda x: round(x, 4), d.uv))
-                         for d in uvl.data] for uvl in anim_uv_layers]
-        for coords in uv_coord_list:
-            ascii_lines.extend([fstr.format(c[0], c[1]) for c in coords])
+        fstr = '      % 7.4f % 7.4f  0'
+        uv_coords = np.empty((num_samples, num_tverts, 2), dtype=np.float32)
+        for uvl, coords in zip(anim_uv_layers, uv_coords):
+            uvl.data.foreach_get('uv', coords.reshape(-1))
+        for coords in uv_coords:
+            nvb_writer.extend_rows(ascii_lines, fstr,
+                                   np.round(coords.astype(np.float64), 4))
         ascii_lines.append('    endlist')
 
         return num_samples
@@ -0,0 +1,1321 @@
+"""Reader and writer for compiled (binary) mdl files.
+
+The compiled model is decoded into the same (type, tokens, rows) records
+the ascii tokenizer yields, so nodes and animations are loaded by the
+regular ascii code. Large blocks (vertices, faces, keys, ...) are passed
+as numpy arrays instead of rows of strings. The writer works the other
+way around and encodes the records of an ascii mdl, or the records
+collected on export, which keep the numeric blocks as arrays too.
+"""
+
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from . import nvb_def
+from . import nvb_parse
+from . import nvb_rotation
+
+Recordtype = nvb_parse.Recordtype
+
+# Pointers are relative to the model data, which starts after the file header
+file_header = struct.Struct('<III')
+# Offset, used length, allocated length
+array_def = struct.Struct('<III')
+# Type, rows, key offset, data offset, columns (+ padding)
+controller_key = struct.Struct('<iHHHBx')
+# Plane normal, plane distance, surface, adjacent faces, vertex indices
+face_dtype = np.dtype([('normal', '<f4', 3), ('distance', '<f4'),
+                       ('surface', '<u4'), ('adjacent', '<i2', 3),
+                       ('vertices', '<u2', 3)])
+# Bounding box, child nodes, face index (-1 for inner nodes), split plane
+aabb_dtype = np.dtype([('min', '<f4', 3), ('max', '<f4', 3),
+                       ('left', '<u4'), ('right', '<u4'), ('face', '<i4'),
+                       ('plane', '<u4')])
+# Raw data offsets are -1 if unused
+raw_null = 0xFFFFFFFF
+
+
+class Nodeflag():
+    """Node header flags (combinations of them define the node type)."""
+
+    HEADER = 0x001
+    LIGHT = 0x002
+    EMITTER = 0x004
+    CAMERA = 0x008
+    REFERENCE = 0x010
+    MESH = 0x020
+    SKIN = 0x040
+    ANIM = 0x080
+    DANGLY = 0x100
+    AABB = 0x200
+
+
+nodetypes = {0x001: nvb_def.Nodetype.DUMMY,
+             0x003: nvb_def.Nodetype.LIGHT,
+             0x005: nvb_def.Nodetype.EMITTER,
+             0x009: nvb_def.Nodetype.DUMMY,  # Camera
+             0x011: nvb_def.Nodetype.REFERENCE,
+             0x021: nvb_def.Nodetype.TRIMESH,
+             0x061: nvb_def.Nodetype.SKIN,
+             0x0A1: nvb_def.Nodetype.ANIMMESH,
+             0x121: nvb_def.Nodetype.DANGLYMESH,
+             0x221: nvb_def.Nodetype.AABB}
+
+classifications = {0x01: nvb_def.Classification.EFFECT,
+                   0x02: nvb_def.Classification.TILE,
+                   0x04: nvb_def.Classification.CHARACTER,
+                   0x08: nvb_def.Classification.DOOR}
+
+# Controller ids, they depend on the node type
+controllers_node = {8: 'position', 20: 'orientation', 36: 'scale'}
+controllers_light = {76: 'color', 88: 'radius', 96: 'shadowradius',
+                     100: 'verticaldisplacement', 140: 'multiplier'}
+controllers_mesh = {100: 'selfillumcolor', 128: 'alpha'}
+controllers_emitter = {80: 'alphaend', 84: 'alphastart', 88: 'birthrate',
+                       92: 'bounce_co', 96: 'colorend', 108: 'colorstart',
+                       120: 'combinetime', 124: 'drag', 128: 'fps',
+                       132: 'frameend', 136: 'framestart', 140: 'grav',
+                       144: 'lifeexp', 148: 'mass', 152: 'p2p_bezier2',
+                       156: 'p2p_bezier3', 160: 'particlerot',
+                       164: 'randvel', 168: 'sizestart', 172: 'sizeend',
+                       176: 'sizestart_y', 180: 'sizeend_y', 184: 'spread',
+                       188: 'threshold', 192: 'velocity', 196: 'xsize',
+                       200: 'ysize', 204: 'blurlength',
+                       208: 'lightningdelay', 212: 'lightningradius',
+                       216: 'lightningscale', 228: 'detonate',
+                       464: 'alphamid', 468: 'colormid',
+                       480: 'percentstart', 481: 'percentmid',
+                       482: 'percentend', 484: 'sizemid', 488: 'sizemid_y'}
+
+# Emitter flags
+emitter_flags = [(0x0001, 'p2p'), (0x0004, 'affectedbywind'),
+                 (0x0008, 'm_istinted'), (0x0010, 'bounce'),
+                 (0x0020, 'random'), (0x0040, 'inherit'),
+                 (0x0080, 'inheritvel'), (0x0100, 'inherit_local'),
+                 (0x0200, 'splat'), (0x0400, 'inherit_part')]
+emitter_flag_bezier = 0x0002
+
+identity_quat = (1.0, 0.0, 0.0, 0.0)
+
+
+def quat_from_mdl(values):
+    """Reorder (x, y, z, w) quaternions of compiled mdls to (w, x, y, z)."""
+    return np.roll(nvb_rotation.as_rows(values, 4), 1, axis=1)
+
+
+def quat_to_mdl(quats):
+    """Reorder (w, x, y, z) quaternions to (x, y, z, w) for compiled mdls."""
+    return np.roll(nvb_rotation.as_rows(quats, 4), -1, axis=1)
+
+
+def float_tokens(values):
+    """Convert numbers to string tokens."""
+    return [str(float(v)) for v in values]
+
+
+class Reader():
+    """Decodes a compiled mdl from a buffer."""
+
+    def __init__(self, buf):
+        """TODO: DOC."""
+        self.buf = buf
+        if len(buf) < file_header.size:
+            raise nvb_def.MalformedMdlFile('Binary MDL too short')
+        zero, model_size, raw_size = file_header.unpack_from(buf, 0)
+        if zero != 0 or \
+           file_header.size + model_size + raw_size > len(buf):
+            raise nvb_def.MalformedMdlFile('Invalid binary MDL header')
+        self.model_offset = file_header.size
+        self.raw_offset = file_header.size + model_size
+        self.raw_size = raw_size
+        self.part_names = dict()  # Part number => node name (geometry)
+
+    def unpack(self, fmt, offset):
+        """Unpack values at offset in the model data."""
+        return struct.unpack_from(fmt, self.buf, self.model_offset + offset)
+
+    def string(self, offset, size):
+        """Read a null terminated string of fixed size."""
+        data = bytes(self.buf[self.model_offset + offset:
+                              self.model_offset + offset + size])
+        return data.split(b'\0', 1)[0].decode('latin-1')
+
+    def array(self, offset, dtype, count, dim=0):
+        """Copy count rows of model data into a numpy array (1D if dim=0)."""
+        data = np.frombuffer(self.buf, dtype=dtype,
+                             count=count * max(dim, 1),
+                             offset=self.model_offset + offset)
+        return data.reshape(-1, dim).copy() if dim else data.copy()
+
+    def raw_array(self, offset, dtype, count, dim=1):
+        """Copy count rows of raw data into a numpy array (None if unset)."""
+        if offset == raw_null or not count:
+            return None
+        data = np.frombuffer(self.buf, dtype=dtype, count=count * dim,
+                             offset=self.raw_offset + offset)
+        return data.reshape(-1, dim).copy()
+
+    def array_def(self, offset):
+        """Read an array definition, return offset and length."""
+        arr_offset, arr_len, _ = self.unpack(array_def.format, offset)
+        return arr_offset, arr_len
+
+    def read_records(self, anims=True):
+        """Decode the model, return a list of records."""
+        records = []
+        # Geometry header
+        model_name = self.string(0x08, 64)
+        root_offset, = self.unpack('<I', 0x48)
+        # Model header
+        classification, = self.unpack('<B', 0x72)
+        animscale, = self.unpack('<f', 0xA4)
+        supermodel = self.string(0xA8, 64) or nvb_def.null
+
+        classification = classifications.get(
+            classification, nvb_def.Classification.UNKNOWN)
+        records.append((Recordtype.LINE, ['newmodel', model_name], []))
+        records.append((Recordtype.LINE,
+                        ['setsupermodel', model_name, supermodel], []))
+        records.append((Recordtype.LINE,
+                        ['classification', classification], []))
+        records.append((Recordtype.LINE,
+                        ['setanimationscale', str(animscale)], []))
+        # Skins may reference bones further down the tree
+        self.read_part_names(root_offset)
+        self.read_node_tree(root_offset, records, False)
+        # Animations
+        if anims:
+            for anim_offset in self.read_anim_offsets():
+                self.read_animation(anim_offset, model_name, records)
+        return records
+
+    def read_anim_offsets(self):
+        """Return the offsets of all animations."""
+        anims_offset, anims_cnt = self.array_def(0x78)
+        if not anims_cnt:
+            return []
+        return self.array(anims_offset, '<u4', anims_cnt).tolist()
+
+    def read_animation(self, offset, model_name, records, nodes=True):
+        """Decode a single animation (only its header without nodes)."""
+        anim_name = self.string(offset + 0x08, 64)
+        root_offset, = self.unpack('<I', offset + 0x48)
+        length, transtime = self.unpack('<ff', offset + 0x70)
+        animroot = self.string(offset + 0x78, 64)
+        events_offset, events_cnt = self.array_def(offset + 0xB8)
+
+        records.append((Recordtype.NEWANIM,
+                        ['newanim', anim_name, model_name], []))
+        records.append((Recordtype.LINE, ['length', str(length)], []))
+        records.append((Recordtype.LINE, ['transtime', str(transtime)], []))
+        records.append((Recordtype.LINE, ['animroot', animroot], []))
+        for i in range(events_cnt):
+            ev_offset = events_offset + 36 * i
+            ev_time, = self.unpack('<f', ev_offset)
+            ev_name = self.string(ev_offset + 4, 32)
+            records.append((Recordtype.LINE,
+                            ['event', str(ev_time), ev_name], []))
+        if nodes:
+            self.read_node_tree(root_offset, records, True)
+        records.append((Recordtype.DONEANIM,
+                        ['doneanim', anim_name, model_name], []))
+
+    def check(self):
+        """Check node types of geometry and animations without decoding."""
+        root_offsets = [self.unpack('<I', 0x48)[0]]
+        root_offsets.extend([self.unpack('<I', o + 0x48)[0]
+                             for o in self.read_anim_offsets()])
+        stack = root_offsets
+        while stack:
+            node_offset = stack.pop()
+            flags, = self.unpack('<I', node_offset + 0x6C)
+            if flags not in nodetypes:
+                raise nvb_def.MalformedMdlFile(
+                    'Invalid node type ' + hex(flags))
+            stack.extend(self.read_children(node_offset))
+
+    def read_children(self, node_offset):
+        """Return the offsets of the child nodes."""
+        children_offset, children_cnt = self.array_def(node_offset + 0x48)
+        if not children_cnt:
+            return []
+        return self.array(children_offset, '<u4', children_cnt).tolist()
+
+    def read_part_names(self, root_offset):
+        """Map part numbers to node names."""
+        stack = [root_offset]
+        while stack:
+            node_offset = stack.pop()
+            part_number, = self.unpack('<I', node_offset + 0x1C)
+            self.part_names[part_number] = self.string(node_offset + 0x20, 32)
+            stack.extend(self.read_children(node_offset))
+
+    def read_node_tree(self, root_offset, records, is_anim):
+        """Decode all nodes in pre-order, the same order as ascii mdls."""
+        stack = [(root_offset, nvb_def.null)]
+        while stack:
+            node_offset, parent_name = stack.pop()
+            node_name = self.read_node(node_offset, parent_name, records,
+                                       is_anim)
+            stack.extend([(c, node_name)
+                          for c in reversed(self.read_children(node_offset))])
+
+    def read_node(self, offset, parent_name, records, is_anim):
+        """Decode a single node, return its name."""
+        inheritcolor, = self.unpack('<I', offset + 0x18)
+        node_name = self.string(offset + 0x20, 32)
+        flags, = self.unpack('<I', offset + 0x6C)
+        try:
+            node_type = nodetypes[flags]
+        except KeyError:
+            raise nvb_def.MalformedMdlFile('Invalid node type ' + hex(flags))
+
+        records.append((Recordtype.NODE, ['node', node_type, node_name], []))
+        records.append((Recordtype.LINE, ['parent', parent_name], []))
+        # Controllers: Single values for geometry, keys for animations
+        if flags & Nodeflag.EMITTER:
+            controller_names = controllers_emitter
+        elif flags & Nodeflag.LIGHT:
+            controller_names = controllers_light
+        elif flags & Nodeflag.MESH:
+            controller_names = controllers_mesh
+        else:
+            controller_names = dict()
+        self.read_controllers(offset, controller_names, records, is_anim)
+        # Type specific data, animations only store animmesh data
+        if is_anim:
+            if flags & Nodeflag.ANIM:
+                self.read_animmesh(offset + 0x270, records)
+        elif flags & Nodeflag.LIGHT:
+            self.read_light(offset + 0x70, records)
+        elif flags & Nodeflag.EMITTER:
+            self.read_emitter(offset + 0x70, records)
+        elif flags & Nodeflag.REFERENCE:
+            self.read_reference(offset + 0x70, records)
+        elif flags & Nodeflag.MESH:
+            records.append((Recordtype.LINE,
+                            ['inheritcolor', str(inheritcolor)], []))
+            vert_cnt = self.read_mesh(offset + 0x70, records)
+            if flags & Nodeflag.SKIN:
+                self.read_skin(offset + 0x270, vert_cnt, records)
+            elif flags & Nodeflag.DANGLY:
+                self.read_dangly(offset + 0x270, records)
+            elif flags & Nodeflag.ANIM:
+                self.read_animmesh(offset + 0x270, records)
+        records.append((Recordtype.ENDNODE, ['endnode'], []))
+        return node_name
+
+    def read_controllers(self, offset, controller_names, records, is_anim):
+        """Decode controller keys and data of a node."""
+        keys_offset, keys_cnt = self.array_def(offset + 0x54)
+        data_offset, data_cnt = self.array_def(offset + 0x60)
+        if not keys_cnt:
+            return
+        data = self.array(data_offset, '<f4', data_cnt)
+        for i in range(keys_cnt):
+            ctrl_type, rows, key_idx, data_idx, columns = \
+                self.unpack(controller_key.format,
+                            keys_offset + controller_key.size * i)
+            if ctrl_type in controllers_node:
+                name = controllers_node[ctrl_type]
+            elif ctrl_type in controller_names:
+                name = controller_names[ctrl_type]
+            else:
+                continue
+            # Bezier keys have value, in- and out-tangent, use values only
+            bezier = columns & 0x10
+            columns = columns & 0x0F
+            stride = 3 * columns if bezier else columns
+            values = data[data_idx:data_idx + rows * stride]
+            values = values.reshape(rows, stride)[:, :columns]
+            if name == 'orientation':
+                values = nvb_rotation.quat_to_axisangle(
+                    quat_from_mdl(values))
+            if is_anim:
+                times = data[key_idx:key_idx + rows].reshape(rows, 1)
+                records.append((Recordtype.LINE, [name + 'key', str(rows)],
+                                np.hstack((times, values))))
+            elif rows:
+                records.append((Recordtype.LINE,
+                                [name] + float_tokens(values[0]), []))
+
+    def read_light(self, offset, records):
+        """Decode the light header."""
+        flareradius, = self.unpack('<f', offset)
+        sizes_offset, sizes_cnt = self.array_def(offset + 0x10)
+        pos_offset, pos_cnt = self.array_def(offset + 0x1C)
+        shifts_offset, shifts_cnt = self.array_def(offset + 0x28)
+        tex_offset, tex_cnt = self.array_def(offset + 0x34)
+        lightpriority, ambientonly, ndynamictype, affectdynamic, shadow, \
+            lensflares, fadinglight = self.unpack('<7I', offset + 0x40)
+
+        values = [('lightpriority', lightpriority),
+                  ('ambientonly', ambientonly),
+                  ('ndynamictype', ndynamictype),
+                  ('affectdynamic', affectdynamic),
+                  ('shadow', shadow),
+                  ('lensflares', lensflares),
+                  ('fadinglight', fadinglight)]
+        records.extend([(Recordtype.LINE, [label, str(v)], [])
+                        for label, v in values])
+        records.append((Recordtype.LINE,
+                        ['flareradius', str(flareradius)], []))
+        if tex_cnt:
+            tex_offsets = self.array(tex_offset, '<u4', tex_cnt)
+            records.append((Recordtype.LINE, ['texturenames'], []))
+            records.extend([(Recordtype.LINE, [self.string(o, 64)], [])
+                            for o in tex_offsets.tolist()])
+        if sizes_cnt:
+            records.append((Recordtype.LINE, ['flaresizes'],
+                            self.array(sizes_offset, '<f4', sizes_cnt, 1)))
+        if pos_cnt:
+            records.append((Recordtype.LINE, ['flarepositions'],
+                            self.array(pos_offset, '<f4', pos_cnt, 1)))
+        if shifts_cnt:
+            records.append((Recordtype.LINE, ['flarecolorshifts'],
+                            self.array(shifts_offset, '<f4', shifts_cnt, 3)))
+
+    def read_emitter(self, offset, records):
+        """Decode the emitter header."""
+        deadspace, blastradius, blastlength = self.unpack('<3f', offset)
+        xgrid, ygrid, spawntype = self.unpack('<2Ii', offset + 0x0C)
+        update = self.string(offset + 0x18, 32)
+        render = self.string(offset + 0x38, 32)
+        blend = self.string(offset + 0x58, 32)
+        texture = self.string(offset + 0x78, 64) or nvb_def.null
+        chunkname = self.string(offset + 0xB8, 16) or nvb_def.null
+        twosidedtex, loop, renderorder = self.unpack('<IIH', offset + 0xC8)
+        flags, = self.unpack('<I', offset + 0xD4)
+
+        values = [('deadspace', str(deadspace)),
+                  ('blastradius', str(blastradius)),
+                  ('blastlength', str(blastlength)),
+                  ('xgrid', str(xgrid)),
+                  ('ygrid', str(ygrid)),
+                  ('spawntype', str(spawntype)),
+                  ('update', update),
+                  ('render', render),
+                  ('blend', blend),
+                  ('texture', texture),
+                  ('chunkname', chunkname),
+                  ('twosidedtex', str(twosidedtex)),
+                  ('loop', str(loop)),
+                  ('renderorder', str(renderorder)),
+                  ('p2p_sel', '1' if flags & emitter_flag_bezier else '2')]
+        values.extend([(label, str(int(bool(flags & flag))))
+                       for flag, label in emitter_flags])
+        records.extend([(Recordtype.LINE, [label, v], [])
+                        for label, v in values])
+
+    def read_reference(self, offset, records):
+        """Decode the reference header."""
+        refmodel = self.string(offset, 64) or nvb_def.null
+        reattachable, = self.unpack('<I', offset + 0x40)
+        records.append((Recordtype.LINE, ['refmodel', refmodel], []))
+        records.append((Recordtype.LINE,
+                        ['reattachable', str(reattachable)], []))
+
+    def read_mesh(self, offset, records):
+        """Decode the mesh header, return the number of vertices."""
+        faces_offset, faces_cnt = self.array_def(offset + 0x08)
+        ambient = self.unpack('<3f', offset + 0x48)
+        diffuse = self.unpack('<3f', offset + 0x3C)
+        specular = self.unpack('<3f', offset + 0x54)
+        shininess, shadow, beaming, render, transparencyhint = \
+            self.unpack('<f4I', offset + 0x60)
+        textures = [self.string(offset + 0x78 + 64 * i, 64)
+                    for i in range(4)]
+        tilefade, = self.unpack('<I', offset + 0x178)
+        verts_offset, vert_cnt, tex_cnt = self.unpack('<IHH', offset + 0x1BC)
+        tverts_offsets = self.unpack('<4I', offset + 0x1C4)
+        normals_offset, colors_offset = self.unpack('<II', offset + 0x1D4)
+        rotatetexture, = self.unpack('<B', offset + 0x1F5)
+
+        values = [('ambient', float_tokens(ambient)),
+                  ('diffuse', float_tokens(diffuse)),
+                  ('specular', float_tokens(specular)),
+                  ('shininess', [str(int(shininess))]),
+                  ('shadow', [str(shadow)]),
+                  ('beaming', [str(beaming)]),
+                  ('render', [str(render)]),
+                  ('transparencyhint', [str(transparencyhint)]),
+                  ('tilefade', [str(tilefade)]),
+                  ('rotatetexture', [str(rotatetexture)]),
+                  ('bitmap', [textures[0] or nvb_def.null])]
+        values.extend([('texture' + str(i), [tex])
+                       for i, tex in enumerate(textures[1:], 1) if tex])
+        records.extend([(Recordtype.LINE, [label, *v], [])
+                        for label, v in values])
+        # Vertex data (tverts share the vertex indices)
+        verts = self.raw_array(verts_offset, '<f4', vert_cnt, 3)
+        if verts is not None:
+            records.append((Recordtype.LINE, ['verts', str(vert_cnt)],
+                            verts))
+        for i, tverts_offset in enumerate(tverts_offsets[:tex_cnt]):
+            tverts = self.raw_array(tverts_offset, '<f4', vert_cnt, 2)
+            if tverts is not None:
+                label = 'tverts' + (str(i) if i else '')
+                records.append((Recordtype.LINE, [label, str(vert_cnt)],
+                                tverts))
+        normals = self.raw_array(normals_offset, '<f4', vert_cnt, 3)
+        if normals is not None:
+            records.append((Recordtype.LINE, ['normals', str(vert_cnt)],
+                            normals))
+        colors = self.raw_array(colors_offset, '<u1', vert_cnt, 4)
+        if colors is not None:
+            records.append((Recordtype.LINE, ['colors', str(vert_cnt)],
+                            colors[:, :3] / np.float32(255.0)))
+        # Faces: smoothgroup 1, normals are stored per vertex
+        if faces_cnt:
+            faces = np.frombuffer(self.buf, dtype=face_dtype,
+                                  count=faces_cnt,
+                                  offset=self.model_offset + faces_offset)
+            facedef = np.ones((faces_cnt, 8), dtype=np.int32)
+            facedef[:, 0:3] = faces['vertices']
+            facedef[:, 4:7] = faces['vertices']
+            facedef[:, 7] = faces['surface']
+            records.append((Recordtype.LINE, ['faces', str(faces_cnt)],
+                            facedef))
+        return vert_cnt
+
+    def read_skin(self, offset, vert_cnt, records):
+        """Decode the skin header."""
+        weights_offset, bones_offset, map_offset, map_cnt = \
+            self.unpack('<4I', offset + 0x0C)
+        weights = self.raw_array(weights_offset, '<f4', vert_cnt, 4)
+        bones = self.raw_array(bones_offset, '<i2', vert_cnt, 4)
+        if weights is None or bones is None:
+            return
+        # Bone index => part number => node name
+        node_to_bone = self.array(map_offset, '<i2', map_cnt)
+        bone_names = {b: self.part_names.get(p, nvb_def.null)
+                      for p, b in enumerate(node_to_bone.tolist()) if b >= 0}
+        # One row of bone names and weights per vertex, instead of a
+        # record per vertex as in ascii mdls (rows may be empty)
+        rows = []
+        for vert_bones, vert_weights in zip(bones.tolist(), weights.tolist()):
+            tokens = []
+            for b, w in zip(vert_bones, vert_weights):
+                if b >= 0 and w > 0.0:
+                    tokens.extend([bone_names.get(b, nvb_def.null), str(w)])
+            rows.append(tokens)
+        records.append((Recordtype.LINE, ['weights', str(vert_cnt)], rows))
+
+    def read_dangly(self, offset, records):
+        """Decode the danglymesh header."""
+        constraints_offset, constraints_cnt = self.array_def(offset)
+        displacement, tightness, period = self.unpack('<3f', offset + 0x0C)
+        records.append((Recordtype.LINE,
+                        ['displacement', str(displacement)], []))
+        records.append((Recordtype.LINE, ['tightness', str(tightness)], []))
+        records.append((Recordtype.LINE, ['period', str(period)], []))
+        if constraints_cnt:
+            records.append((Recordtype.LINE,
+                            ['constraints', str(constraints_cnt)],
+                            self.array(constraints_offset, '<f4',
+                                       constraints_cnt, 1)))
+
+    def read_animmesh(self, offset, records):
+        """Decode the animmesh header."""
+        sampleperiod, = self.unpack('<f', offset)
+        animverts_offset, animverts_cnt = self.array_def(offset + 0x04)
+        animtverts_offset, animtverts_cnt = self.array_def(offset + 0x10)
+        records.append((Recordtype.LINE,
+                        ['sampleperiod', str(sampleperiod)], []))
+        if animverts_cnt:
+            records.append((Recordtype.LINE,
+                            ['animverts', str(animverts_cnt)],
+                            self.array(animverts_offset, '<f4',
+                                       animverts_cnt, 3)))
+        if animtverts_cnt:
+            animtverts = self.array(animtverts_offset, '<f4',
+                                    animtverts_cnt, 3)
+            records.append((Recordtype.LINE,
+                            ['animtverts', str(animtverts_cnt)],
+                            animtverts[:, :2]))
+
+
+def read_file(mdl_filepath, read_func):
+    """Map a compiled mdl file and decode it with read_func(reader)."""
+    with open(os.fsencode(mdl_filepath), 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            try:
+                return read_func(Reader(mm))
+            except (struct.error, ValueError, IndexError) as e:
+                raise nvb_def.MalformedMdlFile(
+                    'Unable to read binary MDL: ' + str(e))
+
+
+def read_records(mdl_filepath, anims=True):
+    """Decode a compiled mdl file, return a list of records."""
+    return read_file(mdl_filepath, lambda r: r.read_records(anims))
+
+
+def read_anim_offsets(mdl_filepath):
+    """Return the offsets of all animations in a compiled mdl file."""
+    return read_file(mdl_filepath, lambda r: r.read_anim_offsets())
+
+
+def read_anim_records(mdl_filepath, offset, nodes=True):
+    """Decode a single animation of a compiled mdl, return its records."""
+    def read_func(reader):
+        records = []
+        reader.read_animation(offset, reader.string(0x08, 64), records,
+                              nodes)
+        return records
+    return read_file(mdl_filepath, read_func)
+
+
+def is_supported(mdl_filepath):
+    """Check if a compiled mdl can be read (header and node types only)."""
+    try:
+        with open(os.fsencode(mdl_filepath), 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                Reader(mm).check()
+    except (nvb_def.MalformedMdlFile, struct.error, ValueError, IndexError,
+            OSError):
+        return False
+    return True
+
+
+class Buffer():
+    """Growable byte buffer, offsets are relative to its start."""
+
+    def __init__(self):
+        """TODO: DOC."""
+        self.data = bytearray()
+
+    def alloc(self, size):
+        """Append size zero bytes (4 byte aligned), return their offset."""
+        self.data.extend(bytes(-len(self.data) % 4))
+        offset = len(self.data)
+        self.data.extend(bytes(size))
+        return offset
+
+    def append(self, data):
+        """Append bytes (4 byte aligned), return their offset."""
+        self.data.extend(bytes(-len(self.data) % 4))
+        offset = len(self.data)
+        self.data.extend(data)
+        return offset
+
+    def pack(self, fmt, offset, *values):
+        """Write values at offset."""
+        struct.pack_into(fmt, self.data, offset, *values)
+
+    def string(self, offset, value, size):
+        """Write a null terminated string of fixed size."""
+        data = value.encode('latin-1', 'replace')[:size - 1]
+        self.data[offset:offset + len(data)] = data
+
+
+class Writer():
+    """Encodes ascii mdl records into a compiled mdl."""
+
+    # Size of the node structures
+    node_sizes = {0x001: 0x70, 0x003: 0xCC, 0x005: 0x148, 0x011: 0xB4,
+                  0x021: 0x270, 0x061: 0x2D4, 0x0A1: 0x2A8, 0x121: 0x28C,
+                  0x221: 0x274}
+    node_flags = {nvb_def.Nodetype.DUMMY: 0x001,
+                  nvb_def.Nodetype.PATCH: 0x001,
+                  nvb_def.Nodetype.LIGHT: 0x003,
+                  nvb_def.Nodetype.EMITTER: 0x005,
+                  nvb_def.Nodetype.REFERENCE: 0x011,
+                  nvb_def.Nodetype.TRIMESH: 0x021,
+                  nvb_def.Nodetype.SKIN: 0x061,
+                  nvb_def.Nodetype.ANIMMESH: 0x0A1,
+                  nvb_def.Nodetype.DANGLYMESH: 0x121,
+                  nvb_def.Nodetype.AABB: 0x221}
+    # Maximum number of bones per vertex
+    max_vertex_bones = 4
+
+    def __init__(self):
+        """TODO: DOC."""
+        self.model = Buffer()
+        self.raw = Buffer()
+        self.part_numbers = dict()  # Node name => part number
+        self.transforms = dict()  # Node name => (world position, rotation)
+        self.vertex_maps = dict()  # Mesh name => (vertex ids, tvert ids)
+
+    @staticmethod
+    def read_block(record, itrecords):
+        """Collect the records of a node, return a dict."""
+        tokens = record[1]
+        node = {'type': tokens[1].lower(),
+                'name': tokens[2] if len(tokens) > 2 else nvb_def.null,
+                'parent': nvb_def.null,
+                'props': dict(),
+                'weights': [],
+                'texturenames': []}
+        for rtype, tokens, rows in itrecords:
+            if rtype == Recordtype.ENDNODE:
+                break
+            label = tokens[0].lower()
+            if label == 'parent':
+                node['parent'] = tokens[1]
+            elif label == 'weights':
+                # Each line is a separate record (starts with a bone name),
+                # unless decoded from a compiled mdl
+                cnt = nvb_parse.ascii_int(tokens[1])
+                if rows:
+                    node['weights'] = rows[:cnt]
+                else:
+                    node['weights'] = [next(itrecords)[1]
+                                       for _ in range(cnt)]
+            elif label == 'texturenames':
+                cnt = nvb_parse.ascii_int(tokens[1]) if len(tokens) > 1 else 0
+                node['texturenames'] = [next(itrecords)[1][0]
+                                        for _ in range(cnt)]
+            elif label not in node['props']:
+                node['props'][label] = (tokens, rows)
+        return node
+
+    def write_records(self, records):
+        """Encode the records, return the compiled mdl as bytes."""
+        header = {'newmodel': 'unnamed',
+                  'setsupermodel': nvb_def.null,
+                  'classification': nvb_def.Classification.UNKNOWN,
+                  'setanimationscale': '1.0'}
+        geom_nodes = []
+        anims = []
+        anim = None
+        itrecords = iter(records)
+        for record in itrecords:
+            rtype, tokens, rows = record
+            label = tokens[0].lower()
+            if rtype == Recordtype.NODE:
+                node = Writer.read_block(record, itrecords)
+                if anim:
+                    anim['nodes'].append(node)
+                else:
+                    geom_nodes.append(node)
+            elif rtype == Recordtype.NEWANIM:
+                anim = {'name': tokens[1], 'length': 1.0, 'transtime': 0.25,
+                        'animroot': nvb_def.null, 'events': [], 'nodes': []}
+                anims.append(anim)
+            elif rtype == Recordtype.DONEANIM:
+                anim = None
+            elif anim:
+                if label in ['length', 'transtime']:
+                    anim[label] = nvb_parse.ascii_float(tokens[1])
+                elif label == 'animroot':
+                    anim['animroot'] = tokens[1]
+                elif label == 'event':
+                    anim['events'].append(
+                        (nvb_parse.ascii_float(tokens[1]), tokens[2]))
+            elif label in header and len(tokens) > 1:
+                header[label] = tokens[-1]
+
+        model_name = header['newmodel']
+        classification = {v: k for k, v in classifications.items()}.get(
+            header['classification'].lower(), 0)
+        supermodel = header['setsupermodel']
+        if supermodel.lower() == nvb_def.null:
+            supermodel = ''
+        # Geometry header + model header
+        self.model.alloc(0xE8)
+        self.model.string(0x08, model_name, 64)
+        self.model.pack('<B', 0x6C, 2)
+        self.model.pack('<BB', 0x72, classification, 1)
+        self.model.pack('<f', 0xA4,
+                        nvb_parse.ascii_float(header['setanimationscale']))
+        self.model.string(0xA8, supermodel, 64)
+        self.part_numbers = {n['name'].lower(): i
+                             for i, n in enumerate(geom_nodes)}
+        self.calc_transforms(geom_nodes)
+        root_offset = self.write_node_tree(geom_nodes, 0, False)
+        self.model.pack('<II', 0x48, root_offset, len(geom_nodes))
+        self.write_bounds(geom_nodes)
+        # Animations
+        if anims:
+            anim_offsets = [self.write_animation(a) for a in anims]
+            arr_offset = self.model.append(
+                np.array(anim_offsets, dtype='<u4').tobytes())
+            self.model.pack(array_def.format, 0x78,
+                            arr_offset, len(anims), len(anims))
+        return file_header.pack(0, len(self.model.data),
+                                len(self.raw.data)) + \
+            bytes(self.model.data) + bytes(self.raw.data)
+
+    def calc_transforms(self, nodes):
+        """Calculate world space position and rotation of all nodes."""
+        for node in nodes:  # Parents come before their children
+            props = node['props']
+            position = (0.0, 0.0, 0.0)
+            if 'position' in props:
+                position = [nvb_parse.ascii_float(v)
+                            for v in props['position'][0][1:4]]
+            rotation = identity_quat
+            if 'orientation' in props:
+                rotation = nvb_rotation.axisangle_to_quat(
+                    [nvb_parse.ascii_float(v)
+                     for v in props['orientation'][0][1:5]])[0]
+            parent = node['parent'].lower()
+            if parent in self.transforms:
+                parent_pos, parent_rot = self.transforms[parent]
+                position = np.add(parent_pos, nvb_rotation.quat_rotate(
+                    parent_rot, position)[0])
+                rotation = nvb_rotation.quat_mul(parent_rot, rotation)[0]
+            self.transforms[node['name'].lower()] = \
+                (tuple(position), rotation)
+
+    def write_bounds(self, nodes):
+        """Write the bounding box and radius to the model header."""
+        coords = []
+        for node in nodes:
+            if 'verts' not in node['props']:
+                continue
+            tokens, rows = node['props']['verts']
+            verts = nvb_parse.ascii_array(
+                rows, nvb_parse.ascii_int(tokens[1]), 3)
+            position, rotation = self.transforms[node['name'].lower()]
+            # Rotate all vertices at once with the rotation matrix
+            rot_mat = nvb_rotation.quat_to_matrix(rotation)[0]
+            coords.append(verts @ rot_mat.T + position)
+        if not coords:
+            return
+        coords = np.concatenate(coords)
+        bb_min = coords.min(axis=0)
+        bb_max = coords.max(axis=0)
+        self.model.pack('<3f3ff', 0x88, *bb_min, *bb_max,
+                        float(np.linalg.norm(bb_max - bb_min) / 2.0))
+
+    def write_animation(self, anim):
+        """Write an animation, return its offset."""
+        offset = self.model.alloc(0xC4)
+        self.model.string(offset + 0x08, anim['name'], 64)
+        self.model.pack('<B', offset + 0x6C, 5)
+        self.model.pack('<ff', offset + 0x70,
+                        anim['length'], anim['transtime'])
+        self.model.string(offset + 0x78, anim['animroot'], 64)
+        events = anim['events']
+        if events:
+            ev_offset = self.model.alloc(36 * len(events))
+            for i, (ev_time, ev_name) in enumerate(events):
+                self.model.pack('<f', ev_offset + 36 * i, ev_time)
+                self.model.string(ev_offset + 36 * i + 4, ev_name, 32)
+            self.model.pack(array_def.format, offset + 0xB8,
+                            ev_offset, len(events), len(events))
+        root_offset = self.write_node_tree(anim['nodes'], offset, True)
+        self.model.pack('<II', offset + 0x48, root_offset, len(anim['nodes']))
+        return offset
+
+    def write_node_tree(self, nodes, geom_offset, is_anim):
+        """Write all nodes of a geometry, return the root node offset."""
+        if not nodes:
+            return 0
+        flags = [Writer.node_flags.get(n['type'], 0x001) for n in nodes]
+        offsets = []
+        for node, node_flags in zip(nodes, flags):
+            # Animation nodes only need the header (and animmesh data)
+            if is_anim and not node_flags & Nodeflag.ANIM:
+                size = Writer.node_sizes[0x001]
+            else:
+                size = Writer.node_sizes[node_flags]
+            offsets.append(self.model.alloc(size))
+        node_offsets = {n['name'].lower(): o for n, o in zip(nodes, offsets)}
+        children = {o: [] for o in offsets}
+        for node, offset in zip(nodes, offsets):
+            parent = node['parent'].lower()
+            if parent in node_offsets:
+                children[node_offsets[parent]].append(offset)
+        for node, node_flags, offset in zip(nodes, flags, offsets):
+            parent_offset = node_offsets.get(node['parent'].lower(), 0)
+            self.write_node(node, node_flags, offset, geom_offset,
+                            parent_offset, children[offset], is_anim)
+        return offsets[0]
+
+    def write_node(self, node, flags, offset, geom_offset, parent_offset,
+                   children, is_anim):
+        """Write a single node."""
+        props = node['props']
+        name = node['name']
+        inheritcolor = 0
+        if 'inheritcolor' in props:
+            inheritcolor = nvb_parse.ascii_int(props['inheritcolor'][0][1])
+        self.model.pack('<II', offset + 0x18, inheritcolor,
+                        self.part_numbers.get(name.lower(), 0))
+        self.model.string(offset + 0x20, name, 32)
+        self.model.pack('<II', offset + 0x40, geom_offset, parent_offset)
+        if children:
+            children_offset = self.model.append(
+                np.array(children, dtype='<u4').tobytes())
+            self.model.pack(array_def.format, offset + 0x48,
+                            children_offset, len(children), len(children))
+        self.model.pack('<I', offset + 0x6C, flags)
+        # Controllers
+        if flags & Nodeflag.EMITTER:
+            controller_names = controllers_emitter
+        elif flags & Nodeflag.LIGHT:
+            controller_names = controllers_light
+        elif flags & Nodeflag.MESH:
+            controller_names = controllers_mesh
+        else:
+            controller_names = dict()
+        self.write_controllers(offset, props, controller_names)
+        # Type specific data
+        if is_anim:
+            if flags & Nodeflag.ANIM:
+                self.write_animmesh(offset + 0x270, node)
+        elif flags & Nodeflag.LIGHT:
+            self.write_light(offset + 0x70, node)
+        elif flags & Nodeflag.EMITTER:
+            self.write_emitter(offset + 0x70, props)
+        elif flags & Nodeflag.REFERENCE:
+            self.write_reference(offset + 0x70, props)
+        elif flags & Nodeflag.MESH:
+            vert_ids = self.write_mesh(offset + 0x70, node)
+            if flags & Nodeflag.SKIN:
+                self.write_skin(offset + 0x270, node, vert_ids)
+            elif flags & Nodeflag.DANGLY:
+                self.write_dangly(offset + 0x270, props, vert_ids)
+            elif flags & Nodeflag.ANIM:
+                self.write_animmesh(offset + 0x270, node)
+            elif flags & Nodeflag.AABB:
+                self.write_aabb(offset + 0x270, props)
+
+    def write_controllers(self, offset, props, controller_names):
+        """Write controller keys and data of a node."""
+        controller_ids = {v: k for k, v in controllers_node.items()}
+        controller_ids.update({v: k for k, v in controller_names.items()})
+        keys = []
+        data = []
+        for label, (tokens, rows) in props.items():
+            if label.endswith('key') and label[:-3] in controller_ids:
+                if not len(rows):
+                    continue
+                # Keys: Time + values per row
+                cnt = len(rows)
+                if len(tokens) > 1:
+                    cnt = min(cnt, nvb_parse.ascii_int(tokens[1]))
+                values = nvb_parse.ascii_array(rows, cnt, len(rows[0]))
+                times = values[:, 0]
+                values = values[:, 1:]
+                label = label[:-3]
+            elif label in controller_ids:
+                # Single value, time 0
+                values = np.array([[nvb_parse.ascii_float(v)
+                                    for v in tokens[1:]]], dtype=np.float32)
+                times = np.zeros(1, dtype=np.float32)
+            else:
+                continue
+            if label == 'orientation':
+                values = quat_to_mdl(
+                    nvb_rotation.axisangle_to_quat(values[:, :4]))
+            key_idx = len(data)
+            data.extend(times.tolist())
+            data_idx = len(data)
+            data.extend(values.ravel().tolist())
+            keys.append(controller_key.pack(controller_ids[label],
+                                            len(values), key_idx, data_idx,
+                                            values.shape[1]))
+        if keys:
+            keys_offset = self.model.append(b''.join(keys))
+            data_offset = self.model.append(
+                np.array(data, dtype='<f4').tobytes())
+            self.model.pack(array_def.format, offset + 0x54,
+                            keys_offset, len(keys), len(keys))
+            self.model.pack(array_def.format, offset + 0x60,
+                            data_offset, len(data), len(data))
+
+    def write_float_array(self, values, dim):
+        """Write floats to the model data, return offset and row count."""
+        values = np.asarray(values, dtype='<f4').reshape(-1, dim)
+        return self.model.append(values.tobytes()), len(values)
+
+    def write_light(self, offset, node):
+        """Write the light header."""
+        props = node['props']
+
+        def get_int(label):
+            if label in props:
+                return nvb_parse.ascii_int(props[label][0][1])
+            return 0
+
+        def get_rows(label, dim):
+            if label in props:
+                tokens, rows = props[label]
+                return nvb_parse.ascii_array(rows, len(rows), dim)
+            return np.zeros((0, dim), dtype=np.float32)
+
+        flareradius = 0.0
+        if 'flareradius' in props:
+            flareradius = nvb_parse.ascii_float(props['flareradius'][0][1])
+        self.model.pack('<f', offset, flareradius)
+        flare_arrays = [(0x10, get_rows('flaresizes', 1), 1),
+                        (0x1C, get_rows('flarepositions', 1), 1),
+                        (0x28, get_rows('flarecolorshifts', 3), 3)]
+        for arr_def, values, dim in flare_arrays:
+            if len(values):
+                arr_offset, cnt = self.write_float_array(values, dim)
+                self.model.pack(array_def.format, offset + arr_def,
+                                arr_offset, cnt, cnt)
+        if node['texturenames']:
+            tex_offsets = []
+            for tex in node['texturenames']:
+                tex_offset = self.model.alloc(64)
+                self.model.string(tex_offset, tex, 64)
+                tex_offsets.append(tex_offset)
+            arr_offset = self.model.append(
+                np.array(tex_offsets, dtype='<u4').tobytes())
+            self.model.pack(array_def.format, offset + 0x34, arr_offset,
+                            len(tex_offsets), len(tex_offsets))
+        self.model.pack('<7I', offset + 0x40,
+                        get_int('lightpriority'), get_int('ambientonly'),
+                        get_int('ndynamictype'), get_int('affectdynamic'),
+                        get_int('shadow'), get_int('lensflares'),
+                        get_int('fadinglight'))
+
+    def write_emitter(self, offset, props):
+        """Write the emitter header."""
+        def get_value(label, default):
+            if label in props:
+                return props[label][0][1]
+            return default
+
+        def get_float(label):
+            return nvb_parse.ascii_float(get_value(label, '0.0'))
+
+        def get_int(label):
+            return nvb_parse.ascii_int(get_value(label, '0'))
+
+        self.model.pack('<3f', offset, get_float('deadspace'),
+                        get_float('blastradius'), get_float('blastlength'))
+        self.model.pack('<2Ii', offset + 0x0C, get_int('xgrid'),
+                        get_int('ygrid'), get_int('spawntype'))
+        self.model.string(offset + 0x18, get_value('update', 'Fountain'), 32)
+        self.model.string(offset + 0x38, get_value('render', 'Normal'), 32)
+        self.model.string(offset + 0x58, get_value('blend', 'Normal'), 32)
+        texture = get_value('texture', nvb_def.null)
+        if texture.lower() != nvb_def.null:
+            self.model.string(offset + 0x78, texture, 64)
+        chunkname = get_value('chunkname', nvb_def.null)
+        if chunkname.lower() != nvb_def.null:
+            self.model.string(offset + 0xB8, chunkname, 16)
+        self.model.pack('<IIH', offset + 0xC8, get_int('twosidedtex'),
+                        get_int('loop'), get_int('renderorder'))
+        flags = 0
+        for flag, label in emitter_flags:
+            if get_int(label):
+                flags |= flag
+        if get_value('p2p_sel', '2') == '1':
+            flags |= emitter_flag_bezier
+        self.model.pack('<I', offset + 0xD4, flags)
+
+    def write_reference(self, offset, props):
+        """Write the reference header."""
+        if 'refmodel' in props:
+            refmodel = props['refmodel'][0][1]
+            if refmodel.lower() != nvb_def.null:
+                self.model.string(offset, refmodel, 64)
+        if 'reattachable' in props:
+            self.model.pack('<I', offset + 0x40, nvb_parse.ascii_int(
+                props['reattachable'][0][1]))
+
+    @staticmethod
+    def calc_adjacent_faces(faces):
+        """Find the neighbouring face across each edge (-1 if there is none).
+
+        Edges are matched by sorting them, only the first two faces sharing
+        an edge are considered adjacent.
+        """
+        face_cnt = len(faces)
+        edges = np.stack((faces, np.roll(faces, -1, axis=1)), axis=2)
+        edges = np.sort(edges.reshape(-1, 2), axis=1).astype(np.int64)
+        edge_keys = edges[:, 0] * (int(faces.max()) + 1) + edges[:, 1]
+        order = np.argsort(edge_keys, kind='stable')
+        sorted_keys = edge_keys[order]
+        adjacent = np.full(face_cnt * 3, -1, dtype=np.int16)
+        pairs = np.flatnonzero(sorted_keys[1:] == sorted_keys[:-1])
+        # Skip the third face of non-manifold edges
+        if len(pairs) > 1:
+            pairs = pairs[np.insert(pairs[1:] != pairs[:-1] + 1, 0, True)]
+        adjacent[order[pairs]] = order[pairs + 1] // 3
+        adjacent[order[pairs + 1]] = order[pairs] // 3
+        return adjacent.reshape(face_cnt, 3)
+
+    def write_mesh(self, offset, node):
+        """Write the mesh header, return the original id of each vertex.
+
+        Compiled meshes have a single index per face corner, vertices are
+        split where uv coordinates or smoothgroups differ.
+        """
+        props = node['props']
+
+        def get_block(label, dim, dtype=np.float32):
+            if label in props:
+                tokens, rows = props[label]
+                cnt = nvb_parse.ascii_int(tokens[1]) if len(tokens) > 1 \
+                    else len(rows)
+                return nvb_parse.ascii_array(rows, cnt, dim, dtype)
+            return np.zeros((0, dim), dtype=dtype)
+
+        def get_floats(label, default):
+            if label in props:
+                return [nvb_parse.ascii_float(v) for v in props[label][0][1:]]
+            return default
+
+        def get_int(label, default):
+            if label in props:
+                return nvb_parse.ascii_int(props[label][0][1])
+            return default
+
+        # Material
+        self.model.pack('<3f3f3f', offset + 0x3C,
+                        *get_floats('diffuse', [1.0] * 3)[:3],
+                        *get_floats('ambient', [1.0] * 3)[:3],
+                        *get_floats('specular', [0.0] * 3)[:3])
+        self.model.pack('<f4I', offset + 0x60,
+                        get_int('shininess', 1), get_int('shadow', 1),
+                        get_int('beaming', 0), get_int('render', 1),
+                        get_int('transparencyhint', 0))
+        for i, labels in enumerate([('bitmap', 'texture0'), ('texture1',),
+                                    ('texture2',), ('texture3',)]):
+            for label in labels:
+                if label in props:
+                    texture = props[label][0][1]
+                    if texture.lower() != nvb_def.null:
+                        self.model.string(offset + 0x78 + 64 * i,
+                                          texture, 64)
+                    break
+        self.model.pack('<I', offset + 0x178, get_int('tilefade', 0))
+        self.model.pack('<B', offset + 0x1F5, get_int('rotatetexture', 0))
+        # Unused raw data
+        self.model.pack('<4I', offset + 0x1C4, *[raw_null] * 4)
+        self.model.pack('<8I', offset + 0x1D4, *[raw_null] * 8)
+
+        verts = get_block('verts', 3)
+        facedef = get_block('faces', 8, np.int32)
+        if not len(verts) or not len(facedef):
+            return np.zeros(0, dtype=np.int32)
+        tverts = [get_block(label, 2) for label in
+                  ['tverts', 'tverts1', 'tverts2', 'tverts3']]
+        tverts = [tv for tv in tverts if len(tv)]
+        normals = get_block('normals', 3)
+        colors = get_block('colors', 3)
+        # One key per face corner: (vertex, smoothgroup, tvert)
+        corner_keys = np.zeros((len(facedef) * 3, 3), dtype=np.int64)
+        corner_keys[:, 0] = facedef[:, 0:3].ravel()
+        if not len(normals):
+            corner_keys[:, 1] = np.repeat(facedef[:, 3], 3)
+        if tverts:
+            corner_keys[:, 2] = facedef[:, 4:7].ravel()
+        corner_keys = np.clip(corner_keys, 0, None)
+        vert_keys, corner_vert_ids = np.unique(corner_keys, axis=0,
+                                               return_inverse=True)
+        corner_vert_ids = corner_vert_ids.ravel()
+        vert_ids = vert_keys[:, 0]
+        tvert_ids = vert_keys[:, 2]
+        self.vertex_maps[node['name'].lower()] = \
+            ((vert_ids, len(verts)),
+             (tvert_ids, len(tverts[0]) if tverts else 0))
+        faces = corner_vert_ids.reshape(-1, 3)
+        if len(vert_keys) > 0xFFFF:
+            raise nvb_def.MalformedMdlFile(
+                'Too many vertices in ' + node['name'])
+        face_verts = verts[facedef[:, 0:3]].astype(np.float64)
+        # Face planes
+        face_normals = np.cross(face_verts[:, 1] - face_verts[:, 0],
+                                face_verts[:, 2] - face_verts[:, 0])
+        if not len(normals):
+            # Area weighted, smoothed per vertex and smoothgroup
+            group_keys, corner_groups = np.unique(
+                corner_keys[:, :2], axis=0, return_inverse=True)
+            corner_groups = corner_groups.ravel()
+            group_normals = np.zeros((len(group_keys), 3))
+            np.add.at(group_normals, corner_groups,
+                      np.repeat(face_normals, 3, axis=0))
+            normals = np.zeros((len(vert_keys), 3))
+            normals[corner_vert_ids] = group_normals[corner_groups]
+        else:
+            normals = normals[np.clip(vert_ids, 0, len(normals) - 1)]
+        normals_len = np.linalg.norm(normals, axis=1)
+        normals_len[normals_len < 1.0e-12] = 1.0
+        normals = normals / normals_len[:, None]
+        face_len = np.linalg.norm(face_normals, axis=1)
+        face_len[face_len < 1.0e-12] = 1.0
+        face_normals /= face_len[:, None]
+
+        face_data = np.zeros(len(faces), dtype=face_dtype)
+        face_data['normal'] = face_normals
+        face_data['distance'] = -np.einsum('ij,ij->i', face_normals,
+                                           face_verts[:, 0])
+        face_data['surface'] = np.clip(facedef[:, 7], 0, None)
+        face_data['adjacent'] = Writer.calc_adjacent_faces(facedef[:, 0:3])
+        face_data['vertices'] = faces
+        faces_offset = self.model.append(face_data.tobytes())
+        self.model.pack(array_def.format, offset + 0x08,
+                        faces_offset, len(faces), len(faces))
+        # Bounding box, radius and average
+        mesh_verts = verts[vert_ids]
+        bb_min = mesh_verts.min(axis=0)
+        bb_max = mesh_verts.max(axis=0)
+        average = mesh_verts.mean(axis=0)
+        radius = np.linalg.norm(mesh_verts - average, axis=1).max()
+        self.model.pack('<3f3ff3f', offset + 0x14, *bb_min, *bb_max,
+                        float(radius), *average)
+        # Vertex indices for rendering (one list, count and raw offset)
+        indices_offset = self.raw.append(faces.astype('<u2').tobytes())
+        cnt_offset = self.model.append(
+            struct.pack('<I', faces.size))
+        idx_offset = self.model.append(struct.pack('<I', indices_offset))
+        self.model.pack(array_def.format, offset + 0x194, cnt_offset, 1, 1)
+        self.model.pack(array_def.format, offset + 0x1A0, idx_offset, 1, 1)
+        # Vertex data
+        self.model.pack('<IHH', offset + 0x1BC,
+                        self.raw.append(mesh_verts.astype('<f4').tobytes()),
+                        len(vert_keys), len(tverts))
+        for i, tv in enumerate(tverts):
+            tv = tv[np.clip(tvert_ids, 0, len(tv) - 1)]
+            self.model.pack('<I', offset + 0x1C4 + 4 * i,
+                            self.raw.append(tv.astype('<f4').tobytes()))
+        self.model.pack('<I', offset + 0x1D4,
+                        self.raw.append(normals.astype('<f4').tobytes()))
+        if len(colors):
+            colors = colors[np.clip(vert_ids, 0, len(colors) - 1)]
+            rgba = np.full((len(colors), 4), 255, dtype=np.uint8)
+            rgba[:, :3] = np.clip(np.round(colors * 255.0), 0, 255)
+            self.model.pack('<I', offset + 0x1D8,
+                            self.raw.append(rgba.tobytes()))
+        return vert_ids
+
+    def write_skin(self, offset, node, vert_ids):
+        """Write the skin header."""
+        vert_cnt = len(vert_ids)
+        if not vert_cnt or not node['weights']:
+            return
+        bone_names = []
+        bone_ids = dict()
+        vert_bones = np.full((len(node['weights']), Writer.max_vertex_bones),
+                             -1, dtype=np.int16)
+        vert_weights = np.zeros(vert_bones.shape, dtype=np.float32)
+        for i, tokens in enumerate(node['weights']):
+            # Pairs of bone name and weight
+            for j, (bone, w) in enumerate(zip(
+                    tokens[0:2*Writer.max_vertex_bones:2],
+                    tokens[1:2*Writer.max_vertex_bones:2])):
+                bone = bone.lower()
+                if bone not in bone_ids:
+                    bone_ids[bone] = len(bone_names)
+                    bone_names.append(bone)
+                vert_bones[i, j] = bone_ids[bone]
+                vert_weights[i, j] = nvb_parse.ascii_float(w)
+        idx = np.clip(vert_ids, 0, len(vert_bones) - 1)
+        self.model.pack('<II', offset + 0x0C,
+                        self.raw.append(vert_weights[idx].tobytes()),
+                        self.raw.append(vert_bones[idx].tobytes()))
+        # Part number => bone index
+        node_to_bone = np.full(len(self.part_numbers), -1, dtype='<i2')
+        for bone, bone_idx in bone_ids.items():
+            if bone in self.part_numbers:
+                node_to_bone[self.part_numbers[bone]] = bone_idx
+        self.model.pack('<II', offset + 0x14,
+                        self.model.append(node_to_bone.tobytes()),
+                        len(node_to_bone))
+        # Transformation from mesh space into bone space
+        mesh_pos, mesh_rot = self.transforms.get(
+            node['name'].lower(), ((0.0, 0.0, 0.0), identity_quat))
+        qbones = []
+        tbones = []
+        for bone in bone_names:
+            bone_pos, bone_rot = self.transforms.get(
+                bone, ((0.0, 0.0, 0.0), identity_quat))
+            inv_rot = nvb_rotation.quat_conjugate(bone_rot)
+            qbones.append(nvb_rotation.quat_mul(inv_rot, mesh_rot)[0])
+            tbones.append(nvb_rotation.quat_rotate(
+                inv_rot, np.subtract(mesh_pos, bone_pos))[0])
+        for arr_def, values, dim in [(0x1C, quat_to_mdl(qbones), 4),
+                                     (0x28, tbones, 3)]:
+            arr_offset, cnt = self.write_float_array(values, dim)
+            self.model.pack(array_def.format, offset + arr_def,
+                            arr_offset, cnt, cnt)
+        bone_parts = [self.part_numbers.get(b, -1) for b in bone_names[:17]]
+        bone_parts.extend([-1] * (17 - len(bone_parts)))
+        self.model.pack('<17h', offset + 0x40, *bone_parts)
+
+    def write_dangly(self, offset, props, vert_ids):
+        """Write the danglymesh header."""
+        for i, label in enumerate(['displacement', 'tightness', 'period']):
+            if label in props:
+                self.model.pack('<f', offset + 0x0C + 4 * i,
+                                nvb_parse.ascii_float(props[label][0][1]))
+        if 'constraints' in props and len(vert_ids):
+            tokens, rows = props['constraints']
+            constraints = nvb_parse.ascii_array(
+                rows, nvb_parse.ascii_int(tokens[1]), 1)[:, 0]
+            constraints = constraints[
+                np.clip(vert_ids, 0, len(constraints) - 1)]
+            arr_offset, cnt = self.write_float_array(constraints, 1)
+            self.model.pack(array_def.format, offset, arr_offset, cnt, cnt)
+        self.model.pack('<I', offset + 0x18, raw_null)
+
+    def write_aabb(self, offset, props):
+        """Write the aabb tree, it is stored in pre-order in ascii mdls."""
+        if 'aabb' not in props:
+            return
+        tokens, rows = props['aabb']
+        tree = np.vstack(([nvb_parse.ascii_float(v) for v in tokens[1:8]],
+                          nvb_parse.ascii_array(rows, len(rows), 7)))
+        node_cnt = len(tree)
+        face_ids = tree[:, 6].astype(np.int32)
+        # Subtree sizes, children always come after their parent
+        sizes = np.ones(node_cnt, dtype=np.int64)
+        for i in range(node_cnt - 1, -1, -1):
+            if face_ids[i] < 0 and i + 1 < node_cnt:
+                left_size = sizes[i + 1]
+                right = i + 1 + left_size
+                sizes[i] = 1 + left_size + \
+                    (sizes[right] if right < node_cnt else 0)
+        tree_offset = len(self.model.data) + (-len(self.model.data) % 4)
+        inner = np.flatnonzero(face_ids < 0)
+        inner = inner[inner + 1 < node_cnt]
+        right = inner + 1 + sizes[inner + 1]
+        inner, right = inner[right < node_cnt], right[right < node_cnt]
+        aabb_data = np.zeros(node_cnt, dtype=aabb_dtype)
+        aabb_data['min'] = tree[:, 0:3]
+        aabb_data['max'] = tree[:, 3:6]
+        aabb_data['face'] = face_ids
+        aabb_data['left'][inner] = tree_offset + aabb_dtype.itemsize * \
+            (inner + 1)
+        aabb_data['right'][inner] = tree_offset + aabb_dtype.itemsize * right
+        extents = tree[inner, 3:6] - tree[inner, 0:3]
+        aabb_data['plane'][inner] = 1 << np.argmax(extents, axis=1)
+        self.model.append(aabb_data.tobytes())
+        self.model.pack('<I', offset, tree_offset)
+
+    def write_animmesh(self, offset, node):
+        """Write the animmesh header.
+
+        Animated vertices are stored per sample for the original vertices,
+        they are reordered to match the split vertices of the mesh.
+        """
+        props = node['props']
+        if 'sampleperiod' in props:
+            self.model.pack('<f', offset, nvb_parse.ascii_float(
+                props['sampleperiod'][0][1]))
+        vertex_maps = self.vertex_maps.get(node['name'].lower(),
+                                           ((None, 0), (None, 0)))
+        set_cnts = [0, 0]
+        for i, (label, (vertex_ids, orig_cnt)) in enumerate(
+                zip(['animverts', 'animtverts'], vertex_maps)):
+            if label not in props:
+                continue
+            tokens, rows = props[label]
+            values = nvb_parse.ascii_array(
+                rows, nvb_parse.ascii_int(tokens[1]), 3)
+            if orig_cnt:
+                set_cnts[i] = len(values) // orig_cnt
+                values = values[:set_cnts[i] * orig_cnt].reshape(
+                    set_cnts[i], orig_cnt, 3)[:, vertex_ids]
+            arr_offset, cnt = self.write_float_array(values, 3)
+            self.model.pack(array_def.format, offset + 0x04 + 0x0C * i,
+                            arr_offset, cnt, cnt)
+        self.model.pack('<II', offset + 0x30, *set_cnts)
+
+
+def write_records(records):
+    """Encode ascii records into a compiled mdl, return it as bytes."""
+    return Writer().write_records(records)
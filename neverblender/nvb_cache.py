@@ -0,0 +1,132 @@
+"""Persistent on-disk cache for parsed mdl files."""
+
+import os
+import sys
+import pickle
+import hashlib
+import tempfile
+
+# Increase whenever the parser or the parsed classes change
+cache_version = 4
+cache_ext = '.nvbcache'
+
+
+def get_cache_dir():
+    """Return the directory for cached files in the users cache dir."""
+    if sys.platform == 'win32':
+        base_dir = os.environ.get('LOCALAPPDATA',
+                                  os.path.expanduser('~\\AppData\\Local'))
+    elif sys.platform == 'darwin':
+        base_dir = os.path.expanduser('~/Library/Caches')
+    else:
+        base_dir = os.environ.get('XDG_CACHE_HOME',
+                                  os.path.expanduser('~/.cache'))
+    return os.path.join(base_dir, 'neverblender')
+
+
+def get_key(filepaths, settings=()):
+    """Generate a key from path, mtime, size and content of the files.
+
+    Settings influencing the parse result have to be part of the key.
+    """
+    key_hash = hashlib.sha1()
+    key_hash.update(repr((cache_version, tuple(settings))).encode())
+    for filepath in filepaths:
+        filepath = os.path.abspath(filepath)
+        stat = os.stat(os.fsencode(filepath))
+        key_hash.update(repr((filepath, stat.st_mtime_ns,
+                              stat.st_size)).encode())
+        with open(os.fsencode(filepath), 'rb') as f:
+            key_hash.update(hashlib.sha1(f.read()).digest())
+    return key_hash.hexdigest()
+
+
+def contains(key):
+    """Whether there is a cached object for this key."""
+    return os.path.isfile(os.path.join(get_cache_dir(), key + cache_ext))
+
+
+def load(key):
+    """Return the cached object for this key or None."""
+    cache_path = os.path.join(get_cache_dir(), key + cache_ext)
+    try:
+        with open(cache_path, 'rb') as f:
+            obj = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        # Broken or outdated entry, get rid of it
+        print("Neverblender: WARNING - Removing invalid cache file " +
+              cache_path)
+        remove(cache_path)
+        return None
+    # Mark as recently used
+    try:
+        os.utime(cache_path)
+    except OSError:
+        pass
+    return obj
+
+
+def store(key, obj, max_size):
+    """Write an object to the cache, evict old entries above max_size."""
+    cache_dir = get_cache_dir()
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write to a temporary file first, other processes may be reading
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, os.path.join(cache_dir, key + cache_ext))
+        except Exception:
+            remove(tmp_path)
+            raise
+    except (OSError, pickle.PicklingError) as e:
+        print("Neverblender: WARNING - Unable to write cache: " + str(e))
+        return
+    evict(max_size)
+
+
+def evict(max_size):
+    """Delete least recently used entries until below max_size (bytes)."""
+    cache_dir = get_cache_dir()
+    entries = []
+    try:
+        with os.scandir(cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith(cache_ext):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+    except OSError:
+        return
+    total_size = sum(e[1] for e in entries)
+    entries.sort()
+    for _, size, path in entries:
+        if total_size <= max_size:
+            break
+        remove(path)
+        total_size -= size
+
+
+def clear():
+    """Delete all cached files, return the number of deleted files."""
+    cache_dir = get_cache_dir()
+    cnt = 0
+    try:
+        with os.scandir(cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith(cache_ext):
+                    cnt += remove(entry.path)
+    except OSError:
+        pass
+    return cnt
+
+
+def remove(path):
+    """Remove a file, ignore errors (another process may have done it)."""
+    try:
+        os.remove(path)
+    except OSError:
+        return False
+    return True
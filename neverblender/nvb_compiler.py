@@ -0,0 +1,183 @@
+"""Run external (de)compilers asynchronously."""
+
+import asyncio
+import queue
+import subprocess
+import threading
+import time
+
+
+class CompilerRun():
+    """Log entry for a single run of the compiler."""
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    OK = 'ok'
+    FAILED = 'failed'
+    TIMEOUT = 'timeout'
+    CANCELLED = 'cancelled'
+
+    def __init__(self, run_cmd):
+        """TODO: DOC."""
+        self.run_cmd = run_cmd
+        self.status = CompilerRun.PENDING
+        self.returncode = None
+        self.duration = 0.0
+        self.output = []  # (stream name, line) tuples in order of arrival
+
+    def is_done(self):
+        """Whether the run has finished (successful or not)."""
+        return self.status not in (CompilerRun.PENDING, CompilerRun.RUNNING)
+
+    def print_log(self):
+        """Print errors, including the compiler output."""
+        if self.status == CompilerRun.OK:
+            return
+        print("Neverblender: ERROR - Decompiler " + self.status + " (" +
+              " ".join(self.run_cmd) + ")")
+        for stream_name, line in self.output:
+            print("    " + stream_name + ": " + line)
+
+
+class CompilerPool():
+    """Runs compiler commands in a background thread.
+
+    An asyncio loop in the background thread runs up to max_workers
+    processes at once, every process is killed after timeout seconds
+    (0 = no timeout). Progress can be polled from the main thread,
+    finished runs can be collected as they complete.
+    """
+
+    def __init__(self, cmd_list, working_dir, max_workers=1, timeout=0.0):
+        """TODO: DOC."""
+        self.runs = [CompilerRun(cmd) for cmd in cmd_list]
+        self.working_dir = working_dir
+        self.max_workers = max(1, max_workers)
+        self.timeout = timeout
+        self.cancelled = False
+        self.thread = None
+        self.loop = None
+        self.tasks = []
+        self.finished = queue.Queue()  # Indices of finished runs
+
+    def start(self):
+        """Start running the compilers in the background."""
+        self.thread = threading.Thread(target=asyncio.run,
+                                       args=(self.run_all(), ), daemon=True)
+        self.thread.start()
+
+    def join(self):
+        """Wait for all runs to finish."""
+        if self.thread:
+            self.thread.join()
+
+    def cancel(self):
+        """Cancel pending runs, kill the running processes."""
+        self.cancelled = True
+        if self.loop and not self.loop.is_closed():
+            try:
+                for task in self.tasks:
+                    self.loop.call_soon_threadsafe(task.cancel)
+            except RuntimeError:  # Loop closed in the meantime
+                pass
+
+    def finished_count(self):
+        """Return the number of finished runs."""
+        return sum(r.is_done() for r in self.runs)
+
+    def is_done(self):
+        """Whether all runs have finished."""
+        return all(r.is_done() for r in self.runs)
+
+    def pop_finished(self, wait=False):
+        """Return the indices of runs finished since the last call.
+
+        With wait, block until at least one more run has finished.
+        """
+        finished = []
+        if wait:
+            finished.append(self.finished.get())
+        while True:
+            try:
+                finished.append(self.finished.get_nowait())
+            except queue.Empty:
+                return finished
+
+    def run_done(self, run_idx):
+        """Mark a run as finished, tasks may be cancelled before start."""
+        run = self.runs[run_idx]
+        if not run.is_done():
+            run.status = CompilerRun.CANCELLED
+        self.finished.put(run_idx)
+
+    async def run_all(self):
+        """Run all compilers, limited by the number of workers."""
+        self.loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.max_workers)
+        self.tasks = [asyncio.ensure_future(self.run_one(r, semaphore))
+                      for r in self.runs]
+        for run_idx, task in enumerate(self.tasks):
+            task.add_done_callback(
+                lambda _, run_idx=run_idx: self.run_done(run_idx))
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    @staticmethod
+    async def read_stream(stream, stream_name, output):
+        """Append lines of a stream to the output as they arrive."""
+        while True:
+            line = await stream.readline()
+            if not line:
+                break
+            output.append((stream_name,
+                           line.decode(errors='replace').rstrip()))
+
+    async def run_one(self, run, semaphore):
+        """Run a single compiler process."""
+        async with semaphore:
+            if self.cancelled:
+                run.status = CompilerRun.CANCELLED
+                return
+            run.status = CompilerRun.RUNNING
+            start_time = time.perf_counter()
+            try:
+                proc = await asyncio.create_subprocess_exec(
+                    *run.run_cmd, cwd=self.working_dir,
+                    stdin=subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE)
+            except OSError as e:
+                run.output.append(('error', str(e)))
+                run.status = CompilerRun.FAILED
+                return
+            try:
+                await asyncio.wait_for(
+                    asyncio.gather(
+                        CompilerPool.read_stream(proc.stdout, 'stdout',
+                                                 run.output),
+                        CompilerPool.read_stream(proc.stderr, 'stderr',
+                                                 run.output),
+                        proc.wait()),
+                    self.timeout or None)
+            except asyncio.TimeoutError:
+                run.status = CompilerRun.TIMEOUT
+            except asyncio.CancelledError:
+                run.status = CompilerRun.CANCELLED
+            finally:
+                if proc.returncode is None:
+                    proc.kill()
+                    await proc.wait()
+                run.duration = time.perf_counter() - start_time
+            run.returncode = proc.returncode
+            if run.status == CompilerRun.RUNNING:
+                if proc.returncode == 0:
+                    run.status = CompilerRun.OK
+                else:
+                    run.status = CompilerRun.FAILED
+
+
+def run(run_cmd, working_dir, timeout=0.0):
+    """Run a single compiler command, return its log entry."""
+    pool = CompilerPool([run_cmd], working_dir, 1, timeout)
+    asyncio.run(pool.run_all())
+    pool.runs[0].print_log()
+    return pool.runs[0]
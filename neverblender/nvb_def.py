@@ -1,5 +1,7 @@
 """TODO: DOC."""
 
+import copy
+
 # Frame at which to start all animations
 anim_globstart = 1
 # Offset between two imported animations (minimum)
@@ -88,6 +90,7 @@ class MalformedMdlFile(Exception):
 
     def __init__(self, value):
         """TODO: DOC."""
+        Exception.__init__(self, value)  # keep it picklable
         self.parameter = value
 
     def __str__(self):
@@ -274,10 +277,16 @@ class ImportOptions():
         self.dummy_size = 1.0
         self.placement = 'SPIRAL'
         self.mdl_location = (0.0, 0.0, 0.0)
+        self.parse_processes = 1
+        self.cache_use = False
+        self.cache_size = 0  # bytes
         # Handling of binary models
         self.compiler_use = False
         self.compiler_path = ""
         self.compiler_command = ""
+        self.compiler_processes = 1
+        self.compiler_timeout = 0.0  # seconds, 0 = no timeout
+        self.decompiled = dict()  # Binary mdl path => decompiled copy
         # Geometry
         self.geom_import = True
         self.geom_smoothgroups = True
@@ -303,11 +312,24 @@ class ImportOptions():
         self.anim_restpose = True
         self.anim_ignore_existing = False
         self.anim_scale = None  # use None, instead of 1.0
+        self.anim_lazy = False  # load keyframes on demand
+        # Filters for nodes and animations (see nvb_parse.NameFilter)
+        self.filter_nodes = ''
+        self.filter_types = ''
+        self.filter_anims = ''
         # Blender Settings
         self.rotmode = 'XYZ'
         self.fix_uvs = False
         self.collections_use = True
 
+    def copy_for_parsing(self):
+        """Return a copy without references to blender data (picklable)."""
+        parse_options = copy.copy(self)
+        parse_options.scene = None
+        parse_options.collection = None
+        parse_options.mtrdb = dict()
+        return parse_options
+
 
 class ExportOptions():
     """Holds all export options."""
@@ -336,6 +358,7 @@ class ExportOptions():
         self.mat_diffuse_ref = 'bitmap'
         # Misc options
         self.anim_export = True        
+        self.export_binary = False
         # UV Map  settings
         self.uv_merge = True
         self.uv_level = 'REN'
@@ -344,4 +367,8 @@ class ExportOptions():
         self.apply_modifiers = True
         self.mesh_convert = 'RENDER'
         self.batch_mode = 'OFF'
+        self.write_processes = 1
+        self.export_incremental = False
+        self.mesh_cache = dict()  # Object name => triangulated mesh data
+        self.warnings = []  # Reported by the operator after exporting
         self.strip_trailing = False
@@ -0,0 +1,243 @@
+"""Fingerprints of exported models, used to skip unchanged models."""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+import bpy
+
+from . import nvb_utils
+
+manifest_name = '.nvb_export.json'  # Sidecar next to the exported files
+manifest_version = 1
+
+# Export options not affecting the content of the files
+ignored_options = {'filepath', 'mdlname', 'classification',
+                   'write_processes', 'export_incremental'}
+
+
+def hash_array(h, collection, attr, dim=1, dtype=np.float32):
+    """Hash an attribute of all items of a collection."""
+    data = np.empty(len(collection) * dim, dtype=dtype)
+    if len(data):
+        collection.foreach_get(attr, data)
+    h.update(data.tobytes())
+
+
+def hash_value(h, value):
+    """Hash a simple (non struct) property value."""
+    if isinstance(value, set):  # Enum flags, order is not stable
+        value = sorted(value)
+    elif isinstance(value, (int, float, str, bool)) or value is None:
+        pass
+    else:  # Arrays, vectors, matrices
+        try:
+            value = np.array(value, dtype=np.float64).tolist()
+        except (TypeError, ValueError):
+            pass
+    h.update(repr(value).encode())
+
+
+def hash_rna(h, struct, depth=0):
+    """Hash all properties of a blender struct.
+
+    Nested structs are hashed as well, for IDs only the name is used.
+    Generic ID properties (users, session uid, ...) change between sessions
+    and are skipped.
+    """
+    if struct is None or depth > 4:
+        h.update(b'None')
+        return
+    skipped = {'rna_type'}
+    if isinstance(struct, bpy.types.ID):
+        skipped.update(p.identifier for p in bpy.types.ID.bl_rna.properties)
+    for prop in struct.bl_rna.properties:
+        prop_id = prop.identifier
+        if prop_id in skipped:
+            continue
+        try:
+            value = getattr(struct, prop_id)
+        except AttributeError:
+            continue
+        h.update(prop_id.encode())
+        if isinstance(value, bpy.types.ID):
+            h.update(value.name.encode())
+        elif prop.type == 'POINTER':
+            hash_rna(h, value, depth+1)
+        elif prop.type == 'COLLECTION':
+            for item in value:
+                hash_rna(h, item, depth+1)
+        else:
+            hash_value(h, value)
+
+
+def hash_action(h, id_data):
+    """Hash the keyframes of the action of an ID."""
+    anim_data = getattr(id_data, 'animation_data', None)
+    action = anim_data.action if anim_data else None
+    if not action:
+        h.update(b'None')
+        return
+    h.update(action.name.encode())
+    for fcu in action.fcurves:
+        h.update((fcu.data_path + str(fcu.array_index)).encode())
+        kfp = fcu.keyframe_points
+        for attr in ('co', 'handle_left', 'handle_right'):
+            hash_array(h, kfp, attr, 2)
+        hash_array(h, kfp, 'interpolation', 1, np.int32)
+
+
+def hash_mesh(h, mesh):
+    """Hash the geometry and layers of a mesh."""
+    hash_array(h, mesh.vertices, 'co', 3)
+    hash_array(h, mesh.edges, 'vertices', 2, np.int32)
+    hash_array(h, mesh.edges, 'use_edge_sharp', 1, bool)
+    hash_array(h, mesh.loops, 'vertex_index', 1, np.int32)
+    hash_array(h, mesh.polygons, 'loop_start', 1, np.int32)
+    hash_array(h, mesh.polygons, 'loop_total', 1, np.int32)
+    hash_array(h, mesh.polygons, 'material_index', 1, np.int32)
+    hash_array(h, mesh.polygons, 'use_smooth', 1, bool)
+    hash_value(h, (mesh.use_auto_smooth, mesh.auto_smooth_angle))
+    for uv_layer in mesh.uv_layers:
+        hash_value(h, (uv_layer.name, uv_layer.active))
+        hash_array(h, uv_layer.data, 'uv', 2)
+    for vcolors in mesh.vertex_colors:
+        hash_value(h, (vcolors.name, vcolors.active))
+        hash_array(h, vcolors.data, 'color', 4)
+    shape_keys = mesh.shape_keys
+    if shape_keys:
+        hash_value(h, shape_keys.use_relative)
+        for kb in shape_keys.key_blocks:
+            hash_value(h, (kb.name, kb.frame, kb.mute))
+            hash_array(h, kb.data, 'co', 3)
+        hash_action(h, shape_keys)
+
+
+def hash_material(h, material):
+    """Hash a material including its node tree."""
+    if not material:
+        h.update(b'None')
+        return
+    hash_rna(h, material)
+    hash_action(h, material)
+    node_tree = material.node_tree
+    if not node_tree:
+        return
+    for node in node_tree.nodes:
+        hash_value(h, (node.name, node.bl_idname))
+        image = getattr(node, 'image', None)
+        if image:
+            hash_value(h, (image.name, image.filepath))
+        for socket in node.inputs:
+            hash_value(h, socket.identifier)
+            hash_value(h, getattr(socket, 'default_value', None))
+    for link in node_tree.links:
+        hash_value(h, (link.from_node.name, link.from_socket.identifier,
+                       link.to_node.name, link.to_socket.identifier))
+    hash_action(h, node_tree)
+
+
+def hash_object(h, obj):
+    """Hash everything of an object ending up in the export."""
+    hash_value(h, (obj.name, obj.type, obj.parent.name if obj.parent else '',
+                   obj.rotation_mode, obj.hide_render))
+    hash_value(h, obj.matrix_basis)
+    hash_value(h, obj.matrix_parent_inverse)
+    hash_value(h, obj.color)
+    hash_rna(h, obj.nvb)
+    hash_action(h, obj)
+    for modifier in obj.modifiers:
+        hash_rna(h, modifier)
+    for psys in obj.particle_systems:
+        hash_rna(h, psys.settings)
+        hash_action(h, psys.settings)
+    for slot in obj.material_slots:
+        hash_material(h, slot.material)
+    data = obj.data
+    if data is None:
+        return
+    h.update(data.name.encode())
+    if obj.type == 'MESH':
+        hash_mesh(h, data)
+        # Skin weights
+        if obj.vertex_groups:
+            hash_value(h, [vg.name for vg in obj.vertex_groups])
+            hash_value(h, [[(g.group, g.weight) for g in v.groups]
+                           for v in data.vertices])
+    else:
+        hash_rna(h, data)
+    hash_action(h, data)
+
+
+def fingerprint(mdl_base, options):
+    """Return a fingerprint of a model and the export options."""
+    h = hashlib.blake2b(digest_size=16)
+    export_options = {k: v for k, v in vars(options).items()
+                      if k not in ignored_options and
+                      isinstance(v, (bool, int, float, str))}
+    hash_value(h, sorted(export_options.items()))
+    if options.scene:  # Geometry is evaluated at the current frame
+        hash_value(h, options.scene.frame_current)
+    obj_list = [mdl_base]
+    nvb_utils.get_children_recursive(mdl_base, obj_list)
+    for obj in obj_list:
+        hash_object(h, obj)
+    # Keys of lazy animations are exported from their source mdls
+    for anim in mdl_base.nvb.animList:
+        if anim.lazy_source:
+            hash_value(h, file_stat(anim.lazy_source))
+    return h.hexdigest()
+
+
+def file_stat(filepath):
+    """Return [size, modification time] of a file or None."""
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class Manifest():
+    """Fingerprints and output files of the models exported to a directory.
+
+    Stored as json, the model file name is used as key.
+    """
+
+    def __init__(self, directory):
+        """TODO: DOC."""
+        self.filepath = os.path.join(directory, manifest_name)
+        self.models = dict()
+        try:
+            with open(self.filepath, 'r') as f:
+                data = json.load(f)
+            if data.get('version') == manifest_version:
+                self.models = data['models']
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass  # No or unreadable manifest, export everything
+
+    def is_unchanged(self, mdl_path, mdl_fingerprint):
+        """Whether the model and its files are as they were last exported."""
+        entry = self.models.get(os.path.basename(mdl_path))
+        if not entry or entry.get('fingerprint') != mdl_fingerprint:
+            return False
+        directory = os.path.dirname(mdl_path)
+        return all(file_stat(os.path.join(directory, name)) == stat
+                   for name, stat in entry.get('files', dict()).items())
+
+    def update(self, mdl_path, mdl_fingerprint, file_list):
+        """Store the fingerprint and the state of the written files."""
+        files = {os.path.basename(p): file_stat(p) for p in file_list}
+        self.models[os.path.basename(mdl_path)] = {
+            'fingerprint': mdl_fingerprint,
+            'files': {name: stat for name, stat in files.items() if stat}}
+
+    def save(self):
+        """Write the manifest."""
+        tmp_path = self.filepath + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': manifest_version, 'models': self.models},
+                      f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.filepath)
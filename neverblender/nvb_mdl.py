@@ -4,6 +4,8 @@ import os
 import tempfile
 import subprocess
 import shutil
+import multiprocessing
+import concurrent.futures
 from datetime import datetime
 
 import bpy
@@ -13,6 +15,10 @@ from . import nvb_node
 from . import nvb_anim
 from . import nvb_def
 from . import nvb_utils
+from . import nvb_parse
+from . import nvb_binmdl
+from . import nvb_compiler
+from . import nvb_cache
 
 
 class Mdl():
@@ -43,115 +49,140 @@ class Mdl():
         self.dwknodes = []
         # Animations
         self.animations = []
+        # Set if a binary file could not be decompiled, don't cache these
+        self.decompile_failed = False
 
-    def read_ascii_header(self, ascii_block):
+    def read_ascii_header(self, line):
         """TODO: DOC."""
-        ascii_lines = [l.strip().split() for l in ascii_block.splitlines()]
-        for line in ascii_lines:
+        label = line[0].lower()
+        if label == 'newmodel':
             try:
-                label = line[0].lower()
-            except (IndexError, AttributeError):
-                continue  # Probably empty line, skip it
-            if label == 'newmodel':
-                try:
-                    self.name = line[1]
-                except (ValueError, IndexError):
-                    print("Neverblender: WARNING - Unable to read model name.")
-            elif label == 'setsupermodel':
-                try:  # should be ['setsupermodel', modelname, supermodelname]
-                    self.supermodel = line[2].lower()
-                except (ValueError, IndexError):
-                    print("Neverblender: WARNING - Unable to read supermodel. \
-                           Using default value " + self.supermodel)
-            elif label == 'classification':
-                try:
-                    self.classification = line[1].lower()
-                except (ValueError, IndexError):
-                    print("Neverblender: WARNING - Unable to read \
-                           classification. \
-                           Using Default value " + self.classification)
-                if self.classification not in nvb_def.Classification.ALL:
-                    print("Neverblender: WARNING - Invalid classification \
-                           '" + self.classification + "'")
-                    self.classification = nvb_def.Classification.UNKNOWN
-            elif label == 'setanimationscale':
-                try:
-                    self.animscale = float(line[1])
-                except (ValueError, IndexError):
-                    print("Neverblender: WARNING - Unable to read \
-                           animationscale. \
-                           Using default value " + self.animscale)
+                self.name = line[1]
+            except (ValueError, IndexError):
+                print("Neverblender: WARNING - Unable to read model name.")
+        elif label == 'setsupermodel':
+            try:  # should be ['setsupermodel', modelname, supermodelname]
+                self.supermodel = line[2].lower()
+            except (ValueError, IndexError):
+                print("Neverblender: WARNING - Unable to read supermodel. \
+                       Using default value " + self.supermodel)
+        elif label == 'classification':
+            try:
+                self.classification = line[1].lower()
+            except (ValueError, IndexError):
+                print("Neverblender: WARNING - Unable to read \
+                       classification. \
+                       Using Default value " + self.classification)
+            if self.classification not in nvb_def.Classification.ALL:
+                print("Neverblender: WARNING - Invalid classification \
+                       '" + self.classification + "'")
+                self.classification = nvb_def.Classification.UNKNOWN
+        elif label == 'setanimationscale':
+            try:
+                self.animscale = float(line[1])
+            except (ValueError, IndexError):
+                print("Neverblender: WARNING - Unable to read \
+                       animationscale. \
+                       Using default value " + self.animscale)
 
-    def read_ascii_wkm(self, ascii_block, wkmtype, options):
+    def read_ascii_wkm(self, ascii_records, wkmtype, options):
         """TODO: DOC."""
         if options.geom_walkmesh:
-            geom_start = ascii_block.find('node ')
-            if (geom_start < 0):  # Most likely empty walkmesh file
-                print("Neverblender: WARNING: Unable to read walkmesh data")
-                return
             if wkmtype == 'pwk':
-                Mdl.read_ascii_geom(ascii_block[geom_start:], self.pwknodes)
+                nodelist = self.pwknodes
             elif wkmtype == 'dwk':
-                Mdl.read_ascii_geom(ascii_block[geom_start:], self.dwknodes)
+                nodelist = self.dwknodes
+            else:
+                return
+            itrecords = iter(ascii_records)
+            for record in itrecords:
+                if record[0] == nvb_parse.Recordtype.NODE:
+                    Mdl.read_ascii_node(record, itrecords, nodelist)
+            if not nodelist:  # Most likely empty walkmesh file
+                print("Neverblender: WARNING: Unable to read walkmesh data")
 
     @staticmethod
-    def read_ascii_geom(ascii_block, nodelist):
-        """Read the geometry block of ascii mdl."""
-        dlm = 'node '
-        ascii_node_list = [dlm + b for b in ascii_block.split(dlm) if b]
-        for idx, ascii_node in enumerate(ascii_node_list):
-            ascii_lines = [l.strip().split() for l in ascii_node.splitlines()]
-            node = None
-            node_type = ''
-            node_name = 'UNNAMED'
-            try:  # Read node type
-                node_type = ascii_lines[0][1].lower()
-            except (IndexError, AttributeError):
-                raise nvb_def.MalformedMdlFile('Unable to read node type')
-            try:  # Read node name
-                node_name = ascii_lines[0][2].lower()
-            except (IndexError, AttributeError):
-                raise nvb_def.MalformedMdlFile('Unable to read node name')
-            try:  # Create (node) object
-                node = Mdl.nodelookup[node_type](node_name)
-            except KeyError:
-                raise nvb_def.MalformedMdlFile('Invalid node type')
-            # Parse and add to node list
-            node.loadAscii(ascii_lines, idx)
-            nodelist.append(node)
-
-    def read_ascii_anims(self, ascii_block):
-        """Load all animations from an ascii mdl block."""
-        def read_anim(ascii_anim):
-            """Load a single animation from an ascii animation block."""
-            anim = nvb_anim.Animation()
-            anim.loadAscii(ascii_anim)
-            return anim
-        dlm = 'newanim '  # Split animations using 'newanim' as delimiter
-        animList = [dlm + b for b in ascii_block.split(dlm) if b]
-        self.animations = list(map(read_anim, animList))
-
-    def read_ascii_mdl(self, ascii_block, options):
-        """Parse an ascii mdl file."""
-        geom_start = ascii_block.find('node ')
-        anim_start = ascii_block.find('newanim ')
-
-        if (anim_start > 0) and (geom_start > anim_start):
-            raise nvb_def.MalformedMdlFile('Animations before geometry')
-        if (geom_start < 0):
+    def read_ascii_node(record, itrecords, nodelist, node_idx=None):
+        """Read a single node block and add it to the node list."""
+        line = record[1]
+        node = None
+        node_type = ''
+        node_name = 'UNNAMED'
+        try:  # Read node type
+            node_type = line[1].lower()
+        except (IndexError, AttributeError):
+            raise nvb_def.MalformedMdlFile('Unable to read node type')
+        try:  # Read node name
+            node_name = line[2].lower()
+        except (IndexError, AttributeError):
+            raise nvb_def.MalformedMdlFile('Unable to read node name')
+        try:  # Create (node) object
+            node = Mdl.nodelookup[node_type](node_name)
+        except KeyError:
+            raise nvb_def.MalformedMdlFile('Invalid node type')
+        # Parse and add to node list
+        if node_idx is None:
+            node_idx = len(nodelist)
+        node.loadAscii(nvb_parse.ascii_block(record, itrecords), node_idx)
+        nodelist.append(node)
+
+    def read_ascii_mdl(self, ascii_records, options, lazy_anims=False):
+        """Parse an ascii mdl file from a stream of records.
+
+        Parsing stops at the first animation if animations are not imported
+        or loaded lazily (lazy_anims).
+        """
+        node_idx = 0  # Position in the file, including skipped nodes
+        skipped_parents = dict()
+        itrecords = iter(ascii_records)
+        for record in itrecords:
+            record_type = record[0]
+            if record_type == nvb_parse.Recordtype.NODE:
+                Mdl.read_ascii_node(record, itrecords, self.mdlnodes,
+                                    node_idx)
+                node_idx += 1
+            elif record_type == nvb_parse.Recordtype.SKIPNODE:
+                if len(record[1]) > 2:
+                    parent = ''
+                    if record[2] and len(record[2][0]) > 1:
+                        parent = nvb_parse.ascii_identifier(record[2][0][1])
+                    skipped_parents[record[1][2].lower()] = parent.lower()
+                node_idx += 1
+            elif record_type == nvb_parse.Recordtype.NEWANIM:
+                if not self.mdlnodes:
+                    raise nvb_def.MalformedMdlFile('Animations before geometry')
+                if lazy_anims or not options.anim_import:
+                    break
+                anim = nvb_anim.Animation()
+                anim.loadAscii(record, itrecords)
+                self.animations.append(anim)
+            elif not self.mdlnodes:
+                self.read_ascii_header(record[1])
+        if not self.mdlnodes:
             raise nvb_def.MalformedMdlFile('Unable to find geometry')
-
-        self.read_ascii_header(ascii_block[:geom_start-1])
-        # Import Geometry
-        if (anim_start > 0):
-            # Animations present, exclude them for geometry loading
-            Mdl.read_ascii_geom(ascii_block[geom_start:anim_start],
-                                self.mdlnodes)
+        # Attach nodes to the closest ancestor, which was not filtered out
+        if skipped_parents:
+            for node in self.mdlnodes:
+                parent = node.parent
+                visited = set()
+                while parent.lower() in skipped_parents and \
+                        parent.lower() not in visited:
+                    visited.add(parent.lower())
+                    parent = skipped_parents[parent.lower()]
+                node.parent = parent
+
+    def read_lazy_anims(self, mdl_filepath, binary, block_filter=None):
+        """Read only the headers of animations and keep their offsets."""
+        if binary:
+            offset_list = nvb_binmdl.read_anim_offsets(mdl_filepath)
         else:
-            Mdl.read_ascii_geom(ascii_block[geom_start:], self.mdlnodes)
-        # Import Animations
-        if options.anim_import and (anim_start > 0):
-            self.read_ascii_anims(ascii_block[anim_start:])
+            offset_list = nvb_parse.ascii_anim_offsets(mdl_filepath)
+        for offset in offset_list:
+            anim = nvb_anim.Animation()
+            anim.loadSource(mdl_filepath, offset, binary, True)
+            if block_filter and not block_filter.anim_names.match(anim.name):
+                continue
+            self.animations.append(anim)
 
     @staticmethod
     def is_binary(filepath):
@@ -192,13 +223,127 @@ class Mdl():
 
         return run_cmd
 
+    @staticmethod
+    def prepare_decompile(path_list, tmp_dir, options, max_workers=1):
+        """Copy binary mdls into tmp_dir for decompilation in a batch.
+
+        Only files the binary reader can't handle and which are not in the
+        cache are decompiled. They are copied into subdirectories of
+        tmp_dir, one per worker. Compilers taking directories run once per
+        subdirectory, others once per file.
+        Returns a list of (command, [(mdl path, decompiled path), ...]).
+        """
+        if not options.compiler_use or \
+           not os.path.isfile(options.compiler_path):
+            return []
+        path_list = [p for p in path_list if Mdl.is_binary(p) and
+                     not nvb_binmdl.is_supported(p) and
+                     not Mdl.is_cached(p, options)]
+        if not path_list:
+            return []
+        if max_workers < 1:
+            max_workers = multiprocessing.cpu_count()
+        # Copy files into one directory per worker, names have to be unique
+        chunk_list = [dict() for _ in range(min(max_workers, len(path_list)))]
+        for i, mdl_path in enumerate(path_list):
+            mdl_filename = os.path.basename(mdl_path)
+            chunk_idx = i % len(chunk_list)
+            while mdl_filename.lower() in chunk_list[chunk_idx]:
+                chunk_idx += 1
+                if chunk_idx >= len(chunk_list):
+                    chunk_list.append(dict())
+            chunk_list[chunk_idx][mdl_filename.lower()] = mdl_path
+        run_list = []
+        # Without file references the compiler processes whole directories
+        cmd_refs = options.compiler_command.lower().split()
+        per_file = '%in_path%' in cmd_refs or '%out_path%' in cmd_refs
+        for chunk_idx, chunk in enumerate(chunk_list):
+            chunk_dir = os.path.join(tmp_dir, str(chunk_idx))
+            os.makedirs(chunk_dir, exist_ok=True)
+            file_list = []
+            for mdl_path in chunk.values():
+                tmp_path = os.path.join(chunk_dir, os.path.basename(mdl_path))
+                shutil.copyfile(mdl_path, tmp_path)
+                file_list.append((mdl_path, tmp_path))
+            if per_file:
+                run_list.extend([(Mdl.build_external_decompile_cmd(
+                    tmp_path, options.compiler_path, options.compiler_command),
+                    [(mdl_path, tmp_path)])
+                    for mdl_path, tmp_path in file_list])
+            else:
+                run_list.append((Mdl.build_external_decompile_cmd(
+                    os.path.join(chunk_dir, '*.mdl'), options.compiler_path,
+                    options.compiler_command), file_list))
+        return [r for r in run_list if r[0]]
+
+    @staticmethod
+    def get_decompiled(file_list):
+        """Return a dict of decompiled files, None for failed ones."""
+        decompiled = dict()
+        for mdl_path, tmp_path in file_list:
+            if os.path.isfile(tmp_path) and not Mdl.is_binary(tmp_path):
+                decompiled[mdl_path] = tmp_path
+            else:
+                decompiled[mdl_path] = None
+                print("Neverblender: ERROR - Could not decompile file " +
+                      mdl_path)
+        return decompiled
+
+    @staticmethod
+    def start_decompile(run_list, options, max_workers=1):
+        """Start the compiler runs from prepare_decompile in the background.
+
+        Finished runs can be collected from the returned pool, their
+        files are passed to get_decompiled.
+        """
+        if max_workers < 1:
+            max_workers = multiprocessing.cpu_count()
+        # Same as single files: Use compiler dir as working dir
+        pool = nvb_compiler.CompilerPool(
+            [run_cmd for run_cmd, _ in run_list],
+            os.path.split(options.compiler_path)[0], max_workers,
+            options.compiler_timeout)
+        pool.start()
+        return pool
+
     def parse_mdl(self, mdl_filepath, options):
         """Parse a single mdl file."""
-        if Mdl.is_binary(mdl_filepath):
-            # Binary modles have to be decompiled
-            if not options.compiler_use:
+        # Only files we can read again later can be loaded lazily
+        lazy_anims = options.anim_import and options.anim_lazy
+        # Nodes and animations not matching the filters are skipped
+        block_filter = nvb_parse.BlockFilter(options.filter_nodes,
+                                             options.filter_types,
+                                             options.filter_anims)
+        if not block_filter.is_active():
+            block_filter = None
+        if mdl_filepath in options.decompiled:
+            # Decompiled beforehand, together with other files
+            tmp_filepath = options.decompiled[mdl_filepath]
+            if not tmp_filepath:
+                self.decompile_failed = True
+                return
+            with open(os.fsencode(tmp_filepath), 'r') as f:
+                self.read_ascii_mdl(nvb_parse.ascii_records(f, block_filter),
+                                    options)
+        elif Mdl.is_binary(mdl_filepath):
+            # Try reading binary models directly, decompile if that fails
+            try:
+                records = nvb_binmdl.read_records(
+                    mdl_filepath, options.anim_import and not lazy_anims)
+            except nvb_def.MalformedMdlFile as e:
+                print("Neverblender: WARNING - " + e.parameter)
+                records = None
+            if records:
+                if block_filter:
+                    records = nvb_parse.filter_records(records, block_filter)
+                self.read_ascii_mdl(records, options)
+                if lazy_anims:
+                    self.read_lazy_anims(mdl_filepath, True, block_filter)
+            elif not options.compiler_use:
+                self.decompile_failed = True
                 print("Neverblender: WARNING - Detected binary MDL with disabled external compiler.")
             elif not os.path.isfile(options.compiler_path):
+                self.decompile_failed = True
                 print("Neverblender: WARNING - Detected binary MDL with invalid path to external compiler.")
             else:
                 # - Create named temporay file (named because we'll need full access for subprocesses)
@@ -212,14 +357,16 @@ class Mdl():
                     # Try getting a decompile command based on user options, make it overwrite the input file
                     run_cmd = Mdl.build_external_decompile_cmd(tmp_filepath, options.compiler_path, options.compiler_command)
                     #print(run_cmd)
+                    self.decompile_failed = True
                     if run_cmd:
                         # copy the file we want to import to tempfile
                         shutil.copyfile(mdl_filepath, tmp_filepath)
-                        # Let the compiler do its work
-                        result = subprocess.run(run_cmd, stdout=subprocess.PIPE, cwd=working_dir)
-                        if result.returncode == 0:
+                        # Let the compiler do its work (killed on timeout)
+                        result = nvb_compiler.run(run_cmd, working_dir, options.compiler_timeout)
+                        if result.status == nvb_compiler.CompilerRun.OK:
                             # If succesful pass the resulting file to the ascii parser
-                            self.read_ascii_mdl(tf.read(), options)
+                            self.read_ascii_mdl(nvb_parse.ascii_records(tf, block_filter), options)
+                            self.decompile_failed = False
                         else:
                             print("Neverblender: ERROR - Could not decompile file.")
                 finally:
@@ -252,13 +399,17 @@ class Mdl():
         else:
             # ASCII model, parse directly
             with open(os.fsencode(mdl_filepath), 'r') as f:
-                self.read_ascii_mdl(f.read(), options)
+                self.read_ascii_mdl(nvb_parse.ascii_records(f, block_filter),
+                                    options, lazy_anims)
+            if lazy_anims:
+                self.read_lazy_anims(mdl_filepath, False, block_filter)
 
     def parse_wkm(self, wkm_filepath, wkm_type, options):
         """Parse a single walkmesh file."""
         if Mdl.is_binary(wkm_filepath):
             # Binary modles have to be decompiled
             if not options.decompiler_use_external:
+                self.decompile_failed = True
                 print("Neverblender: WARNING - Detected binary MDL with no decompiler avaible.")
             else:
                 # Write the output of the external decompiler to a temp file and feed it into the ascii parser
@@ -269,8 +420,9 @@ class Mdl():
                     run_cmd = Mdl.build_external_decompile_cmd(mdl_filepath, tf.name, options)
                     result = subprocess.run(run_cmd, stdout=subprocess.PIPE)
                     if result.returncode == 0:
-                        self.read_ascii_mdl(tf.read(), options)
+                        self.read_ascii_mdl(nvb_parse.ascii_records(tf), options)
                     else:
+                        self.decompile_failed = True
                         print("Neverblender: ERROR - Could not decompile file.")
                 finally:
                     tf.close()
@@ -278,7 +430,97 @@ class Mdl():
         else:
             # ASCII model, parse directly
             with open(os.fsencode(wkm_filepath), 'r') as f:
-                self.read_ascii_wkm(f.read(), wkm_type, options)
+                self.read_ascii_wkm(nvb_parse.ascii_records(f), wkm_type,
+                                    options)
+
+    @staticmethod
+    def get_wkm_list(mdl_filepath, options):
+        """Return (path, type) of the walkmeshes next to a mdl file."""
+        mdl_filedir, mdl_filename = os.path.split(mdl_filepath)
+        mdl_name = os.path.splitext(mdl_filename)[0]
+
+        # Placeable (pwk) and door walkmeshes (dwk) next to the mdl
+        wkm_list = []
+        if options.geom_walkmesh:
+            for wkm_type in [nvb_def.Walkmeshtype.PWK,
+                             nvb_def.Walkmeshtype.DWK]:
+                wkm_filepath = os.path.join(mdl_filedir,
+                                            mdl_name + '.' + wkm_type)
+                if os.path.isfile(os.fsencode(wkm_filepath)):
+                    wkm_list.append((wkm_filepath, wkm_type))
+        return wkm_list
+
+    @staticmethod
+    def get_cache_key(mdl_filepath, wkm_list, options):
+        """Return the cache key of a mdl file, None if caching is off."""
+        if not options.cache_use:
+            return None
+        return nvb_cache.get_key(
+            [mdl_filepath] + [w[0] for w in wkm_list],
+            [options.anim_import, options.anim_lazy,
+             options.compiler_use, options.compiler_path,
+             options.compiler_command, options.filter_nodes,
+             options.filter_types, options.filter_anims])
+
+    @staticmethod
+    def is_cached(mdl_filepath, options):
+        """Whether parse_file will load this file from the cache."""
+        cache_key = Mdl.get_cache_key(
+            mdl_filepath, Mdl.get_wkm_list(mdl_filepath, options), options)
+        return bool(cache_key) and nvb_cache.contains(cache_key)
+
+    @staticmethod
+    def parse_file(mdl_filepath, options):
+        """Parse a mdl file and its walkmeshes into a new Mdl object.
+
+        Does not touch blender data, safe to run in worker processes.
+        """
+        wkm_list = Mdl.get_wkm_list(mdl_filepath, options)
+        # Skip parsing entirely if the files are unchanged since last time
+        cache_key = Mdl.get_cache_key(mdl_filepath, wkm_list, options)
+        if cache_key:
+            mdl = nvb_cache.load(cache_key)
+            if mdl:
+                return mdl
+
+        mdl = Mdl()
+        mdl.parse_mdl(mdl_filepath, options)
+        for wkm_filepath, wkm_type in wkm_list:
+            mdl.parse_wkm(wkm_filepath, wkm_type, options)
+        # Failed or empty results would be returned until the file changes
+        if cache_key and mdl.mdlnodes and not mdl.decompile_failed:
+            nvb_cache.store(cache_key, mdl, options.cache_size)
+        return mdl
+
+    @staticmethod
+    def parse_files(path_list, options, max_workers=1):
+        """Parse multiple mdl files, yield (path, mdl) in order of path_list.
+
+        With more than one worker the files are parsed in a process pool,
+        while the caller is creating objects from the files already done.
+        Workers are forked, without fork (Windows) files are parsed
+        sequentially. Forking blender is not safe in general (threads,
+        GPU and audio state), so this is opt-in and off by default.
+        """
+        if max_workers < 1:
+            max_workers = os.cpu_count() or 1
+        max_workers = min(max_workers, len(path_list))
+        if max_workers <= 1 or \
+           'fork' not in multiprocessing.get_all_start_methods():
+            for mdl_filepath in path_list:
+                yield mdl_filepath, Mdl.parse_file(mdl_filepath, options)
+            return
+        # Options have to be sent to the workers, leave out blender data
+        parse_options = options.copy_for_parsing()
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers, mp_context=multiprocessing.get_context('fork'))
+        try:
+            futures = [executor.submit(Mdl.parse_file, p, parse_options)
+                       for p in path_list]
+            for mdl_filepath, future in zip(path_list, futures):
+                yield mdl_filepath, future.result()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
 
     @staticmethod
     def generate_ascii_header(mdl_base, ascii_lines, options):
@@ -320,6 +562,7 @@ class Mdl():
     def generate_ascii_animations(mdl_base, ascii_lines, options):
         """TODO: DOC."""
         if mdl_base.nvb.animList:
+            # Animations not loaded yet are copied from their source mdl
             ascii_lines.append('')
             ascii_lines.append('# ANIM ASCII')
             for anim in mdl_base.nvb.animList:
@@ -548,17 +791,32 @@ class Mdl():
             # Set mdl base as active
             bpy.context.view_layer.objects.active = mdl_base
 
-    def create_super(self, mdl_base, options):
-        """Import animation onto existing MDL."""
+    @staticmethod
+    def get_node_resolver(mdl_base):
+        """(Re)build a name resolver for the objects of an existing MDL."""
         def setup_resolver(resolver, obj):
             node_name = nvb_utils.strip_trailing_numbers(obj.name)
             resolver.insert_obj(node_name, obj.nvb.imporder, obj.name)
             for c in obj.children:
                 setup_resolver(resolver, c)
 
-        # (Re)build name resolver for the mdl_base
         node_resolver = nvb_utils.NodeResolver()
         setup_resolver(node_resolver, mdl_base)
+        return node_resolver
+
+    @staticmethod
+    def create_lazy_animations(mdl_base, anim_list, options):
+        """Load keyframes of lazily imported animations in anim_list."""
+        anim_list = [a for a in anim_list if a.lazy_source]
+        if not anim_list:
+            return
+        node_resolver = Mdl.get_node_resolver(mdl_base)
+        for anim in anim_list:
+            nvb_anim.Animation.create_lazy(anim, node_resolver, options)
+
+    def create_super(self, mdl_base, options):
+        """Import animation onto existing MDL."""
+        node_resolver = Mdl.get_node_resolver(mdl_base)
         # Create animations
         if options.anim_fps_use:
             options.scene.render.fps = options.anim_fps
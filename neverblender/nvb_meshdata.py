@@ -0,0 +1,65 @@
+"""Conversion of per loop and per vertex mesh data, works on numpy arrays."""
+
+import numpy as np
+
+
+def first_loop_data(loop_vert_ids, vert_cnt, loop_data):
+    """Return per vertex data, taken from the first loop using the vertex.
+
+    loop_vert_ids holds the vertex index of each loop, loop_data the
+    (loop count, N) values. Vertices without loops get zeros.
+    """
+    loop_data = np.asarray(loop_data)
+    vert_ids, first_loop_ids = np.unique(loop_vert_ids, return_index=True)
+    vert_data = np.zeros((vert_cnt,) + loop_data.shape[1:],
+                         dtype=loop_data.dtype)
+    vert_data[vert_ids] = loop_data[first_loop_ids]
+    return vert_data
+
+
+def vertex_loop_data(loop_vert_ids, vert_data, loop_dim):
+    """Return (loop count, loop_dim) float32 data, from the loop's vertex.
+
+    Components missing in vert_data are set to zero, extra ones dropped.
+    """
+    vert_data = np.asarray(vert_data)
+    loop_data = np.zeros((len(loop_vert_ids), loop_dim), dtype=np.float32)
+    dim = min(loop_dim, vert_data.shape[1])
+    loop_data[:, :dim] = vert_data[loop_vert_ids, :dim]
+    return loop_data
+
+
+def first_pair_ids(vert_ids, bone_ids, bone_cnt):
+    """Return the indices of the first weight of each (vertex, bone) pair.
+
+    Later weights for a bone already listed for a vertex are dropped, the
+    remaining indices keep their original order.
+    """
+    pair_ids = np.asarray(vert_ids, dtype=np.int64) * max(bone_cnt, 1) + \
+        np.asarray(bone_ids, dtype=np.int64)
+    _, first_ids = np.unique(pair_ids, return_index=True)
+    return np.sort(first_ids)
+
+
+def absolute_key_weights(kb_frames, eval_times):
+    """Return the blend of absolute shape keys for each eval time.
+
+    Blends linearly between the last key at or before and the first key
+    at or after the eval time, as blender does for linear absolute keys.
+    Eval times outside the keys get the first or last key. Returns the
+    indices into kb_frames of both keys and the factor of the second one.
+    """
+    kb_frames = np.asarray(kb_frames, dtype=np.float64)
+    eval_times = np.asarray(eval_times, dtype=np.float64)
+    kb_order = np.argsort(kb_frames, kind='stable')
+    sorted_frames = kb_frames[kb_order]
+    last_kb = len(sorted_frames) - 1
+    pos0 = np.clip(
+        np.searchsorted(sorted_frames, eval_times, side='right') - 1,
+        0, last_kb)
+    pos1 = np.clip(np.searchsorted(sorted_frames, eval_times, side='left'),
+                   0, last_kb)
+    span = sorted_frames[pos1] - sorted_frames[pos0]
+    factor = np.divide(eval_times - sorted_frames[pos0], span,
+                       out=np.zeros(len(eval_times)), where=span > 0.0)
+    return kb_order[pos0], kb_order[pos1], factor
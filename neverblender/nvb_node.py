@@ -2,16 +2,17 @@
 
 import array
 
-import mathutils
+import numpy as np
 import bpy
 import bmesh
-from bpy_extras.io_utils import unpack_list
 
 from . import nvb_def
 from . import nvb_utils
 from . import nvb_parse
 from . import nvb_aabb
 from . import nvb_material
+from . import nvb_writer
+from . import nvb_meshdata
 
 
 class Node(object):
@@ -52,24 +53,19 @@ class Node(object):
         """TODO: DOC."""
         return self.name
 
-    def parse_ascii_line(self, itlines):
+    def parse_ascii_line(self, itrecords):
         """TODO: DOC."""
-        line = None
+        record = None
         try:
-            line = next(itlines)
+            record = next(itrecords)
         except StopIteration:
             return None
-        label = ''
-        try:
-            label = line[0].lower()
-        except (IndexError, AttributeError):
-            return line  # Probably empty line or comment
-        if nvb_utils.isNumber(label):
-            return line
+        line = record[1]
+        label = line[0].lower()
         if label == 'node':
             self.name = nvb_parse.ascii_identifier(line[2])
         elif label == 'endnode':
-            return line
+            return record
         elif label == 'parent':
             self.parent = nvb_parse.ascii_identifier(line[1])
         elif label == 'position':
@@ -80,15 +76,15 @@ class Node(object):
             self.scale = float(line[1])
         elif label == 'wirecolor':
             self.wirecolor = tuple([float(v) for v in line[1:4]])
-        return line
+        return record
 
-    def loadAscii(self, ascii_lines, nodeidx=-1):
+    def loadAscii(self, ascii_records, nodeidx=-1):
         """TODO: DOC."""
         self.nodeidx = nodeidx
-        iterable = iter(ascii_lines)
-        line = True
-        while line is not None:
-            line = self.parse_ascii_line(iterable)
+        iterable = iter(ascii_records)
+        record = True
+        while record is not None:
+            record = self.parse_ascii_line(iterable)
 
     def createObjectData(self, obj, options):
         """TODO: DOC."""
@@ -150,9 +146,9 @@ class Dummy(Node):
         Node.__init__(self, name)
         self.emptytype = nvb_def.Emptytype.DUMMY
 
-    def loadAscii(self, asciiLines, nodeidx=-1):
+    def loadAscii(self, ascii_records, nodeidx=-1):
         """TODO: Doc."""
-        Node.loadAscii(self, asciiLines, nodeidx)
+        Node.loadAscii(self, ascii_records, nodeidx)
 
     def createObjectData(self, obj, options):
         """TODO: DOC."""
@@ -192,16 +188,17 @@ class Reference(Node):
         self.refmodel = nvb_def.null
         self.reattachable = 0
 
-    def parse_ascii_line(self, itlines):
+    def parse_ascii_line(self, itrecords):
         """TODO: Doc."""
-        line = Node.parse_ascii_line(self, itlines)
-        if line:
+        record = Node.parse_ascii_line(self, itrecords)
+        if record:
+            line = record[1]
             label = line[0].lower()
             if label == 'refmodel':
                 self.refmodel = nvb_parse.ascii_identifier(line[1])
             elif label == 'reattachable':
                 self.reattachable = nvb_parse.ascii_bool(line[1])
-        return line
+        return record
 
     def createObjectData(self, obj, options):
         """TODO: Doc."""
@@ -220,6 +217,23 @@ class Reference(Node):
         asciiLines.append('  reattachable ' + str(int(obj.nvb.reattachable)))
 
 
+class MeshData():
+    """Triangulated mesh data of an object, as written on export."""
+
+    def __init__(self):
+        """TODO: Doc."""
+        self.vert_coords = np.empty((0, 3), dtype=np.float32)
+        self.face_verts = []  # Vertex indices per face
+        self.face_uvs = []  # Uv indices per face
+        self.face_groups = []  # Smoothgroup per face
+        self.face_materials = []  # Material index per face
+        self.uv_coords = []  # List of uv coordinates per uv layer
+        self.normals = None  # Per vertex normals, if exported
+        self.tangents = None  # Per vertex tangents, if exported
+        self.vert_colors = []
+        self.aabb_tree = None  # Generated on first use
+
+
 class Trimesh(Node):
     """Default type of Mesh."""
 
@@ -240,17 +254,20 @@ class Trimesh(Node):
         self.shininess = 0
         self.rotatetexture = 0
         self.material = nvb_material.Material()
-        self.vertex_coords = []
-        self.texture_coordinates = [[]]  # list of tex coords = uv layers
-        self.facedef = []
-        self.tangents = []
-        self.normals = []
-        self.colors = []
-
-    def parse_ascii_line(self, itlines):
+        # Mesh data is stored in arrays, one row per vertex/face/...
+        self.vertex_coords = np.zeros((0, 3), dtype=np.float32)
+        # list of tex coords = uv layers
+        self.texture_coordinates = [np.zeros((0, 2), dtype=np.float32)]
+        self.facedef = np.zeros((0, 8), dtype=np.int32)
+        self.tangents = np.zeros((0, 4), dtype=np.float32)
+        self.normals = np.zeros((0, 3), dtype=np.float32)
+        self.colors = np.zeros((0, 3), dtype=np.float32)
+
+    def parse_ascii_line(self, itrecords):
         """TODO: Doc."""
-        line = Node.parse_ascii_line(self, itlines)
-        if line:
+        record = Node.parse_ascii_line(self, itrecords)
+        if record:
+            _, line, rows = record
             label = line[0].lower()
             if label == 'tilefade':
                 self.tilefade = nvb_parse.ascii_int(line[1])
@@ -269,33 +286,26 @@ class Trimesh(Node):
             elif label == 'shininess':
                 self.shininess = nvb_parse.ascii_int(line[1])
             elif label == 'verts':
-                if not self.vertex_coords:
+                if not len(self.vertex_coords):
                     nvals = int(line[1])
-                    tmp = [next(itlines) for _ in range(nvals)]
-                    self.vertex_coords = [tuple(map(nvb_utils.str2float, v))
-                                          for v in tmp]
+                    self.vertex_coords = nvb_parse.ascii_array(rows, nvals, 3)
             elif label == 'faces':
-                if not self.facedef:
+                if not len(self.facedef):
                     nvals = int(line[1])
-                    tmp = [next(itlines) for _ in range(nvals)]
-                    self.facedef = [list(map(int, v)) for v in tmp]
+                    self.facedef = nvb_parse.ascii_array(rows, nvals, 8,
+                                                         np.int32)
             elif label == 'normals':
-                if not self.normals:
+                if not len(self.normals):
                     nvals = int(line[1])
-                    tmp = [next(itlines) for _ in range(nvals)]
-                    self.normals = [tuple(map(nvb_utils.str2float, v))
-                                    for v in tmp]
+                    self.normals = nvb_parse.ascii_array(rows, nvals, 3)
             elif label == 'tangents':
-                if not self.tangents:
+                if not len(self.tangents):
                     nvals = int(line[1])
-                    tmp = [next(itlines) for _ in range(nvals)]
-                    self.tangents = [tuple(map(nvb_utils.str2float, v))
-                                     for v in tmp]
+                    self.tangents = nvb_parse.ascii_array(rows, nvals, 4)
             elif label == 'colors':
-                if not self.colors:
+                if not len(self.colors):
                     nvals = int(line[1])
-                    tmp = [next(itlines) for _ in range(nvals)]
-                    self.colors = [tuple(map(float, v)) for v in tmp]
+                    self.colors = nvb_parse.ascii_array(rows, nvals, 3)
             elif label.startswith('tverts'):
                 tvid = 0
                 if label[6:]:  # might be '', which we interpret as 0
@@ -303,15 +313,15 @@ class Trimesh(Node):
                     tvcnt = len(self.texture_coordinates)
                     if tvid+1 > tvcnt:
                         self.texture_coordinates.extend(
-                            [[] for _ in range(tvid-tvcnt+1)])
-                if not self.texture_coordinates[tvid]:
+                            [np.zeros((0, 2), dtype=np.float32)
+                             for _ in range(tvid-tvcnt+1)])
+                if not len(self.texture_coordinates[tvid]):
                     nvals = int(line[1])
-                    tmp = [next(itlines) for _ in range(nvals)]
                     self.texture_coordinates[tvid] = \
-                        [(float(v[0]), float(v[1])) for v in tmp]
+                        nvb_parse.ascii_array(rows, nvals, 2)
             else:
                 self.material.parse_ascii_line(line)
-        return line
+        return record
 
     def fix_degenerated_tverts(self):
         """Fixes degenerated UVs by adding dummy coordinates."""
@@ -319,63 +329,76 @@ class Trimesh(Node):
             """Return true if the area of the uv triangle is 0."""
             # d = Matrix([[*p1,1],[*p2,1],[*p3,1]]).determinant()
             # return (abs(d) > 0.0001)
-            return (abs((p2-p1).cross(p3-p1)) > 0.00001)
+            e1 = p2 - p1
+            e2 = p3 - p1
+            return (np.abs(e1[:, 0] * e2[:, 1] - e1[:, 1] * e2[:, 0]) >
+                    0.00001)
 
         tverts = self.texture_coordinates[0]
         tvert_cnt = len(self.texture_coordinates[0])
         tvert_dummys = list(range(tvert_cnt, tvert_cnt+3))
-        if tverts and tvert_cnt > 0:
-            add_dummy_uvs = False
-            for f in self.facedef:
-                if is_degenerated(tverts[f[4]], tverts[f[5]], tverts[f[6]]):
-                    add_dummy_uvs = True
-                    f[4], f[5], f[6] = tvert_dummys
-            if add_dummy_uvs:
-                self.texture_coordinates[0].extend([(0, 0), (0, 1), (1, 1)])
+        if tvert_cnt > 0 and len(self.facedef):
+            fd = self.facedef
+            degenerated = is_degenerated(tverts[fd[:, 4]], tverts[fd[:, 5]],
+                                         tverts[fd[:, 6]])
+            if degenerated.any():
+                fd[degenerated, 4:7] = tvert_dummys
+                self.texture_coordinates[0] = np.concatenate(
+                    (tverts, [(0, 0), (0, 1), (1, 1)])).astype(np.float32)
 
     @staticmethod
     def create_vertex_colors(mesh, vcolors, vcname):
         """Create a color map from a per-vertex color list for the mesh."""
         cmap = None
-        if vcolors:
+        if len(vcolors):
             cmap = mesh.vertex_colors.new(name=vcname)
-            # Get all loops for each vertex
-            vert_loop_map = {}
-            for lp in mesh.loops:
-                if lp.vertex_index in vert_loop_map:
-                    vert_loop_map[lp.vertex_index].append(lp.index)
-                else:
-                    vert_loop_map[lp.vertex_index] = [lp.index]
-            # Set color for each vertex (in every loop)
+            loop_cnt = len(mesh.loops)
+            if not loop_cnt:
+                return cmap
+            # Vertex index of each loop, pick the colors per loop from it
+            loop_vert_ids = np.empty(loop_cnt, dtype=np.int32)
+            mesh.loops.foreach_get('vertex_index', loop_vert_ids)
             # BUGFIX: colors have dim 4 on some systems
             #         (should be 3 as per documentation)
             color_dim = len(cmap.data[0].color)
-            if color_dim > 3:
-                for vidx in vert_loop_map:
-                    for lidx in vert_loop_map[vidx]:
-                        cmap.data[lidx].color = \
-                            (*vcolors[vidx], *[0]*(color_dim-3))
-            else:  # Keep the right way separate for speed
-                for vidx in vert_loop_map:
-                    for lidx in vert_loop_map[vidx]:
-                        cmap.data[lidx].color = vcolors[vidx]
+            loop_colors = nvb_meshdata.vertex_loop_data(
+                loop_vert_ids, vcolors, color_dim)
+            cmap.data.foreach_set('color', loop_colors.ravel())
         return cmap
 
     @staticmethod
-    def create_sharp_edges(blen_mesh, sgr_list):
+    def create_sharp_edges(blen_mesh, face_vert_ids, sgr_list):
         """Create sharp edges from (per face) smoothgroup list."""
-        bm = bmesh.new()
-        bm.from_mesh(blen_mesh)
-        if hasattr(bm.edges, "ensure_lookup_table"):
-            bm.edges.ensure_lookup_table()
-        # Mark edge as sharp if its faces belong to different smooth groups
-        for e in bm.edges:
-            f = e.link_faces
-            if (len(f) > 1) and (sgr_list[f[0].index] != sgr_list[f[1].index]):
-                edgeIdx = e.index
-                blen_mesh.edges[edgeIdx].use_edge_sharp = True
-        bm.free()
-        del bm
+        edge_cnt = len(blen_mesh.edges)
+        if not edge_cnt or not len(face_vert_ids):
+            return
+        # Every edge of every face as (smaller, larger) vertex index
+        face_edges = np.stack((face_vert_ids,
+                               np.roll(face_vert_ids, -1, axis=1)), axis=2)
+        face_edges = face_edges.reshape(-1, 2).astype(np.int64)
+        face_edges.sort(axis=1)
+        vert_cnt = len(blen_mesh.vertices)
+        edge_keys = face_edges[:, 0] * vert_cnt + face_edges[:, 1]
+        edge_sgr = np.repeat(sgr_list, 3)
+        # Group by edge, it's sharp if its faces have different smoothgroups
+        order = np.argsort(edge_keys, kind='stable')
+        edge_keys = edge_keys[order]
+        edge_sgr = edge_sgr[order]
+        group_start = np.flatnonzero(
+            np.concatenate(([True], edge_keys[1:] != edge_keys[:-1])))
+        edge_keys = edge_keys[group_start]
+        edge_sharp = np.minimum.reduceat(edge_sgr, group_start) != \
+            np.maximum.reduceat(edge_sgr, group_start)
+        # Match to blender's edges
+        blen_edges = np.empty(edge_cnt * 2, dtype=np.int32)
+        blen_mesh.edges.foreach_get('vertices', blen_edges)
+        blen_edges = blen_edges.reshape(-1, 2).astype(np.int64)
+        blen_edges.sort(axis=1)
+        blen_keys = blen_edges[:, 0] * vert_cnt + blen_edges[:, 1]
+        idx = np.minimum(np.searchsorted(edge_keys, blen_keys),
+                         len(edge_keys) - 1)
+        use_edge_sharp = (edge_keys[idx] == blen_keys) & edge_sharp[idx]
+        blen_mesh.edges.foreach_set('use_edge_sharp', use_edge_sharp)
 
     def create_blender_mesh(self, blen_name, options):
         """TODO: Doc."""
@@ -384,14 +407,14 @@ class Trimesh(Node):
         blen_mesh = bpy.data.meshes.new(name=blen_name)
         # Create vertices
         blen_mesh.vertices.add(len(self.vertex_coords))
-        blen_mesh.vertices.foreach_set('co', unpack_list(self.vertex_coords))
+        blen_mesh.vertices.foreach_set('co', self.vertex_coords.ravel())
 
         # Create faces
-        face_vert_ids = [v[0:3] for v in self.facedef]
+        face_vert_ids = self.facedef[:, 0:3]
         face_cnt = len(face_vert_ids)    
         # Loops
         blen_mesh.loops.add(face_cnt * 3)
-        blen_mesh.loops.foreach_set('vertex_index', unpack_list(face_vert_ids))
+        blen_mesh.loops.foreach_set('vertex_index', face_vert_ids.ravel())
         # Polygons
         blen_mesh.polygons.add(face_cnt)
         blen_mesh.polygons.foreach_set('loop_start', range(0, face_cnt * 3, 3))
@@ -417,18 +440,16 @@ class Trimesh(Node):
                                                [0] * num_blen_polygons)
 
         # Create UV maps
-        if self.facedef:
-            face_uv_indices = [(f[4], f[5], f[6]) for f in self.facedef]
+        if len(self.facedef):
+            face_uv_indices = self.facedef[:, 4:7]
             # EEEKADOODLE fix - Not necessary?
             # face_uv_indices = \
             #    [(f[5], f[6], f[4]) if f[6] == 0 else (f[4], f[5], f[6])
             #     for f in self.facedef]
-            face_uv_indices = unpack_list(face_uv_indices)
+            face_uv_indices = face_uv_indices.ravel()
             for layer_idx, uv_coords in enumerate(self.texture_coordinates):
-                if uv_coords:
-                    face_uv_coords = [uv_coords[uvi]
-                                      for uvi in face_uv_indices]
-                    face_uv_coords = unpack_list(face_uv_coords)
+                if len(uv_coords):
+                    face_uv_coords = uv_coords[face_uv_indices].ravel()
                     uv_layer = blen_mesh.uv_layers.new(do_init=False)
                     uv_layer.name = "tverts"+str(layer_idx)
                     uv_layer.data.foreach_set(
@@ -442,9 +463,9 @@ class Trimesh(Node):
         blen_mesh.update()
         if options.geom_smoothgroups:
             # Count number of unique smooth groups
-            sgr_list_unique = set([fd[3] for fd in self.facedef])
+            sgr_list_unique = np.unique(self.facedef[:, 3])
             # Single smooth group with id=0   =>   Non-smooth
-            if len(sgr_list_unique) == 1 and sgr_list_unique.pop() == 0:
+            if len(sgr_list_unique) == 1 and sgr_list_unique[0] == 0:
                 blen_mesh.polygons.foreach_set('use_smooth', [False] * num_blen_polygons)
                 blen_mesh.use_auto_smooth = False
                 blen_mesh.auto_smooth_angle = 4.71
@@ -454,18 +475,17 @@ class Trimesh(Node):
                 blen_mesh.polygons.foreach_set('use_smooth', [True] * num_blen_polygons)
                 blen_mesh.use_auto_smooth = True
                 blen_mesh.auto_smooth_angle = 1.57
-                self.create_sharp_edges(blen_mesh, [fd[3] for fd in self.facedef])
+                self.create_sharp_edges(blen_mesh, face_vert_ids,
+                                        self.facedef[:, 3])
                 self.tmp_recommend_smoothgroup_setting = 'AUTO'
                 #blen_mesh.nvb.smoothgroup = 'AUTO'
 
-        if self.normals and blen_mesh.loops and options.geom_normals:
+        if len(self.normals) and blen_mesh.loops and options.geom_normals:
             # Create normals and use them for shading
-            blen_mesh.vertices.foreach_set('normal', unpack_list(self.normals))
+            blen_mesh.vertices.foreach_set('normal', self.normals.ravel())
 
             blen_mesh.create_normals_split()
-            per_loop_normals = [no for vidx_list in face_vert_ids
-                                for vidx in vidx_list
-                                for no in self.normals[vidx]]
+            per_loop_normals = self.normals[face_vert_ids].ravel()
             blen_mesh.loops.foreach_set("normal", per_loop_normals)
 
             clnors = array.array('f', [0.0] * (len(blen_mesh.loops) * 3))
@@ -520,9 +540,13 @@ class Trimesh(Node):
         return obj
 
     @staticmethod
-    def generateAsciiMesh(obj, ascii_lines, options):
-        """TODO: Doc."""
+    def get_mesh_data(obj, options):
+        """Get the evaluated and triangulated mesh data for export.
 
+        Results are kept in options.mesh_cache, so every object is only
+        evaluated and triangulated once, even if it is exported multiple
+        times (aabb and walkmesh, animmeshes in every animation).
+        """
         def mesh_triangulate(mesh, do_split=True, do_split_angle=3.14):
             """Triangulate using bmesh to retain sharp edges."""
             bm = bmesh.new()
@@ -557,6 +581,11 @@ class Trimesh(Node):
                 if options.geom_smoothgroups_distinct_verts:
                     g = nvb_utils.AuroraSmoothgroupGraph()
                     group_ids = g.calc_smooth_groups(blen_mesh)
+                    if g.conflicts:
+                        options.warnings.append(
+                            obj.name + ': ' + str(g.conflicts) +
+                            ' smoothgroup(s) share vertices with groups of '
+                            'the same id')
                 else:
                     group_ids, _ = blen_mesh.calc_smooth_groups(use_bitflags=options.geom_smoothgroups_binary)
             return group_ids
@@ -566,20 +595,25 @@ class Trimesh(Node):
             # calc_tangents() calls calc_normals_split() implicitly
             mesh.calc_tangents(uvmap=uvl_name)
 
-            per_loop_data = [(lp.vertex_index,
-                              lp.normal, lp.tangent, lp.bitangent_sign)
-                             for lp in mesh.loops]
-            per_vertex_data = [[(n, t, b) for i, n, t, b in per_loop_data
-                                if i == vidx]
-                               for vidx in range(len(mesh.vertices))]
-            normals = [d[0][0] for d in per_vertex_data]
-            tangents = [[*d[0][1]] + [d[0][2]] for d in per_vertex_data]
-            # per_vertex_data = {l.vertex_index: (l.normal,
-            #                                     l.tangent,
-            #                                     l.bitangent_sign)
-            #                    for l in mesh.loops}
-            # normals = [d[0] for d in per_vertex_data.values()]
-            # tangents = [[*d[1]] + [d[2]] for d in per_vertex_data.values()]
+            loop_cnt = len(mesh.loops)
+            loop_vert_ids = np.empty(loop_cnt, dtype=np.int32)
+            mesh.loops.foreach_get('vertex_index', loop_vert_ids)
+            loop_normals = np.empty((loop_cnt, 3), dtype=np.float32)
+            mesh.loops.foreach_get('normal', loop_normals.ravel())
+            # Tangent and bitangent sign as 4th component
+            loop_tangents = np.empty((loop_cnt, 4), dtype=np.float32)
+            loop_tangents_xyz = np.empty((loop_cnt, 3), dtype=np.float32)
+            mesh.loops.foreach_get('tangent', loop_tangents_xyz.ravel())
+            loop_tangents[:, :3] = loop_tangents_xyz
+            loop_sign = np.empty(loop_cnt, dtype=np.float32)
+            mesh.loops.foreach_get('bitangent_sign', loop_sign)
+            loop_tangents[:, 3] = loop_sign
+            # Each vertex takes the data from the first loop using it
+            vert_cnt = len(mesh.vertices)
+            normals = nvb_meshdata.first_loop_data(loop_vert_ids, vert_cnt,
+                                                   loop_normals)
+            tangents = nvb_meshdata.first_loop_data(loop_vert_ids, vert_cnt,
+                                                    loop_tangents)
             return normals, tangents
 
         def mesh_get_uvs_to_export(mesh, uv_order='ACT'):
@@ -643,7 +677,11 @@ class Trimesh(Node):
             per_loop_data = {lp.vertex_index: vc.color[:3]
                              for lp, vc in zip(mesh.loops, vcolor_data)}
             return per_loop_data.values()
-      
+
+        mesh_cache = getattr(options, 'mesh_cache', None)
+        if mesh_cache is not None and obj.name in mesh_cache:
+            return mesh_cache[obj.name]
+
         obj_to_export = None
         if options.apply_modifiers:
             obj_to_export = obj.evaluated_get(options.depsgraph)
@@ -652,23 +690,20 @@ class Trimesh(Node):
 
         me = obj_to_export.to_mesh(preserve_all_data_layers=True, depsgraph=options.depsgraph)
 
-        # me.polygons.foreach_set("use_smooth", [True]*len(me.polygons))
-        
         # Triangulate and split
         if obj.data.use_auto_smooth:
             mesh_triangulate(me, options.geom_smoothing_split, obj.data.auto_smooth_angle)
         else:
             mesh_triangulate(me, options.geom_smoothing_split, 3.14)
 
-        # Add vertices
-        me_vertices = me.vertices
-        ascii_lines.append('  verts ' + str(len(me_vertices)))
-        fstr = '   ' + 3 * ' {: 8.5f}'
-        ascii_lines.extend([fstr.format(*v.co) for v in me_vertices])
+        mesh_data = MeshData()
+        # Vertices
+        mesh_data.vert_coords = np.empty((len(me.vertices), 3),
+                                         dtype=np.float32)
+        me.vertices.foreach_get('co', mesh_data.vert_coords.ravel())
 
         # Per face uv indices and a list of their coordinates
-        me_face_uv = [[0, 0, 0]] * len(me.polygons)
-        dig_u = 1  # digits for formatting
+        mesh_data.face_uvs = [[0, 0, 0]] * len(me.polygons)
         if (options.uv_level == 'ALL') or \
            (options.uv_level == 'REN' and obj.nvb.render):
             # TODO: Adds scaling factor from the texture slot to uv coordinates
@@ -681,83 +716,111 @@ class Trimesh(Node):
                          options.uv_merge)
 
             # Generate the tverts
-            me_uv_coord_list = []
             if uv_layer_list:
-                me_face_uv, me_uv_coord_list = mesh_get_uvs(
+                mesh_data.face_uvs, mesh_data.uv_coords = mesh_get_uvs(
                     me, uv_layer_list, merge_uvs)
-                if me_uv_coord_list:
-                    dig_u = len(str(len(me_uv_coord_list[0])))
-                else:
+                if not mesh_data.uv_coords:
                     print('Neverblender: ERROR - Could not find UVs for ' + obj.name)
 
-            # Write tverts to file (if any)
-            if me_uv_coord_list:
-                fstr = '    {: 7.4f} {: 7.4f}  0'
-                # First list entry as "tverts"
-                fstr_tv = '  tverts {:d}'
-                coords0 = me_uv_coord_list[0]
-                ascii_lines.append(fstr_tv.format(len(coords0)))
-                ascii_lines.extend([fstr.format(c[0], c[1]) for c in coords0])
-                # Other list entries as "tvertsN", with N>0
-                fstr_tv = '  tverts{:d} {:d}'
-                for idx, coords in enumerate(me_uv_coord_list[1:], 1):
-                    ascii_lines.append(fstr_tv.format(idx, len(coords)))
-                    ascii_lines.extend([fstr.format(c[0], c[1])
-                                        for c in coords])
-                del me_uv_coord_list
-
-                # Write normals and tangents
-                if options.geom_normals and obj.nvb.render:
-                    normal_uv = uv_layer_list[0].name
-                    me_normals, me_tangents = mesh_get_normals(me, normal_uv)
-
-                    ascii_lines.append('  normals ' + str(len(me_normals)))
-                    fstr = '   ' + 3 * ' {: 8.5f}'
-                    ascii_lines.extend([fstr.format(*n) for n in me_normals])
-                    del me_normals
-
-                    ascii_lines.append('  tangents ' + str(len(me_tangents)))
-                    fstr = '   ' + 3 * ' {: 8.5f}' + ' {: 3.1f}'
-                    ascii_lines.extend([fstr.format(*t) for t in me_tangents])
-                    del me_tangents
+            # Normals and tangents
+            if mesh_data.uv_coords and \
+               options.geom_normals and obj.nvb.render:
+                normal_uv = uv_layer_list[0].name
+                mesh_data.normals, mesh_data.tangents = \
+                    mesh_get_normals(me, normal_uv)
 
         # Generate Smoothgroups
         if options.geom_smoothing_groups:
-            me_face_grp = mesh_get_smoothgroups(me, obj_to_export, options)
+            mesh_data.face_groups = mesh_get_smoothgroups(me, obj_to_export, options)
         else:
-            me_face_grp = [1] * len(me.polygons)
+            mesh_data.face_groups = [1] * len(me.polygons)
+
+        # Face vertex indices
+        mesh_data.face_verts = [tuple(p.vertices) for p in me.polygons]
+
+        # Face material indices
+        mesh_data.face_materials = [p.material_index for p in me.polygons]
+
+        # Vertex color
+        mesh_data.vert_colors = list(mesh_get_vertex_colors(me))
+
+        # Cleanup
+        obj_to_export.to_mesh_clear()
+        if mesh_cache is not None:
+            mesh_cache[obj.name] = mesh_data
+        return mesh_data
+
+    @staticmethod
+    def generateAsciiMesh(obj, ascii_lines, options):
+        """TODO: Doc."""
+        mesh_data = Trimesh.get_mesh_data(obj, options)
+
+        # Add vertices
+        vert_cnt = len(mesh_data.vert_coords)
+        ascii_lines.append('  verts ' + str(vert_cnt))
+        fstr = '   ' + 3 * ' % 8.5f'
+        nvb_writer.extend_rows(ascii_lines, fstr, mesh_data.vert_coords)
 
+        # Write tverts to file (if any)
+        dig_u = 1  # digits for formatting
+        if mesh_data.uv_coords:
+            dig_u = len(str(len(mesh_data.uv_coords[0])))
+            fstr = '    % 7.4f % 7.4f  0'
+            # First list entry as "tverts"
+            fstr_tv = '  tverts {:d}'
+            coords0 = mesh_data.uv_coords[0]
+            ascii_lines.append(fstr_tv.format(len(coords0)))
+            nvb_writer.extend_rows(ascii_lines, fstr,
+                                   np.reshape(coords0, (-1, 2)))
+            # Other list entries as "tvertsN", with N>0
+            fstr_tv = '  tverts{:d} {:d}'
+            for idx, coords in enumerate(mesh_data.uv_coords[1:], 1):
+                ascii_lines.append(fstr_tv.format(idx, len(coords)))
+                nvb_writer.extend_rows(ascii_lines, fstr,
+                                       np.reshape(coords, (-1, 2)))
+
+        # Write normals and tangents
+        if mesh_data.normals is not None:
+            ascii_lines.append('  normals ' + str(len(mesh_data.normals)))
+            fstr = '   ' + 3 * ' % 8.5f'
+            nvb_writer.extend_rows(ascii_lines, fstr, mesh_data.normals)
+
+            ascii_lines.append('  tangents ' + str(len(mesh_data.tangents)))
+            fstr = '   ' + 3 * ' % 8.5f' + ' % 3.1f'
+            nvb_writer.extend_rows(ascii_lines, fstr, mesh_data.tangents)
+
+        # Smoothgroups
+        me_face_grp = mesh_data.face_groups
         if me_face_grp:
             dig_g = max(1, len(str(max(me_face_grp))))  # req digits for format
         else:
             print('Neverblender: ERROR - Could not create smoothgroups for ' + obj.name)
 
         # Face vertex indices
-        me_face_vert = [tuple(p.vertices) for p in me.polygons]
-        dig_v = max(1, len(str(len(me_vertices))))  # req digits for format
+        me_face_vert = mesh_data.face_verts
+        dig_v = max(1, len(str(vert_cnt)))  # req digits for format
 
         # Face material indices
-        me_face_mat = [p.material_index for p in me.polygons]
+        me_face_mat = mesh_data.face_materials
         dig_m = max(1, len(str(max(me_face_mat))))  # req digits for format
 
         # Vertex color
-        me_vert_colors = mesh_get_vertex_colors(me)
-        if me_vert_colors:
-            ascii_lines.append('  colors ' + str(len(me_vert_colors)))
-            fstr = '   ' + 3 * ' {:3.2f}'
-            ascii_lines.extend([fstr.format(*vc) for vc in me_vert_colors])
+        if mesh_data.vert_colors:
+            ascii_lines.append('  colors ' + str(len(mesh_data.vert_colors)))
+            fstr = '   ' + 3 * ' %3.2f'
+            nvb_writer.extend_rows(ascii_lines, fstr, mesh_data.vert_colors)
 
         # Write faces to file
-        face_data = zip(me_face_vert, me_face_grp, me_face_uv, me_face_mat)
+        face_data = np.column_stack(
+            (np.array(me_face_vert, dtype=np.int64).reshape(-1, 3),
+             me_face_grp,
+             np.array(mesh_data.face_uvs, dtype=np.int64).reshape(-1, 3),
+             me_face_mat)).astype(np.int64)
         ascii_lines.append('  faces ' + str(len(me_face_vert)))
         fstr = '   ' + \
-               3 * (' {:' + str(dig_v) + 'd}') + ' {:' + str(dig_g) + 'd} ' + \
-               3 * (' {:' + str(dig_u) + 'd}') + ' {:' + str(dig_m) + 'd}'
-        ascii_lines.extend([fstr.format(*fd[0], fd[1], *fd[2], fd[3])
-                            for fd in face_data])
-        # Cleanup
-        # bpy.data.meshes.remove(me)
-        obj_to_export.to_mesh_clear()
+               3 * (' %' + str(dig_v) + 'd') + ' %' + str(dig_g) + 'd ' + \
+               3 * (' %' + str(dig_u) + 'd') + ' %' + str(dig_m) + 'd'
+        nvb_writer.extend_rows(ascii_lines, fstr, face_data)
 
     @classmethod
     def generateAsciiData(cls, obj, asciiLines, options, iswalkmesh=False):
@@ -822,12 +885,13 @@ class Danglymesh(Trimesh):
         self.period = 1.0
         self.tightness = 1.0
         self.displacement = 1.0
-        self.constraints = []
+        self.constraints = np.zeros(0, dtype=np.float32)
 
-    def parse_ascii_line(self, itlines):
+    def parse_ascii_line(self, itrecords):
         """TODO: Doc."""
-        line = Trimesh.parse_ascii_line(self, itlines)
-        if line:
+        record = Trimesh.parse_ascii_line(self, itrecords)
+        if record:
+            _, line, rows = record
             label = line[0].lower()
             if label == 'period':
                 self.period = nvb_parse.ascii_float(line[1])
@@ -836,11 +900,11 @@ class Danglymesh(Trimesh):
             elif label == 'displacement':
                 self.displacement = nvb_parse.ascii_float(line[1])
             elif label == 'constraints':
-                if not self.constraints:
+                if not len(self.constraints):
                     vcnt = int(line[1])
-                    tmp = [next(itlines) for _ in range(vcnt)]
-                    self.constraints = [float(v[0]) for v in tmp]
-        return line
+                    self.constraints = \
+                        nvb_parse.ascii_array(rows, vcnt, 1)[:, 0]
+        return record
 
     def createConstraints(self, obj):
         """Create a vertex group for the object."""
@@ -850,9 +914,13 @@ class Danglymesh(Trimesh):
         in NWN. Range is [0.0, 255.0] as opposed to [0.0, 1.0] in Blender
         """
         vgroup = obj.vertex_groups.new(name='constraints')
-        for vertexIdx, constraint in enumerate(self.constraints):
-            weight = constraint/255
-            vgroup.add([vertexIdx], weight, 'REPLACE')
+        # Usually only a few distinct values: One add() call for each
+        values, value_ids = np.unique(self.constraints, return_inverse=True)
+        vert_ids = np.argsort(value_ids, kind='stable')
+        split_ids = np.cumsum(np.bincount(value_ids))[:-1]
+        for value, value_vert_ids in zip(values,
+                                         np.split(vert_ids, split_ids)):
+            vgroup.add(value_vert_ids.tolist(), float(value)/255, 'REPLACE')
         obj.nvb.constraints = vgroup.name
 
     def createObjectData(self, obj, options):
@@ -901,65 +969,74 @@ class Skinmesh(Trimesh):
     """Skinmeshes are Trimeshes where every vertex has a weight."""
 
     nodetype = nvb_def.Nodetype.SKIN
+    # Single vertex weight: vertex index, bone index, weight
+    weight_dtype = np.dtype([('vertex', np.int32), ('bone', np.int32),
+                             ('weight', np.float32)])
 
     def __init__(self, name='UNNAMED'):
         """TODO: Doc."""
         Trimesh.__init__(self, name)
         self.meshtype = nvb_def.Meshtype.SKIN
 
-        self.weights = []
+        # Names of the bones (vertex groups), referenced by index in weights
+        self.weight_bones = []
+        self.weights = np.zeros(0, dtype=Skinmesh.weight_dtype)
 
     def loadAsciiWeights(self, asciiLines):
         """TODO: Doc."""
-        def chunker(seq, size):
-            """TODO: DOC."""
-            return (seq[pos:pos + size] for pos in range(0, len(seq), size))
-
-        for line in asciiLines:
+        bone_ids = {n: i for i, n in enumerate(self.weight_bones)}
+        weights = []
+        for vert_idx, line in enumerate(asciiLines):
             # A line looks like this
             # [group_name, vertex_weight, group_name, vertex_weight]
-            # We create a list looking like this:
-            # [[group_name, vertex_weight], [group_name, vertex_weight]]
-            name_weight_pairs = []
-            for chunk in chunker(line, 2):
-                try:
-                    n = chunk[0]
-                    w = chunk[1]
-                except IndexError:
-                    continue
-                try:
-                    n = nvb_parse.ascii_identifier(n)
-                    w = nvb_parse.ascii_float(w)
-                except ValueError:
-                    continue
-                if not any(gwp[0] == n for gwp in name_weight_pairs):
-                    name_weight_pairs.append([n, w])
-            self.weights.append(name_weight_pairs)
-
-    def parse_ascii_line(self, itlines):
+            # We create a (vertex_idx, bone_idx, vertex_weight) entry for
+            # each pair
+            for n, w in zip(line[0::2], line[1::2]):
+                n = nvb_parse.ascii_identifier(n)
+                if n not in bone_ids:
+                    bone_ids[n] = len(self.weight_bones)
+                    self.weight_bones.append(n)
+                weights.append((vert_idx, bone_ids[n],
+                                nvb_parse.ascii_float(w)))
+        weights = np.array(weights, dtype=Skinmesh.weight_dtype)
+        # Bones listed twice for a vertex: The first weight wins, later
+        # ones are ignored
+        self.weights = weights[nvb_meshdata.first_pair_ids(
+            weights['vertex'], weights['bone'], len(self.weight_bones))]
+
+    def parse_ascii_line(self, itrecords):
         """TODO: Doc."""
-        line = Trimesh.parse_ascii_line(self, itlines)
-        if line:
+        record = Trimesh.parse_ascii_line(self, itrecords)
+        if record:
+            line = record[1]
             label = line[0].lower()
             if label == 'weights':
+                # Weights start with bone names: Each one is a separate record
+                # Compiled mdls have them as rows of this record instead
                 cnt = int(line[1])
-                tmp = [next(itlines) for _ in range(cnt)]
+                if record[2]:
+                    tmp = record[2][:cnt]
+                else:
+                    tmp = [next(itrecords)[1] for _ in range(cnt)]
                 self.loadAsciiWeights(tmp)
-        return line
+        return record
 
     def createSkinGroups(self, obj):
         """TODO: Doc."""
-        skinGroupDict = {}
-        for vertIdx, vertMemberships in enumerate(self.weights):
-            for membership in vertMemberships:
-                if membership[0] in skinGroupDict:
-                    skinGroupDict[membership[0]].add([vertIdx],
-                                                     membership[1],
-                                                     'REPLACE')
-                else:
-                    vgroup = obj.vertex_groups.new(name=membership[0])
-                    skinGroupDict[membership[0]] = vgroup
-                    vgroup.add([vertIdx], membership[1], 'REPLACE')
+        if not len(self.weights):
+            return
+        vgroups = [obj.vertex_groups.new(name=n) for n in self.weight_bones]
+        # One add() call for all vertices with the same bone and weight
+        weights = self.weights[np.lexsort((self.weights['weight'],
+                                           self.weights['bone']))]
+        bone_ids = weights['bone']
+        values = weights['weight']
+        split_ids = np.flatnonzero((bone_ids[1:] != bone_ids[:-1]) |
+                                   (values[1:] != values[:-1])) + 1
+        for bucket in np.split(weights, split_ids):
+            vgroups[bucket['bone'][0]].add(bucket['vertex'].tolist(),
+                                           float(bucket['weight'][0]),
+                                           'REPLACE')
 
     def createObjectData(self, obj, options):
         """TODO: Doc."""
@@ -1095,10 +1172,11 @@ class Emitter(Node):
                               (-1.0,  1.0, 0.0)]
         self.facedef = [(0, 1, 0)]
 
-    def parse_ascii_line(self, itlines):
+    def parse_ascii_line(self, itrecords):
         """TODO: Doc."""
-        line = Node.parse_ascii_line(self, itlines)
-        if line:
+        record = Node.parse_ascii_line(self, itrecords)
+        if record:
+            line = record[1]
             label = line[0].lower()
             if label == 'xsize':  # emitter mesh size (in cm)
                 self.xsize = float(line[1])
@@ -1112,7 +1190,7 @@ class Emitter(Node):
                     else:
                         value = convert(line[1].lower())
                     self.blender_data.append((data_path, value))
-        return line
+        return record
 
     def create_particle_system(self, obj, options):
         part_mod = obj.modifiers.new(name='particles', type='PARTICLE_SYSTEM')
@@ -1309,15 +1387,13 @@ class Light(Node):
         self.flarePositions = []
         self.flareCShifts = []  # Flare color shifts
 
-    def parse_ascii_line(self, itlines):
+    def parse_ascii_line(self, itrecords):
         """TODO: Doc."""
-        line = Node.parse_ascii_line(self, itlines)
-        if not line:
-            return line
-        try:
-            label = line[0].lower()
-        except (IndexError, AttributeError):
-            return line  # Probably empty line, skip it
+        record = Node.parse_ascii_line(self, itrecords)
+        if not record:
+            return record
+        _, line, rows = record
+        label = line[0].lower()
         if (label == 'radius'):
             self.radius = nvb_parse.ascii_float(line[1])
         elif (label == 'shadow'):
@@ -1346,65 +1422,53 @@ class Light(Node):
             self.flareradius = nvb_parse.ascii_float(line[1])
         elif (label == 'texturenames'):
             if not self.flareTextures:
+                # Texture names are strings: Each one is a separate record
                 vcnt = self.flareNumValues[0]
-                tmp = [next(itlines) for _ in range(vcnt)]
+                tmp = [next(itrecords)[1] for _ in range(vcnt)]
                 self.flareTextures = [v[0] for v in tmp]
         elif (label == 'flaresizes'):
             if not self.flareSizes:
                 vcnt = self.flareNumValues[1]
-                tmp = [next(itlines) for _ in range(vcnt)]
+                tmp = rows[:vcnt]
                 self.flareSizes = [float(v[0]) for v in tmp]
         elif (label == 'flarepositions'):
             if not self.flarePositions:
                 vcnt = self.flareNumValues[2]
-                tmp = [next(itlines) for _ in range(vcnt)]
+                tmp = rows[:vcnt]
                 self.flarePositions = [float(v[0]) for v in tmp]
         elif (label == 'flarecolorshifts'):
             if not self.flareCShifts:
                 vcnt = self.flareNumValues[3]
-                tmp = [next(itlines) for _ in range(vcnt)]
+                tmp = rows[:vcnt]
                 self.flareCShifts = [tuple(map(float, v)) for v in tmp]
-        return line
+        return record
 
-    def loadNumFlareValues(self, asciiLines):
+    def loadNumFlareValues(self, ascii_records):
         """Get the number of values for flares. There may not be a parameter specifying their number"""
-        l_isNumber = nvb_utils.isNumber
-        for idx, aline in enumerate(asciiLines):
-            try:
-                label = aline[0].lower()
-            except (IndexError, AttributeError):
-                return aline  # Probably empty line or comment
-            else:
-                if not nvb_utils.isNumber(label):
-                    if (label == 'texturenames'):
-                        # Can't do anything here (all strings, can't distinguish from keywords)
-                        pass
-                    elif (label == 'flaresizes'):
-                        vcnt = next((i for i, v in enumerate(asciiLines[idx+1:])
-                                    if not l_isNumber(v[0])), -1)
-                        self.flareNumValues[1] = vcnt
-                    elif (label == 'flarepositions'):
-                        vcnt = next((i for i, v in enumerate(asciiLines[idx+1:])
-                                    if not l_isNumber(v[0])), -1)
-                        self.flareNumValues[2] = vcnt
-                    elif (label == 'flarecolorshifts'):
-                        vcnt = next((i for i, v in enumerate(asciiLines[idx+1:])
-                                    if not l_isNumber(v[0])), -1)
-                        self.flareNumValues[3] = vcnt
-                # We still need to set number of textures
-                self.flareNumValues[0] = min(self.flareNumValues[1:])
-        
-
-    def loadAscii(self, asciiLines, nodeidx=-1):
+        for _, line, rows in ascii_records:
+            label = line[0].lower()
+            if (label == 'texturenames'):
+                # Can't do anything here (all strings, can't distinguish from keywords)
+                pass
+            elif (label == 'flaresizes'):
+                self.flareNumValues[1] = len(rows)
+            elif (label == 'flarepositions'):
+                self.flareNumValues[2] = len(rows)
+            elif (label == 'flarecolorshifts'):
+                self.flareNumValues[3] = len(rows)
+            # We still need to set number of textures
+            self.flareNumValues[0] = min(self.flareNumValues[1:])
+
+    def loadAscii(self, ascii_records, nodeidx=-1):
         """TODO: DOC."""
         self.nodeidx = nodeidx
         #  Need to do two passes. First one is to find the number of flares
-        self.loadNumFlareValues(asciiLines)
+        self.loadNumFlareValues(ascii_records)
         # Second pass to get the values
-        iterable = iter(asciiLines)
-        aline = True
-        while aline is not None:
-            aline = self.parse_ascii_line(iterable)
+        iterable = iter(ascii_records)
+        record = True
+        while record is not None:
+            record = self.parse_ascii_line(iterable)
 
     def createLamp(self, name):
         """TODO: Doc."""
@@ -1514,45 +1578,14 @@ class Aabb(Trimesh):
     @staticmethod
     def generateAsciiAABB(obj, ascii_lines, options):
         """TODO: Doc."""
-        def mesh_triangulate(mesh):
-            """Triangulate a mesh using bmesh to retain sharp edges."""
-            bm = bmesh.new()
-            bm.from_mesh(mesh)
-            bmesh.ops.triangulate(bm, faces=bm.faces)
-            bm.to_mesh(mesh)
-            bm.free()
-            del bm
-
-        obj_to_export = None
-        if options.apply_modifiers:
-            obj_to_export = obj.evaluated_get(options.depsgraph)
-        else:
-            obj_to_export = obj.original
-        me = obj_to_export.to_mesh(preserve_all_data_layers=True,
-                                   depsgraph=options.depsgraph)
-        mesh_triangulate(me)
-
-        poly_list = []
-        for poly_idx, poly in enumerate(me.polygons):
-            if (len(poly.vertices) == 3):
-                # Tri
-                v0, v1, v2 = poly.vertices[:3]
-
-                centroid = mathutils.Vector((me.vertices[v0].co +
-                                             me.vertices[v1].co +
-                                             me.vertices[v2].co)/3)
-                poly_list.append((poly_idx,
-                                 [me.vertices[v0].co,
-                                  me.vertices[v1].co,
-                                  me.vertices[v2].co],
-                                 centroid))
-            else:  # Ngon or not a tri (shouldn't happen)
-                print('Neverblender: WARNING - Ngon in walkmesh. \
-                       Unable to generate aabb.')
-                return
-
-        aabb_tree = []
-        nvb_aabb.generate_tree(aabb_tree, poly_list)
+        # Same triangulation as the faces written by generateAsciiMesh
+        mesh_data = Trimesh.get_mesh_data(obj, options)
+        if mesh_data.aabb_tree is None:
+            face_vert_ids = np.array(mesh_data.face_verts,
+                                     dtype=np.int64).reshape(-1, 3)
+            mesh_data.aabb_tree = nvb_aabb.generate_tree_sah(
+                mesh_data.vert_coords[face_vert_ids])
+        aabb_tree = list(mesh_data.aabb_tree)
 
         if aabb_tree:
             fstr = '  aabb' + \
@@ -1578,13 +1611,13 @@ class Aabb(Trimesh):
         blen_mesh = bpy.data.meshes.new(name=blen_name)
         # Create vertices
         blen_mesh.vertices.add(len(self.vertex_coords))
-        blen_mesh.vertices.foreach_set('co', unpack_list(self.vertex_coords))
+        blen_mesh.vertices.foreach_set('co', self.vertex_coords.ravel())
         # Create faces
-        face_vert_ids = [v[0:3] for v in self.facedef]
+        face_vert_ids = self.facedef[:, 0:3]
         face_cnt = len(face_vert_ids)
         # Loops
         blen_mesh.loops.add(face_cnt * 3)
-        blen_mesh.loops.foreach_set('vertex_index', unpack_list(face_vert_ids))
+        blen_mesh.loops.foreach_set('vertex_index', face_vert_ids.ravel())
         # Polygons
         blen_mesh.polygons.add(face_cnt)
         blen_mesh.polygons.foreach_set('loop_start', range(0, face_cnt * 3, 3))
@@ -1595,10 +1628,10 @@ class Aabb(Trimesh):
 
         if nvb_utils.create_wok_materials(blen_mesh):
             blen_mesh.update()
-            if len(blen_mesh.materials) > max([f[7] for f in self.facedef]):
+            if len(blen_mesh.materials) > self.facedef[:, 7].max():
                 # Apply the walkmesh materials to each face
                 blen_mesh.polygons.foreach_set('material_index',
-                                               [f[7] for f in self.facedef])
+                                               self.facedef[:, 7].ravel())
                 blen_mesh.update()
 
         blen_mesh.validate(clean_customdata=False)
@@ -209,16 +209,8 @@ class NVB_OT_amt_amt2psb(bpy.types.Operator):
         """Copies keyframes from armature bone to pseudo bone."""
         def insert_kfp(fcu, frames, values, dp, dp_dim):
             # Add keyframes to fcurves
-            kfp_list = [fcu[d].keyframe_points for d in range(dp_dim)]
-            kfp_cnt = [len(fcu[d].keyframe_points) for d in range(dp_dim)]
-            list(map(lambda x: x.add(len(values)), kfp_list))
-            # Set values for all keyframe points
-            for i, (frm, val) in enumerate(zip(frames, values)):
-                for d in range(dp_dim):
-                    kfp = kfp_list[d][kfp_cnt[d]+i]
-                    kfp.co = frm, val[d]
-                    kfp.interpolation = 'LINEAR'
-            list(map(lambda c: c.update(), fcu))
+            nvb_utils.insert_keyframes(fcu[:dp_dim], frames,
+                                       [v[:dp_dim] for v in values])
 
         def convert_loc(amt, posebone, psb, kfvalues, mat_eb):
             vecs = [mathutils.Vector(v) for v in kfvalues]
@@ -592,17 +584,8 @@ class NVB_OT_amt_psb2amt(bpy.types.Operator):
         """TODO: DOC."""
         def insert_kfp(fcu, frames, values, dp, dp_dim):
             # Add keyframes to fcurves
-            kfp = [fcu[d].keyframe_points for d in range(dp_dim)]
-            list(map(lambda x: x.add(len(values)), kfp))
-            # Set values for all keyframe points
-            for d in range(dp_dim):
-                kfp_data = [None] * 2 * len(values)
-                kfp_data[::2] = frames
-                kfp_data[1::2] = [v[d] for v in values]
-                kfp[d].foreach_set('co', kfp_data)
-                for p in kfp[d]:
-                    p.interpolation = 'LINEAR'
-            list(map(lambda c: c.update(), fcu))
+            nvb_utils.insert_keyframes(fcu[:dp_dim], frames,
+                                       [v[:dp_dim] for v in values])
 
         def convert_loc(am, amb, meb, kfvalues, amb_base):
             mats = [mathutils.Matrix.Translation(v) for v in kfvalues]
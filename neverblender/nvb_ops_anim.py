@@ -5,6 +5,17 @@ import bpy
 
 from . import nvb_def
 from . import nvb_utils
+from . import nvb_mdl
+
+
+def load_lazy_anims(context, mdl_base, anim_list, restpose=True):
+    """Load keyframes of animations in anim_list, if not loaded yet."""
+    options = nvb_def.ImportOptions()
+    # Same names for actions and shape keys as animations loaded on import
+    options.mdlname = mdl_base.name
+    options.scene = context.scene
+    options.anim_restpose = restpose
+    nvb_mdl.Mdl.create_lazy_animations(mdl_base, anim_list, options)
 
 
 class NVB_OT_anim_clone(bpy.types.Operator):
@@ -56,6 +67,10 @@ class NVB_OT_anim_clone(bpy.types.Operator):
         cloned_anim.transtime = source_anim.transtime
         cloned_anim.root_obj = source_anim.root_obj
         cloned_anim.name = source_anim.name + '_copy'
+        cloned_anim.lazy_source = source_anim.lazy_source
+        cloned_anim.lazy_offset = source_anim.lazy_offset
+        cloned_anim.lazy_binary = source_anim.lazy_binary
+        cloned_anim.lazy_scale = source_anim.lazy_scale
         # Copy events
         self.clone_events(source_anim, cloned_anim)
         # Copy keyframes
@@ -156,6 +171,8 @@ class NVB_OT_anim_scale(bpy.types.Operator):
         if not nvb_utils.checkAnimBounds(mdl_base):
             self.report({'INFO'}, 'Error: Nested animations.')
             return {'CANCELLED'}
+        load_lazy_anims(context, mdl_base,
+                        [mdl_base.nvb.animList[mdl_base.nvb.animListIdx]])
         anim = mdl_base.nvb.animList[mdl_base.nvb.animListIdx]
         # Check resulting length (has to be >= 1)
         oldSize = anim.frameEnd - anim.frameStart
@@ -288,6 +305,8 @@ class NVB_OT_anim_crop(bpy.types.Operator):
         if not nvb_utils.checkAnimBounds(mdl_base):
             self.report({'INFO'}, 'Failure: Convoluted animations.')
             return {'CANCELLED'}
+        load_lazy_anims(context, mdl_base,
+                        [mdl_base.nvb.animList[mdl_base.nvb.animListIdx]])
         animList = mdl_base.nvb.animList
         currentAnimIdx = mdl_base.nvb.animListIdx
         anim = animList[currentAnimIdx]
@@ -401,6 +420,8 @@ class NVB_OT_anim_pad(bpy.types.Operator):
         if not nvb_utils.checkAnimBounds(mdl_base):
             self.report({'INFO'}, 'Failure: Convoluted animations.')
             return {'CANCELLED'}
+        load_lazy_anims(context, mdl_base,
+                        [mdl_base.nvb.animList[mdl_base.nvb.animListIdx]])
         anim = mdl_base.nvb.animList[mdl_base.nvb.animListIdx]
         frame_start = anim.frameStart
         frame_end = anim.frameEnd
@@ -484,10 +505,47 @@ class NVB_OT_anim_focus(bpy.types.Operator):
     def execute(self, context):
         """Set the timeline to this animation."""
         mdl_base = nvb_utils.get_obj_mdl_base(context.object)
+        # Load keyframes on first focus
+        load_lazy_anims(context, mdl_base,
+                        [mdl_base.nvb.animList[mdl_base.nvb.animListIdx]])
         nvb_utils.toggle_anim_focus(context.scene, mdl_base)
         return {'FINISHED'}
 
 
+class NVB_OT_anim_load(bpy.types.Operator):
+    """Load keyframes of animations imported on demand"""
+
+    bl_idname = 'nvb.anim_load'
+    bl_label = 'Load animation'
+
+    load_all: bpy.props.BoolProperty(
+        name='All', description='Load all animations of the MDL',
+        default=False)
+    anim_restpose: bpy.props.BoolProperty(
+        name='Insert Rest Pose',
+        description='Insert rest keyframe before every animation',
+        default=True)
+
+    @classmethod
+    def poll(self, context):
+        """Prevent execution if there are no animations to load."""
+        mdl_base = nvb_utils.get_obj_mdl_base(context.object)
+        if mdl_base is not None:
+            return any([a.lazy_source for a in mdl_base.nvb.animList])
+        return False
+
+    def execute(self, context):
+        """Load the animation(s)."""
+        mdl_base = nvb_utils.get_obj_mdl_base(context.object)
+        anim_list = mdl_base.nvb.animList
+        if not self.load_all:
+            if not 0 <= mdl_base.nvb.animListIdx < len(anim_list):
+                return {'CANCELLED'}
+            anim_list = [anim_list[mdl_base.nvb.animListIdx]]
+        load_lazy_anims(context, mdl_base, anim_list, self.anim_restpose)
+        return {'FINISHED'}
+
+
 class NVB_OT_anim_new(bpy.types.Operator):
     """Add a new animation to the animation list"""
 
@@ -1,15 +1,20 @@
 """Contains Blender Operators for MDL Import/Export."""
 
 import os
+import functools
 import math
+import tempfile
 
 import bpy
 import bpy_extras
 
 from . import nvb_mdl
+from . import nvb_parse
 from . import nvb_mtr
 from . import nvb_def
 from . import nvb_utils
+from . import nvb_writer
+from . import nvb_manifest
 
 
 class NVB_OT_mdlexport(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
@@ -28,6 +33,10 @@ class NVB_OT_mdlexport(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
             name='Export Animations',
             description='Export animations',
             default=True)
+    export_binary: bpy.props.BoolProperty(
+            name='Compiled MDL',
+            description='Write a compiled (binary) MDL instead of ascii',
+            default=False)
     export_walkmesh: bpy.props.BoolProperty(
             name='Export Walkmesh',
             description='Export a walkmesh',
@@ -96,6 +105,11 @@ class NVB_OT_mdlexport(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
                    ('SEL', 'Selected', 'Export selected MDLs'),
                    ('SCN', 'Scene', 'Export all MDLs in active scene')),
             default='OFF')
+    export_incremental: bpy.props.BoolProperty(
+            name='Incremental',
+            description='Skip models unchanged since the last incremental '
+                        'export to the same directory',
+            default=False)
 
     def mdl_export(self, context, options):
         """TODO: DOC."""
@@ -114,6 +128,42 @@ class NVB_OT_mdlexport(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
             else:
                 return nvb_def.Walkmeshtype.PWK
 
+        def generate_mtr(blen_mat, ascii_lines):
+            """Add the lines of a MTR file."""
+            ascii_lines.extend(nvb_mtr.Mtr.generate_ascii(blen_mat, options))
+
+        def get_export_jobs(mdl_list, mdl_files):
+            """Yield (filepath, generate function, binary) for all files."""
+            for mdl_base, mdl_path, wkm_name in mdl_list:
+                options.mdlname = mdl_base.name
+                options.filepath = mdl_path
+                options.classification = mdl_base.nvb.classification
+                # Meshes are shared by the mdl and walkmesh of a model only
+                options.mesh_cache.clear()
+                mdl_files[mdl_path] = [mdl_path]
+                # Export MDL
+                yield (mdl_path,
+                       functools.partial(nvb_mdl.Mdl.generate_ascii, mdl_base,
+                                         options=options),
+                       options.export_binary)
+                # Export walkmesh for MDL
+                if options.geom_walkmesh:
+                    wkm_type = get_walkmeshtype(mdl_base)
+                    wkm_path = get_filepath(mdl_path, wkm_name,
+                                            '.' + wkm_type)
+                    mdl_files[mdl_path].append(wkm_path)
+                    yield (wkm_path,
+                           functools.partial(nvb_mdl.Mdl.generate_ascii_wkm,
+                                             mdl_base, wkmtype=wkm_type,
+                                             options=options),
+                           False)
+            # Export MTRs (collected while generating the MDLs)
+            for mtr_name, blen_mat_name in options.mtr_list:
+                blen_mat = bpy.data.materials[blen_mat_name]
+                mtr_path = get_filepath(options.filepath, mtr_name, '.mtr')
+                yield (mtr_path, functools.partial(generate_mtr, blen_mat),
+                       False)
+
         # (Re)set to object-mode, if an object is selected
         if bpy.ops.object.mode_set.poll():
             bpy.ops.object.mode_set(mode='OBJECT')
@@ -140,39 +190,41 @@ class NVB_OT_mdlexport(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
                 obj_list = bpy.context.selected_objects
             for obj in obj_list:
                 base = nvb_utils.get_obj_mdl_base(obj)
-                if base and (base not in mdl_list):
+                if base and (base not in [m[0] for m in mdl_list]):
                     # Build a custom filename
                     mdl_path = get_filepath(options.filepath,
                                             base.name, '.mdl')
                     mdl_list.append((base, mdl_path, base.name))
-        # Export MDLs
-        for mdl_base, mdl_path, wkm_name in mdl_list:
-            options.mdlname = mdl_base.name
-            options.filepath = mdl_path
-            options.classification = mdl_base.nvb.classification
-            # Export MDL
-            ascii_lines = []
-            nvb_mdl.Mdl.generate_ascii(mdl_base, ascii_lines, options)
-            with open(os.fsencode(options.filepath), 'w', newline='\r\n') as f:
-                f.write('\n'.join(ascii_lines))
-            # Export walkmesh for MDL
-            if options.geom_walkmesh:
-                wkm_type = get_walkmeshtype(mdl_base)
-                wkm_ext = '.' + wkm_type
-                ascii_lines = []
-                nvb_mdl.Mdl.generate_ascii_wkm(mdl_base, ascii_lines,
-                                               wkm_type, options)
-                if ascii_lines:
-                    wkm_path = get_filepath(mdl_path, wkm_name, wkm_ext)
-                    with open(os.fsencode(wkm_path), 'w', newline='\r\n') as f:
-                        f.write('\n'.join(ascii_lines))
-        # Export MTRs
-        for mtr_name, blen_mat_name in options.mtr_list:
-            blen_mat = bpy.data.materials[blen_mat_name]
-            ascii_lines = nvb_mtr.Mtr.generate_ascii(blen_mat, options)
-            mtr_path = get_filepath(options.filepath, mtr_name, '.mtr')
-            with open(os.fsencode(mtr_path), 'w', newline='\r\n') as f:
-                f.write('\n'.join(ascii_lines))
+
+        # Skip models unchanged since the last export
+        manifest = None
+        if options.export_incremental:
+            manifest = nvb_manifest.Manifest(
+                os.path.dirname(options.filepath))
+            fingerprints = dict()
+            for mdl_base, mdl_path, _ in mdl_list:
+                fingerprints[mdl_path] = nvb_manifest.fingerprint(mdl_base,
+                                                                  options)
+            skipped_cnt = len(mdl_list)
+            mdl_list = [m for m in mdl_list if not manifest.is_unchanged(
+                m[1], fingerprints[m[1]])]
+            skipped_cnt -= len(mdl_list)
+        # Export all files, lines are generated here, formatting and
+        # writing may happen in other processes
+        max_workers = options.write_processes
+        if len(mdl_list) <= 1:
+            max_workers = 1
+        mdl_files = dict()  # MDL path => all files written for the MDL
+        nvb_writer.write_files(get_export_jobs(mdl_list, mdl_files),
+                               max_workers)
+        for warning in options.warnings:
+            self.report({'WARNING'}, warning)
+        if manifest:
+            for mdl_path, file_list in mdl_files.items():
+                manifest.update(mdl_path, fingerprints[mdl_path], file_list)
+            manifest.save()
+            self.report({'INFO'}, 'Exported {:d} models, skipped {:d} '
+                        'unchanged'.format(len(mdl_list), skipped_cnt))
         return {'FINISHED'}
 
     def draw(self, context):
@@ -181,6 +233,7 @@ class NVB_OT_mdlexport(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
         # Misc Export Settings
         box = layout.box()
         box.prop(self, 'export_animations')
+        box.prop(self, 'export_binary')
         box.prop(self, 'export_walkmesh')
         #box.prop(self, 'export_smoothgroups')
         box.prop(self, 'export_normals')
@@ -200,6 +253,7 @@ class NVB_OT_mdlexport(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
         sub.prop(self, 'strip_trailing')
         sub.prop(self, 'frame_set_zero')
         sub.prop(self, 'batch_mode')
+        sub.prop(self, 'export_incremental')
 
     def execute(self, context):
         """TODO: DOC."""
@@ -226,6 +280,7 @@ class NVB_OT_mdlexport(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
         options.geom_walkmesh = self.export_walkmesh
         # Misc Export Settings
         options.anim_export = self.export_animations
+        options.export_binary = self.export_binary
         options.export_metadata = addon_prefs.export_metadata
         options.export_wirecolor = addon_prefs.export_wirecolor
         # UV Map settings
@@ -236,6 +291,8 @@ class NVB_OT_mdlexport(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
         options.apply_modifiers = self.apply_modifiers
         options.strip_trailing = self.strip_trailing
         options.batch_mode = self.batch_mode
+        options.export_incremental = self.export_incremental
+        options.write_processes = addon_prefs.export_write_processes
         return self.mdl_export(context, options)
 
     def invoke(self, context, event):
@@ -315,6 +372,28 @@ class NVB_OT_mdlimport(bpy.types.Operator, bpy_extras.io_utils.ImportHelper):
         name='Insert Rest Pose',
         description='Insert rest keyframe before every animation',
         default=True)
+    anim_lazy: bpy.props.BoolProperty(
+        name='Load Animations on Demand',
+        description='Only add animations to the list, keyframes are ' +
+                    'loaded when focusing the animation',
+        default=False)
+    filter_nodes: bpy.props.StringProperty(
+        name='Nodes',
+        description='Only import nodes matching these patterns ' +
+                    '(space separated, * and ? as wildcards, ' +
+                    '!pattern to exclude, re:pattern for regular expressions)',
+        default='')
+    filter_types: bpy.props.StringProperty(
+        name='Node Types',
+        description='Only import nodes of these types, e.g. ' +
+                    '"emitter" or "!skin !danglymesh"',
+        default='')
+    filter_anims: bpy.props.StringProperty(
+        name='Animations',
+        description='Only import animations matching these patterns ' +
+                    '(space separated, * and ? as wildcards, ' +
+                    '!pattern to exclude, re:pattern for regular expressions)',
+        default='')
     # Blender Settings
     rotmode: bpy.props.EnumProperty(
         name='Rotation Mode',
@@ -354,61 +433,180 @@ class NVB_OT_mdlimport(bpy.types.Operator, bpy_extras.io_utils.ImportHelper):
         description='Ignore Self-Illumnination',
         default=False, options={'HIDDEN'})  
 
-    def mdl_import(self, context, options):
-        def load_file(context, mdl_filepath, options):
-            mdl_filedir, mdl_filename = os.path.split(mdl_filepath)
-            mdl_name = os.path.splitext(mdl_filename)[0]
-
-            options.mdlname = mdl_name
-            options.filepath = mdl_filepath
-
-            # Create a new collection parented to the master collection
-            if options.collections_use:
-                parent_collection = options.scene.collection
-                new_collection = bpy.data.collections.new(name=mdl_name)
-                parent_collection.children.link(new_collection)
-                options.collection = new_collection
-
-            mdl = nvb_mdl.Mdl()
-            mdl.parse_mdl(mdl_filepath, options)
-
-            if options.geom_walkmesh:
-                # Try loading the placeable walkmesh (pwk)
-                pwk_filename = mdl_name + '.' + nvb_def.Walkmeshtype.PWK
-                pwk_filepath = os.path.join(mdl_filedir, pwk_filename)
-                if os.path.isfile(os.fsencode(pwk_filepath)):
-                    mdl.parse_wkm(pwk_filepath,
-                                  nvb_def.Walkmeshtype.PWK, options)
-                # Try loading the door walkmesh (dwk)
-                dwk_filename = mdl_name + '.' + nvb_def.Walkmeshtype.DWK
-                dwk_filepath = os.path.join(mdl_filedir, dwk_filename)
-                if os.path.isfile(os.fsencode(dwk_filepath)):
-                    mdl.parse_wkm(dwk_filepath,
-                                  nvb_def.Walkmeshtype.DWK, options)
-            mdl.create(options)
-
-        def generate_import_loc(i, placement='SPIRAL', spacing=10.0):
-            """Generate a location for the imported model"""
-            if placement == 'LINE':
-                return (spacing * i, 0.0, 0.0)     
-            else:  # 'SPIRAL' is default
-                k = math.floor(math.floor(math.sqrt(i)-1)/2)+1
-                return (spacing * min(k, max(-k, -2*k + abs(i-(4*k*k)-k))),
-                        spacing * min(k, max(-k, -2*k + abs(i-(4*k*k)+k))), 0.0)                  
+    @staticmethod
+    def create_file(context, mdl_filepath, mdl, options):
+        """Create objects for a parsed mdl."""
+        mdl_name = os.path.splitext(os.path.basename(mdl_filepath))[0]
+
+        options.mdlname = mdl_name
+        options.filepath = mdl_filepath
+
+        # Create a new collection parented to the master collection
+        if options.collections_use:
+            parent_collection = options.scene.collection
+            new_collection = bpy.data.collections.new(name=mdl_name)
+            parent_collection.children.link(new_collection)
+            options.collection = new_collection
+
+        mdl.create(options)
+
+    @staticmethod
+    def generate_import_loc(i, placement='SPIRAL', spacing=10.0):
+        """Generate a location for the imported model"""
+        if placement == 'LINE':
+            return (spacing * i, 0.0, 0.0)     
+        else:  # 'SPIRAL' is default
+            k = math.floor(math.floor(math.sqrt(i)-1)/2)+1
+            return (spacing * min(k, max(-k, -2*k + abs(i-(4*k*k)-k))),
+                    spacing * min(k, max(-k, -2*k + abs(i-(4*k*k)+k))), 0.0)                  
+
+    @staticmethod
+    def import_files(context, file_list, options):
+        """Parse and create (mdl path, location) files, decompiled before."""
+        # Files which could not be decompiled are skipped
+        file_list = [(p, loc) for p, loc in file_list
+                     if options.decompiled.get(p, p)]
+        # Parsing may run in parallel, objects are created in order
+        mdl_list = nvb_mdl.Mdl.parse_files([p for p, _ in file_list],
+                                           options, options.parse_processes)
+        for (path, mdl), (_, loc) in zip(mdl_list, file_list):
+            options.mdl_location = loc
+            NVB_OT_mdlimport.create_file(context, path, mdl, options)
+
+    @staticmethod
+    def import_decompiled(context, file_list, run_list, pool, options,
+                          wait=False):
+        """Import the files of decompiler runs finished since last time.
+
+        Returns the number of finished runs.
+        """
+        finished = pool.pop_finished(wait)
+        for run_idx in finished:
+            pool.runs[run_idx].print_log()
+            decompiled = nvb_mdl.Mdl.get_decompiled(run_list[run_idx][1])
+            options.decompiled.update(decompiled)
+            NVB_OT_mdlimport.import_files(
+                context, [f for f in file_list if f[0] in decompiled],
+                options)
+        return len(finished)
 
+    def mdl_import(self, context, options):
         # Build list of files
         path_list = [os.path.join(self.directory, f.name) for f in self.files]
         if path_list:
             # Potentially multiple files => Always generate+overwrite locations 
-            loc_list = [generate_import_loc(i, options.placement) for i in range(len(path_list))]
-            for loc, path in zip(loc_list, path_list):
-                options.mdl_location = loc
-                load_file(context, path, options)
+            loc_list = [NVB_OT_mdlimport.generate_import_loc(i, options.placement) for i in range(len(path_list))]
+            file_list = list(zip(path_list, loc_list))
+            # Binary mdls, which have to be decompiled (and are not
+            # cached), are copied to a temp dir and decompiled in the
+            # background. The other files are imported meanwhile, decompiled
+            # ones as soon as their compiler run is done. Without a window
+            # (background mode, called from scripts) there are no timer
+            # events, wait for the decompiler instead of running modal.
+            tmp_dir = tempfile.TemporaryDirectory()
+            try:
+                run_list = nvb_mdl.Mdl.prepare_decompile(
+                    path_list, tmp_dir.name, options,
+                    options.compiler_processes)
+                pending = {p for _, run_files in run_list
+                           for p, _ in run_files}
+                ready_list = [f for f in file_list if f[0] not in pending]
+                if not run_list:
+                    NVB_OT_mdlimport.import_files(context, file_list,
+                                                  options)
+                elif getattr(self, '_interactive', False) and \
+                        not bpy.app.background and context.window:
+                    self._tmp_dir = tmp_dir
+                    tmp_dir = None  # Cleaned up when the modal ends
+                    return self.modal_start(context, options, file_list,
+                                            ready_list, run_list)
+                else:
+                    pool = nvb_mdl.Mdl.start_decompile(
+                        run_list, options, options.compiler_processes)
+                    try:
+                        NVB_OT_mdlimport.import_files(context, ready_list,
+                                                      options)
+                        finished_cnt = 0
+                        while finished_cnt < len(run_list):
+                            finished_cnt += NVB_OT_mdlimport.import_decompiled(
+                                context, file_list, run_list, pool, options,
+                                True)
+                    finally:
+                        pool.cancel()
+                        pool.join()
+            finally:
+                if tmp_dir:
+                    tmp_dir.cleanup()
         else:
             # Single file => NEVER overwrite locations 
             if self.filepath:
-                load_file(context, self.filepath, options)
+                mdl = nvb_mdl.Mdl.parse_file(self.filepath, options)
+                NVB_OT_mdlimport.create_file(context, self.filepath, mdl,
+                                             options)
+
+        return {'FINISHED'}
+
+    def modal_start(self, context, options, file_list, ready_list,
+                    run_list):
+        """Start the decompiler, import files while it is running."""
+        self._pool = nvb_mdl.Mdl.start_decompile(
+            run_list, options, options.compiler_processes)
+        self._run_list = run_list
+        self._file_list = file_list
+        self._ready_list = ready_list
+        self._finished_cnt = 0
+        self._options = options
 
+        wm = context.window_manager
+        wm.progress_begin(0, len(run_list))
+        self._timer = wm.event_timer_add(0.1, window=context.window)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def modal_end(self, context):
+        """Remove timer and progress, stop the decompiler."""
+        wm = context.window_manager
+        wm.event_timer_remove(self._timer)
+        wm.progress_end()
+        context.workspace.status_text_set(None)
+        self._pool.cancel()
+        self._pool.join()
+
+    def modal(self, context, event):
+        """Import files as the decompiler finishes them."""
+        if event.type == 'ESC':
+            try:
+                self.modal_end(context)
+            finally:
+                self._tmp_dir.cleanup()
+            self.report({'WARNING'}, 'Import cancelled')
+            return {'CANCELLED'}
+        if event.type != 'TIMER':
+            return {'PASS_THROUGH'}
+        options = self._options
+        try:
+            # Files not waiting for the decompiler go first
+            ready_list, self._ready_list = self._ready_list, []
+            NVB_OT_mdlimport.import_files(context, ready_list, options)
+            self._finished_cnt += NVB_OT_mdlimport.import_decompiled(
+                context, self._file_list, self._run_list, self._pool,
+                options)
+        except Exception:
+            try:
+                self.modal_end(context)
+            finally:
+                self._tmp_dir.cleanup()
+            raise
+        if self._finished_cnt < len(self._run_list):
+            context.window_manager.progress_update(self._finished_cnt)
+            context.workspace.status_text_set(
+                'Decompiling MDLs: {:d}/{:d} (ESC to cancel)'.format(
+                    self._finished_cnt, len(self._run_list)))
+            return {'RUNNING_MODAL'}
+        try:
+            self.modal_end(context)
+        finally:
+            self._tmp_dir.cleanup()
         return {'FINISHED'}
 
     def draw(self, context):
@@ -435,12 +633,20 @@ class NVB_OT_mdlimport(bpy.types.Operator, bpy_extras.io_utils.ImportHelper):
         sub1 = box.column()
         sub1.enabled = self.anim_import
         sub1.prop(self, 'anim_restpose')
+        sub1.prop(self, 'anim_lazy')
         row = sub1.row(align=True)
         row.prop(self, 'anim_fps_use', text='')
         sub2 = row.row(align=True)
         sub2.enabled = self.anim_fps_use
         sub2.prop(self, 'anim_fps')
 
+        # Filter nodes and animations
+        box = layout.box()
+        box.label(text='Filter')
+        box.prop(self, 'filter_nodes')
+        box.prop(self, 'filter_types')
+        box.prop(self, 'filter_anims')
+
         # Blender Settings
         box = layout.box()
         box.label(text='Blender Settings')
@@ -460,6 +666,9 @@ class NVB_OT_mdlimport(bpy.types.Operator, bpy_extras.io_utils.ImportHelper):
         options.dummy_type = addon_prefs.dummy_type
         options.dummy_size = addon_prefs.dummy_size
         options.placement = addon_prefs.import_placement
+        options.parse_processes = addon_prefs.import_parse_processes
+        options.cache_use = addon_prefs.import_cache_use
+        options.cache_size = addon_prefs.import_cache_size * 1024 * 1024
         options.hide_lights = self.hide_lights
         options.hide_fading = self.hide_fading
         options.mdl_location = self.mdl_location
@@ -467,6 +676,8 @@ class NVB_OT_mdlimport(bpy.types.Operator, bpy_extras.io_utils.ImportHelper):
         options.compiler_use = addon_prefs.import_compiler_use
         options.compiler_path = addon_prefs.import_compiler_path
         options.compiler_command = addon_prefs.import_compiler_command
+        options.compiler_processes = addon_prefs.import_compiler_processes
+        options.compiler_timeout = addon_prefs.import_compiler_timeout
         # Geometry options
         options.geom_import = self.import_geometry
         options.geom_walkmesh = self.import_walkmesh
@@ -488,8 +699,19 @@ class NVB_OT_mdlimport(bpy.types.Operator, bpy_extras.io_utils.ImportHelper):
         # Animation Options
         options.anim_import = self.anim_import
         options.anim_restpose = self.anim_restpose
+        options.anim_lazy = self.anim_lazy
         options.anim_fps_use = self.anim_fps_use
         options.anim_fps = self.anim_fps
+        # Filter
+        options.filter_nodes = self.filter_nodes
+        options.filter_types = self.filter_types
+        options.filter_anims = self.filter_anims
+        try:
+            nvb_parse.BlockFilter(options.filter_nodes, options.filter_types,
+                                  options.filter_anims)
+        except nvb_def.MalformedMdlFile as e:
+            self.report({'ERROR'}, e.parameter)
+            return {'CANCELLED'}
         # Blender Settings
         options.rotmode = self.rotmode
         options.fix_uvs = self.fix_uvs
@@ -497,6 +719,15 @@ class NVB_OT_mdlimport(bpy.types.Operator, bpy_extras.io_utils.ImportHelper):
 
         return self.mdl_import(context, options)
 
+    def invoke(self, context, event):
+        # Binary files are only decompiled in the background (modal), when
+        # started from the UI
+        self._interactive = True
+        wm = context.window_manager
+        wm.fileselect_add(self)
+
+        return {'RUNNING_MODAL'}
+
 
 class NVB_OT_mdl_superimport(bpy.types.Operator,
                              bpy_extras.io_utils.ImportHelper):
@@ -523,6 +754,28 @@ class NVB_OT_mdl_superimport(bpy.types.Operator,
         name='Insert Rest Pose',
         description='Insert rest keyframe before every animation',
         default=True)
+    anim_lazy: bpy.props.BoolProperty(
+        name='Load Animations on Demand',
+        description='Only add animations to the list, keyframes are ' +
+                    'loaded when focusing the animation',
+        default=False)
+    filter_nodes: bpy.props.StringProperty(
+        name='Nodes',
+        description='Only import nodes matching these patterns ' +
+                    '(space separated, * and ? as wildcards, ' +
+                    '!pattern to exclude, re:pattern for regular expressions)',
+        default='')
+    filter_types: bpy.props.StringProperty(
+        name='Node Types',
+        description='Only import nodes of these types, e.g. ' +
+                    '"emitter" or "!skin !danglymesh"',
+        default='')
+    filter_anims: bpy.props.StringProperty(
+        name='Animations',
+        description='Only import animations matching these patterns ' +
+                    '(space separated, * and ? as wildcards, ' +
+                    '!pattern to exclude, re:pattern for regular expressions)',
+        default='')
     anim_ignore_existing: bpy.props.BoolProperty(
         name='Ignore Existing',
         description='Do not import already existing animations',
@@ -535,8 +788,7 @@ class NVB_OT_mdl_superimport(bpy.types.Operator,
 
             options.mdlname = mdl_name
             options.filepath = mdl_filepath
-            mdl = nvb_mdl.Mdl()
-            mdl.parse_mdl(mdl_filepath, options)
+            mdl = nvb_mdl.Mdl.parse_file(mdl_filepath, options)
             mdl.create_super(mdl_base, options)
 
         # Build list of files
@@ -562,12 +814,20 @@ class NVB_OT_mdl_superimport(bpy.types.Operator,
         box = layout.box()
         box.prop(self, 'anim_ignore_existing')
         box.prop(self, 'anim_restpose')
+        box.prop(self, 'anim_lazy')
         row = box.row(align=True)
         row.prop(self, 'anim_fps_use', text='')
         sub = row.row(align=True)
         sub.enabled = self.anim_fps_use
         sub.prop(self, 'anim_fps')
 
+        # Filter nodes and animations
+        box = layout.box()
+        box.label(text='Filter')
+        box.prop(self, 'filter_nodes')
+        box.prop(self, 'filter_types')
+        box.prop(self, 'filter_anims')
+
     def execute(self, context):
         addon = context.preferences.addons[__package__]
         addon_prefs = addon.preferences
@@ -581,12 +841,28 @@ class NVB_OT_mdl_superimport(bpy.types.Operator,
         options.compiler_use = addon_prefs.import_compiler_use
         options.compiler_path = addon_prefs.import_compiler_path
         options.compiler_command = addon_prefs.import_compiler_command
+        options.compiler_timeout = addon_prefs.import_compiler_timeout
+        options.cache_use = addon_prefs.import_cache_use
+        options.cache_size = addon_prefs.import_cache_size * 1024 * 1024
+        # Walkmeshes are not needed for animations
+        options.geom_walkmesh = False
         # Animations (duh)
         options.anim_import = True
         options.anim_fps_use = self.anim_fps_use
         options.anim_fps = self.anim_fps
         options.anim_restpose = self.anim_restpose
+        options.anim_lazy = self.anim_lazy
         options.anim_ignore_existing = self.anim_ignore_existing
+        # Filter
+        options.filter_nodes = self.filter_nodes
+        options.filter_types = self.filter_types
+        options.filter_anims = self.filter_anims
+        try:
+            nvb_parse.BlockFilter(options.filter_nodes, options.filter_types,
+                                  options.filter_anims)
+        except nvb_def.MalformedMdlFile as e:
+            self.report({'ERROR'}, e.parameter)
+            return {'CANCELLED'}
         return self.mdl_import(context, options)
 
     def invoke(self, context, event):
@@ -1,3 +1,10 @@
+import io
+import os
+import re
+import mmap
+import fnmatch
+
+import numpy as np
 
 from . import nvb_def
 
@@ -39,8 +46,285 @@ def ascii_bool(s):
     return b
 
 
+def ascii_array(rows, count, dim, dtype=np.float32):
+    """Convert the first count rows of a numeric block to a (count, dim) array.
+
+    All rows are converted in one go. Only if that fails (ragged rows,
+    unreadable values) every value is converted on its own, treating errors
+    as 0.0 and padding missing values with 0.0.
+    """
+    rows = rows[:count]
+    try:
+        data = np.array(rows, dtype=dtype)
+    except ValueError:
+        data = None
+    if data is not None and data.ndim == 2 and data.shape[1] >= dim:
+        return np.ascontiguousarray(data[:, :dim])
+    # Malformed rows, use the slow path
+    data = np.zeros((len(rows), dim), dtype=dtype)
+    for i, row in enumerate(rows):
+        values = [ascii_float(v) for v in row[:dim]]
+        data[i, :len(values)] = values
+    return data
+
+
 def ascii_color(l):
     """Convert list of strings to color."""
     color = [ascii_float(v) for v in l[:4]]
     color.extend([1.0] * (4-len(color)))
     return color
+
+
+class Recordtype():
+    """Types of records yielded by the ascii tokenizer."""
+
+    NODE = 'node'
+    ENDNODE = 'endnode'
+    NEWANIM = 'newanim'
+    DONEANIM = 'doneanim'
+    LINE = 'line'
+    SKIPNODE = 'skipnode'  # Filtered node, rows only contain its parent
+
+
+# First characters a numeric row may start with
+number_start = set('0123456789+-.')
+
+
+def ascii_is_row(tokens):
+    """Return True if the tokenized line is a row of numbers."""
+    if tokens[0][0] not in number_start:
+        return False
+    try:
+        float(tokens[0])
+    except ValueError:
+        return False
+    return True
+
+
+class NameFilter():
+    """Matches names against space separated glob patterns.
+
+    Patterns starting with '!' exclude names, patterns starting with 're:'
+    are regular expressions. Without including patterns every name, which
+    isn't excluded, matches.
+    """
+
+    def __init__(self, patterns=''):
+        """TODO: DOC."""
+        include = []
+        exclude = []
+        for pattern in patterns.split():
+            pattern_list = include
+            if pattern.startswith('!'):
+                pattern_list = exclude
+                pattern = pattern[1:]
+            if pattern.startswith('re:'):
+                pattern_list.append(pattern[3:])
+            elif pattern:
+                pattern_list.append(fnmatch.translate(pattern))
+        self.include = NameFilter.compile(include)
+        self.exclude = NameFilter.compile(exclude)
+
+    @staticmethod
+    def compile(regex_list):
+        """Combine a list of regular expressions into one (None if empty)."""
+        if not regex_list:
+            return None
+        try:
+            return re.compile('|'.join(['(?:' + r + ')' for r in regex_list]),
+                              re.IGNORECASE)
+        except re.error as e:
+            raise nvb_def.MalformedMdlFile('Invalid filter: ' + str(e))
+
+    def is_active(self):
+        """Whether this filter can reject any name."""
+        return self.include is not None or self.exclude is not None
+
+    def match(self, name):
+        """Whether the name passes the filter."""
+        if self.include and not self.include.match(name):
+            return False
+        return not (self.exclude and self.exclude.match(name))
+
+
+class BlockFilter():
+    """Decides which node and animation blocks to read.
+
+    Called once for every 'node' and 'newanim' line in order of the file.
+    The first node of the geometry and of every animation (the mdl base)
+    is always read.
+    """
+
+    def __init__(self, node_names='', node_types='', anim_names=''):
+        """TODO: DOC."""
+        self.node_names = NameFilter(node_names)
+        self.node_types = NameFilter(node_types)
+        self.anim_names = NameFilter(anim_names)
+        self.node_cnt = 0
+
+    def is_active(self):
+        """Whether this filter can reject any block."""
+        return self.node_names.is_active() or \
+            self.node_types.is_active() or self.anim_names.is_active()
+
+    def __call__(self, tokens):
+        """Return True if the block starting with this line is read."""
+        if tokens[0].lower() == 'newanim':
+            self.node_cnt = 0
+            return len(tokens) < 2 or self.anim_names.match(tokens[1])
+        self.node_cnt += 1
+        if self.node_cnt == 1 or len(tokens) < 3:
+            return True
+        return self.node_types.match(tokens[1]) and \
+            self.node_names.match(tokens[2])
+
+
+# Labels which may end a skipped block
+block_labels = set(['node', 'endnode', 'newanim', 'doneanim'])
+
+
+def ascii_records(ascii_file, block_filter=None):
+    """Read an ascii mdl line by line and yield (type, tokens, rows) records.
+
+    Numeric rows (vertices, faces, keys, ...) are not yielded on their own,
+    they are appended to the rows of the preceding record. Empty lines
+    and comments are skipped. Missing 'endnode' and 'doneanim' lines are
+    inserted, so every node and animation block is always closed.
+    Node and animation blocks rejected by block_filter(tokens) are skipped
+    without tokenizing them. Skipped nodes yield a single SKIPNODE record
+    holding the parent, skipped animations yield nothing.
+    """
+    endnode = (Recordtype.ENDNODE, ['endnode'], [])
+    doneanim = (Recordtype.DONEANIM, ['doneanim'], [])
+    in_node = False
+    in_anim = False
+    record = None
+    skipped = None  # Record of the skipped block
+    for line in ascii_file:
+        if skipped:
+            # Only look at lines, which may end the block or are a parent
+            c = line.lstrip()[:1]
+            if not c or c in number_start or c == '#':
+                continue
+            tokens = line.split(None, 2)
+            label = tokens[0].lower()
+            if label == 'parent' and skipped[0] == Recordtype.SKIPNODE:
+                skipped[2][:] = [tokens[:2]]
+                continue
+            if label not in block_labels:
+                continue
+            if skipped[0] == Recordtype.SKIPNODE:
+                yield skipped
+                skipped = None
+                if label == 'endnode':
+                    continue
+            elif label == 'newanim':  # Skipped animation ends
+                skipped = None
+            else:
+                if label == 'doneanim':
+                    skipped = None
+                continue
+        tokens = line.split()
+        if not tokens or tokens[0].startswith('#'):
+            continue
+        if ascii_is_row(tokens):
+            if record:
+                record[2].append(tokens)
+            continue
+        if record:
+            yield record
+        label = tokens[0].lower()
+        if label == 'node':
+            if in_node:
+                yield endnode
+            in_node = True
+            record = (Recordtype.NODE, tokens, [])
+            if block_filter and not block_filter(tokens):
+                in_node = False
+                record = None
+                skipped = (Recordtype.SKIPNODE, tokens, [])
+        elif label == 'endnode' and in_node:
+            in_node = False
+            record = (Recordtype.ENDNODE, tokens, [])
+        elif label == 'newanim':
+            if in_node:
+                yield endnode
+                in_node = False
+            if in_anim:
+                yield doneanim
+            in_anim = True
+            record = (Recordtype.NEWANIM, tokens, [])
+            if block_filter and not block_filter(tokens):
+                in_anim = False
+                record = None
+                skipped = (Recordtype.NEWANIM, tokens, [])
+        elif label == 'doneanim' and in_anim:
+            if in_node:
+                yield endnode
+                in_node = False
+            in_anim = False
+            record = (Recordtype.DONEANIM, tokens, [])
+        else:
+            record = (Recordtype.LINE, tokens, [])
+    if record:
+        yield record
+    if skipped and skipped[0] == Recordtype.SKIPNODE:
+        yield skipped
+    if in_node:
+        yield endnode
+    if in_anim:
+        yield doneanim
+
+
+def filter_records(records, block_filter):
+    """Apply a block filter to already decoded records (binary mdls).
+
+    Yields the same records as ascii_records would with this filter.
+    """
+    itrecords = iter(records)
+    for record in itrecords:
+        record_type = record[0]
+        if record_type == Recordtype.NODE and not block_filter(record[1]):
+            rows = [r[1][:2] for r in ascii_block(record, itrecords)
+                    if r[1][0].lower() == 'parent']
+            yield (Recordtype.SKIPNODE, record[1], rows[-1:])
+        elif record_type == Recordtype.NEWANIM and \
+                not block_filter(record[1]):
+            for rec in itrecords:
+                if rec[0] == Recordtype.DONEANIM:
+                    break
+        else:
+            yield record
+
+
+def ascii_block(record, itrecords):
+    """Collect the records of a node block, starting with its node record."""
+    block = [record]
+    for rec in itrecords:
+        block.append(rec)
+        if rec[0] == Recordtype.ENDNODE:
+            break
+    return block
+
+
+# Start of an animation block, 'newanim' at the beginning of a line
+ascii_newanim = re.compile(rb'^[ \t]*newanim\b', re.MULTILINE | re.IGNORECASE)
+
+
+def ascii_anim_offsets(mdl_filepath):
+    """Return the byte offsets of all animation blocks in an ascii mdl."""
+    with open(os.fsencode(mdl_filepath), 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return [m.start() for m in ascii_newanim.finditer(mm)]
+
+
+def ascii_anim_records(mdl_filepath, offset):
+    """Yield the records of a single animation block at a byte offset."""
+    with open(os.fsencode(mdl_filepath), 'rb') as f:
+        f.seek(offset)
+        for record in ascii_records(io.TextIOWrapper(f)):
+            yield record
+            if record[0] == Recordtype.DONEANIM:
+                break
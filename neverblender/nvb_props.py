@@ -6,6 +6,7 @@ import platform
 from . import bpy
 from . import nvb_def
 from . import nvb_utils
+from . import nvb_cache
 
 
 def NVB_psb_anim_target_poll(self, object):
@@ -65,6 +66,18 @@ class NVB_OT_decompile_detect_options(bpy.types.Operator):
         return {'FINISHED'}
 
 
+class NVB_OT_cache_clear(bpy.types.Operator):
+    """Delete all models from the parse cache"""
+    bl_idname = 'nvb.cache_clear'
+    bl_label = "Clear Cache"
+
+    def execute(self, context):
+        """Delete all cached files."""
+        cnt = nvb_cache.clear()
+        self.report({'INFO'}, "Removed " + str(cnt) + " cached model(s)")
+        return {'FINISHED'}
+
+
 
 class NVB_addon_properties(bpy.types.AddonPreferences):
     # this must match the addon name, use '__package__'
@@ -108,6 +121,9 @@ class NVB_addon_properties(bpy.types.AddonPreferences):
     export_tileset_info: bpy.props.BoolProperty(
         name="Export Tileset Info", default=False,
         description="Create a tileset NFO file which holds data for generating set files")        
+    export_write_processes: bpy.props.IntProperty(
+        name="Writer Processes", default=1, min=0, max=64,
+        description="Number of processes for writing files when exporting multiple models (0 = number of CPUs, 1 = no parallel writing). Experimental, forks the blender process")
 
     # Import preferences
     import_placement: bpy.props.EnumProperty(
@@ -119,6 +135,15 @@ class NVB_addon_properties(bpy.types.AddonPreferences):
     import_mesh_validation: bpy.props.BoolProperty(
         name="Mesh Validation", default=False,
         description="Turn on Blenders mesh validation for imported geometry (Removes two sided faces)")
+    import_parse_processes: bpy.props.IntProperty(
+        name="Parser Processes", default=1, min=0, max=64,
+        description="Number of processes for parsing multiple files (0 = number of CPUs, 1 = no parallel parsing). Experimental, forks the blender process")
+    import_cache_use: bpy.props.BoolProperty(
+        name="Parse Cache", default=True,
+        description="Keep parsed models in the user cache directory, unchanged files won't be parsed again")
+    import_cache_size: bpy.props.IntProperty(
+        name="Cache Size (MB)", default=512, min=1,
+        description="Least recently used models will be removed from the cache above this size")
     import_mat_mtr: bpy.props.BoolProperty(
         name="Import mtr files", default=True,
         description="Import MTR files.")        
@@ -144,6 +169,16 @@ class NVB_addon_properties(bpy.types.AddonPreferences):
         description="Additional options for external (de)compiler",  
         subtype='NONE',
         options=set())
+    import_compiler_processes: bpy.props.IntProperty(
+        name="Decompiler Processes", default=0, min=0, max=64,
+        description="Number of decompiler runs in parallel when importing "
+                    "multiple files (0 = number of CPUs)",
+        options=set())
+    import_compiler_timeout: bpy.props.FloatProperty(
+        name="Decompiler Timeout", default=60.0, min=0.0,
+        description="Stop decompiling a file after this many seconds "
+                    "(0 = no timeout)",
+        options=set())
 
     # General Preferences
     dummy_type: bpy.props.EnumProperty(
@@ -296,6 +331,13 @@ class NVB_addon_properties(bpy.types.AddonPreferences):
         box.label(text='General')
         box.prop(self, 'import_placement')
         box.prop(self, 'import_mesh_validation')
+        box.prop(self, 'import_parse_processes')
+        row = box.row(align=True)
+        row.prop(self, 'import_cache_use')
+        sub = row.row(align=True)
+        sub.active = self.import_cache_use
+        sub.prop(self, 'import_cache_size', text="Size (MB)")
+        sub.operator(NVB_OT_cache_clear.bl_idname, icon='TRASH', text='')
 
         box = col.box()
         box.label(text="Materials")
@@ -317,6 +359,9 @@ class NVB_addon_properties(bpy.types.AddonPreferences):
         row = sub.row(align=True)
         row.prop(self, "import_compiler_command", text="Command")
         row.operator(NVB_OT_decompile_detect_options.bl_idname, icon='FILE_REFRESH', text='')
+        row = sub.row(align=True)
+        row.prop(self, "import_compiler_processes", text="Processes")
+        row.prop(self, "import_compiler_timeout", text="Timeout")
 
         # Export Settings
         col = split.column()
@@ -327,6 +372,7 @@ class NVB_addon_properties(bpy.types.AddonPreferences):
         box.prop(self, 'export_wirecolor')
         box.prop(self, 'export_metadata')
         box.prop(self, 'export_tileset_info') 
+        box.prop(self, 'export_write_processes')
 
         box = col.box()
         box.label(text="Materials")  
@@ -393,6 +439,19 @@ class NVB_PG_anim(bpy.types.PropertyGroup):
                                       description='Animation Start', min=0)
     frameEnd: bpy.props.IntProperty(name='End', default=0, options=set(),
                                     description='Animation End', min=0)
+    # Keyframes of lazily imported animations are still in this file
+    lazy_source: bpy.props.StringProperty(
+        name='Source', default='', options=set(), subtype='FILE_PATH',
+        description='MDL to load the keyframes from (empty if loaded)')
+    lazy_offset: bpy.props.IntProperty(
+        name='Offset', default=0, options=set(),
+        description='Position of the animation in the source MDL')
+    lazy_binary: bpy.props.BoolProperty(
+        name='Binary', default=False, options=set(),
+        description='Source MDL is compiled')
+    lazy_scale: bpy.props.FloatProperty(
+        name='Scale', default=1.0, options=set(),
+        description='Animation scale to apply when loading')
 
     eventList: bpy.props.CollectionProperty(type=NVB_PG_animevent)
     eventListIdx: bpy.props.IntProperty(name='Index for event List',
@@ -0,0 +1,255 @@
+"""Batched rotation conversions on numpy arrays.
+
+Quaternions are (w, x, y, z), axis-angles are (x, y, z, angle) as used
+in MDL orientation keys and eulers are in 'XYZ' order. Matrices are
+row-major (N, 3, 3) arrays. Conversions match mathutils within float
+precision, the euler filter works on whole key arrays instead of key by key.
+"""
+
+import math
+
+import numpy as np
+
+
+def as_rows(values, dim):
+    """Return values as a (N, dim) float64 array."""
+    return np.asarray(values, dtype=np.float64).reshape(-1, dim)
+
+
+def wrap_angle(angles):
+    """Wrap angles to [-pi, pi), like mathutils does for axis-angles."""
+    return np.mod(angles + math.pi, 2.0 * math.pi) - math.pi
+
+
+def normalize_quat(quats):
+    """Normalize quaternions, zero length quaternions become identity."""
+    quats = as_rows(quats, 4)
+    length = np.linalg.norm(quats, axis=1)
+    result = np.zeros(quats.shape)
+    result[:, 0] = 1.0
+    valid = length > 0.0
+    result[valid] = quats[valid] / length[valid, None]
+    return result
+
+
+def axisangle_to_quat(axisangles):
+    """Convert (x, y, z, angle) axis-angles to (w, x, y, z) quaternions."""
+    axisangles = as_rows(axisangles, 4)
+    axis_len = np.linalg.norm(axisangles[:, :3], axis=1)
+    half_angle = 0.5 * wrap_angle(axisangles[:, 3])
+    quats = np.zeros(axisangles.shape)
+    quats[:, 0] = 1.0
+    valid = axis_len > 0.0
+    quats[valid, 0] = np.cos(half_angle[valid])
+    quats[valid, 1:] = axisangles[valid, :3] * \
+        (np.sin(half_angle[valid]) / axis_len[valid])[:, None]
+    return quats
+
+
+def canonical_quat(quats):
+    """Normalize quaternions and flip them to w >= 0 (same rotation)."""
+    quats = normalize_quat(quats)
+    quats[quats[:, 0] < 0.0] *= -1.0
+    return quats
+
+
+def quat_to_axisangle(quats):
+    """Convert (w, x, y, z) quaternions to (x, y, z, angle) axis-angles.
+
+    Same as the axis and angle of a mathutils.Quaternion, the angle is
+    wrapped to [-pi, pi).
+    """
+    quats = normalize_quat(quats)
+    half_angle = np.arccos(np.clip(quats[:, 0], -1.0, 1.0))
+    sin_half = np.sin(half_angle)
+    sin_half[np.abs(sin_half) < 0.0005] = 1.0
+    axisangles = np.empty(quats.shape)
+    axisangles[:, :3] = quats[:, 1:] / sin_half[:, None]
+    axisangles[:, 3] = wrap_angle(2.0 * half_angle)
+    # Default axis for (near) identity rotations
+    no_axis = ~np.any(axisangles[:, :3], axis=1)
+    axisangles[no_axis, 1] = 1.0
+    return axisangles
+
+
+def quat_conjugate(quats):
+    """Invert (unit) (w, x, y, z) quaternions."""
+    quats = as_rows(quats, 4).copy()
+    quats[:, 1:] *= -1.0
+    return quats
+
+
+def quat_mul(quats1, quats2):
+    """Multiply (w, x, y, z) quaternions row by row."""
+    w1, x1, y1, z1 = as_rows(quats1, 4).T
+    w2, x2, y2, z2 = as_rows(quats2, 4).T
+    return np.stack([w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2,
+                     w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+                     w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+                     w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2], axis=1)
+
+
+def quat_rotate(quats, vectors):
+    """Rotate (N, 3) vectors by unit (w, x, y, z) quaternions."""
+    vectors = as_rows(vectors, 3)
+    pure = np.zeros((len(vectors), 4))
+    pure[:, 1:] = vectors
+    return quat_mul(quat_mul(quats, pure), quat_conjugate(quats))[:, 1:]
+
+
+def quat_to_matrix(quats):
+    """Convert (w, x, y, z) quaternions to rotation matrices."""
+    w, x, y, z = normalize_quat(quats).T
+    mats = np.empty((len(w), 3, 3))
+    mats[:, 0, 0] = 1.0 - 2.0 * (y * y + z * z)
+    mats[:, 0, 1] = 2.0 * (x * y - w * z)
+    mats[:, 0, 2] = 2.0 * (x * z + w * y)
+    mats[:, 1, 0] = 2.0 * (x * y + w * z)
+    mats[:, 1, 1] = 1.0 - 2.0 * (x * x + z * z)
+    mats[:, 1, 2] = 2.0 * (y * z - w * x)
+    mats[:, 2, 0] = 2.0 * (x * z - w * y)
+    mats[:, 2, 1] = 2.0 * (y * z + w * x)
+    mats[:, 2, 2] = 1.0 - 2.0 * (x * x + y * y)
+    return mats
+
+
+def matrix_to_quat(mats):
+    """Convert (scaled) rotation matrices to (w, x, y, z) quaternions."""
+    mats = np.asarray(mats, dtype=np.float64).reshape(-1, 3, 3)
+    # Remove scale from the axes (columns)
+    col_len = np.linalg.norm(mats, axis=1, keepdims=True)
+    col_len[col_len == 0.0] = 1.0
+    m = mats / col_len
+    m00, m11, m22 = m[:, 0, 0], m[:, 1, 1], m[:, 2, 2]
+    quats = np.empty((len(m), 4))
+    # Pick the numerically most stable formula per matrix
+    trace = m00 + m11 + m22
+    case_w = trace > 0.0
+    case_x = ~case_w & (m00 >= m11) & (m00 >= m22)
+    case_y = ~case_w & ~case_x & (m11 >= m22)
+    case_z = ~case_w & ~case_x & ~case_y
+    s = 2.0 * np.sqrt(np.maximum(1.0 + trace[case_w], 0.0))
+    mc = m[case_w]
+    quats[case_w] = np.stack([0.25 * s,
+                              (mc[:, 2, 1] - mc[:, 1, 2]) / s,
+                              (mc[:, 0, 2] - mc[:, 2, 0]) / s,
+                              (mc[:, 1, 0] - mc[:, 0, 1]) / s], axis=1)
+    mc = m[case_x]
+    s = 2.0 * np.sqrt(np.maximum(
+        1.0 + mc[:, 0, 0] - mc[:, 1, 1] - mc[:, 2, 2], 0.0))
+    quats[case_x] = np.stack([(mc[:, 2, 1] - mc[:, 1, 2]) / s,
+                              0.25 * s,
+                              (mc[:, 0, 1] + mc[:, 1, 0]) / s,
+                              (mc[:, 0, 2] + mc[:, 2, 0]) / s], axis=1)
+    mc = m[case_y]
+    s = 2.0 * np.sqrt(np.maximum(
+        1.0 + mc[:, 1, 1] - mc[:, 0, 0] - mc[:, 2, 2], 0.0))
+    quats[case_y] = np.stack([(mc[:, 0, 2] - mc[:, 2, 0]) / s,
+                              (mc[:, 0, 1] + mc[:, 1, 0]) / s,
+                              0.25 * s,
+                              (mc[:, 1, 2] + mc[:, 2, 1]) / s], axis=1)
+    mc = m[case_z]
+    s = 2.0 * np.sqrt(np.maximum(
+        1.0 + mc[:, 2, 2] - mc[:, 0, 0] - mc[:, 1, 1], 0.0))
+    quats[case_z] = np.stack([(mc[:, 1, 0] - mc[:, 0, 1]) / s,
+                              (mc[:, 0, 2] + mc[:, 2, 0]) / s,
+                              (mc[:, 1, 2] + mc[:, 2, 1]) / s,
+                              0.25 * s], axis=1)
+    # Keep w positive for a canonical result
+    return canonical_quat(quats)
+
+
+def euler_to_matrix(eulers):
+    """Convert 'XYZ' eulers to rotation matrices."""
+    eulers = as_rows(eulers, 3)
+    ci, cj, ch = np.cos(eulers).T
+    si, sj, sh = np.sin(eulers).T
+    mats = np.empty((len(eulers), 3, 3))
+    mats[:, 0, 0] = cj * ch
+    mats[:, 0, 1] = sj * si * ch - ci * sh
+    mats[:, 0, 2] = sj * ci * ch + si * sh
+    mats[:, 1, 0] = cj * sh
+    mats[:, 1, 1] = sj * si * sh + ci * ch
+    mats[:, 1, 2] = sj * ci * sh - si * ch
+    mats[:, 2, 0] = -sj
+    mats[:, 2, 1] = cj * si
+    mats[:, 2, 2] = cj * ci
+    return mats
+
+
+def matrix_to_euler_pair(mats):
+    """Return both 'XYZ' euler solutions for each rotation matrix."""
+    m = np.asarray(mats, dtype=np.float64).reshape(-1, 3, 3)
+    cy = np.hypot(m[:, 0, 0], m[:, 1, 0])
+    eul1 = np.stack([np.arctan2(m[:, 2, 1], m[:, 2, 2]),
+                     np.arctan2(-m[:, 2, 0], cy),
+                     np.arctan2(m[:, 1, 0], m[:, 0, 0])], axis=1)
+    eul2 = np.stack([np.arctan2(-m[:, 2, 1], -m[:, 2, 2]),
+                     np.arctan2(-m[:, 2, 0], -cy),
+                     np.arctan2(-m[:, 1, 0], -m[:, 0, 0])], axis=1)
+    # Gimbal lock: only one solution, put everything into x
+    locked = cy <= 16.0 * np.finfo(np.float32).eps
+    eul1[locked, 0] = np.arctan2(-m[locked, 1, 2], m[locked, 1, 1])
+    eul1[locked, 2] = 0.0
+    eul2[locked] = eul1[locked]
+    return eul1, eul2
+
+
+def euler_filter(eul1, eul2, prev_eul=(0.0, 0.0, 0.0)):
+    """Pick the euler solutions forming the most continuous sequence.
+
+    eul1 and eul2 are the (N, 3) alternative solutions for each rotation,
+    prev_eul is the rotation before the first one. Every rotation takes the
+    solution closest to the one picked for the rotation before, then jumps
+    of more than 180 degrees are removed by adding full turns.
+    """
+    candidates = np.stack((as_rows(eul1, 3), as_rows(eul2, 3)))
+    key_cnt = candidates.shape[1]
+    if not key_cnt:
+        return np.zeros((0, 3))
+    prev_eul = as_rows(prev_eul, 3)
+    # Distance from both solutions of the rotation before (both prev_eul
+    # for the first one) to both solutions, as (before, current, N)
+    before = np.concatenate((np.broadcast_to(prev_eul, (2, 1, 3)),
+                             candidates[:, :-1]), axis=1)
+    dist = np.sum(np.abs(wrap_angle(candidates[None] - before[:, None])),
+                  axis=3)
+    pick = np.argmin(dist, axis=1)  # Pick for either solution before
+    # Picks not depending on the solution before fix the choice (always
+    # true for the first rotation), the others keep or swap it
+    fixed = pick[0] == pick[1]
+    swap = ~fixed & (pick[0] == 1)
+    key_ids = np.arange(key_cnt)
+    last_fixed = np.maximum.accumulate(np.where(fixed, key_ids, 0))
+    swap_cnt = np.cumsum(swap)
+    chosen = (pick[0, last_fixed] + swap_cnt - swap_cnt[last_fixed]) % 2
+    filtered = np.unwrap(candidates[chosen, key_ids], axis=0)
+    # Full turns to start close to prev_eul
+    pi_x2 = 2.0 * math.pi
+    return filtered + pi_x2 * np.round((prev_eul - filtered[0]) / pi_x2)
+
+
+def quat_to_euler(quats, prev_eul=(0.0, 0.0, 0.0)):
+    """Convert (w, x, y, z) quaternions to a continuous 'XYZ' euler curve."""
+    return euler_filter(*matrix_to_euler_pair(quat_to_matrix(quats)),
+                        prev_eul)
+
+
+def euler_to_quat(eulers):
+    """Convert 'XYZ' eulers to (w, x, y, z) quaternions."""
+    return matrix_to_quat(euler_to_matrix(eulers))
+
+
+def apply_parent_inverse_loc(pinv, locations):
+    """Transform (N, 3) locations by a 4x4 parent inverse matrix."""
+    pinv = np.asarray(pinv, dtype=np.float64).reshape(4, 4)
+    return as_rows(locations, 3) @ pinv[:3, :3].T + pinv[:3, 3]
+
+
+def apply_parent_inverse_rot(pinv, mats):
+    """Return the quaternions of (N, 3, 3) rotations after a parent inverse.
+
+    The rotation is taken from the combined matrix, scale is removed.
+    """
+    pinv = np.asarray(pinv, dtype=np.float64).reshape(4, 4)
+    return matrix_to_quat(pinv[:3, :3] @ mats)
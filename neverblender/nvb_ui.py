@@ -33,6 +33,8 @@ class NVB_UL_anims(bpy.types.UIList):
 
         if self.layout_type in {'DEFAULT', 'COMPACT'}:
             layout.prop(item, 'name', text='', emboss=False)
+            if item.lazy_source:  # Keyframes not loaded yet
+                layout.label(text='', icon='IMPORT')
             icn = 'CHECKBOX_DEHLT' if item.mute else 'CHECKBOX_HLT'
             layout.prop(item, 'mute', text='', icon=icn, emboss=False)
         elif self.layout_type in {'GRID'}:
@@ -575,6 +577,9 @@ class NVB_MT_animlist_specials(bpy.types.Menu):
                         icon='SORTSIZE')
         layout.operator(nvb_ops_anim.NVB_OT_anim_clone.bl_idname,
                         icon='NODETREE')
+        layout.operator(nvb_ops_anim.NVB_OT_anim_load.bl_idname,
+                        text='Load all animations',
+                        icon='IMPORT').load_all = True
 
 
 class NVB_PT_animlist(bpy.types.Panel):
@@ -618,6 +623,8 @@ class NVB_PT_animlist(bpy.types.Panel):
             col.separator()
             col.operator('nvb.anim_focus',
                          icon='PREVIEW_RANGE', text='')
+            col.operator('nvb.anim_load',
+                         icon='IMPORT', text='')
             col.menu('NVB_MT_animlist_specials',
                      icon='PLUS', text="")
             anim_list = mdl_base.nvb.animList
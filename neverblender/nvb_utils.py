@@ -5,6 +5,9 @@ import math
 import re
 import collections
 import unicodedata
+import heapq
+
+import numpy as np
 
 import mathutils
 import bpy
@@ -75,54 +78,89 @@ class AuroraSmoothgroupGraph():
     is sufficient
     """
     max_colours = 31  # NWN may only use 32 groups max
-    
+
     def __init__(self):
-        pass
-    
-    
-    def is_colour_valid(self, v, colour, c):
-        """Check if a color assignment is valid."""
-        for i in range(self.V):
-            if self.graph[v][i] == 1 and colour[i] == c:
-                return False
-        return True
-     
-     
-    def create_colourization(self, colour, v):
-        """Find a valid colourization of the graph."""
-        if v == self.V:
-            return True
- 
-        for c in range(1, self.max_colours + 1):
-            if self.is_colour_valid(v, colour, c) == True:
-                colour[v] = c
-                if self.create_colourization(colour, v + 1) == True:
-                    return True
-                colour[v] = 0
-    
-    
+        self.adjacency = []
+        self.conflicts = 0
+
+    def create_adjacency(self, blen_mesh, group_ids, group_cnt):
+        """Connect groups sharing a vertex, single pass over all loops."""
+        loop_vert_ids = np.empty(len(blen_mesh.loops), dtype=np.int64)
+        blen_mesh.loops.foreach_get('vertex_index', loop_vert_ids)
+        poly_cnt = len(blen_mesh.polygons)
+        loop_start = np.empty(poly_cnt, dtype=np.int64)
+        blen_mesh.polygons.foreach_get('loop_start', loop_start)
+        loop_total = np.empty(poly_cnt, dtype=np.int64)
+        blen_mesh.polygons.foreach_get('loop_total', loop_total)
+        # Loop indices polygon by polygon and the group of their polygon
+        loop_ids = np.repeat(loop_start - np.cumsum(loop_total) + loop_total,
+                             loop_total) + np.arange(loop_total.sum())
+        vert_group_ids = np.unique(np.stack(
+            (loop_vert_ids[loop_ids], np.repeat(group_ids, loop_total)),
+            axis=1), axis=0)
+        # All groups using the same vertex are adjacent
+        self.adjacency = [set() for _ in range(group_cnt + 1)]
+        split_ids = np.flatnonzero(np.diff(vert_group_ids[:, 0])) + 1
+        for vert_groups in np.split(vert_group_ids[:, 1], split_ids):
+            if len(vert_groups) > 1:
+                vert_groups = vert_groups.tolist()
+                for g in vert_groups:
+                    self.adjacency[g].update(vert_groups)
+        # Group 0 (faces without group) is never coloured
+        self.adjacency[0].clear()
+        for g, adjacent_groups in enumerate(self.adjacency):
+            adjacent_groups.discard(g)
+            adjacent_groups.discard(0)
+
+    def create_colourization(self):
+        """Colour the graph (DSATUR), return a colour for each group.
+
+        If the colours are not enough the colour with the fewest
+        conflicting neighbours is used.
+        """
+        group_cnt = len(self.adjacency)
+        colours = [0] * group_cnt
+        saturation = [set() for _ in range(group_cnt)]
+        # Most saturated group first, ties broken by degree
+        heap = [(0, -len(adj), g) for g, adj in enumerate(self.adjacency)]
+        heapq.heapify(heap)
+        self.conflicts = 0
+        while heap:
+            sat, _, g = heapq.heappop(heap)
+            if colours[g] or -sat != len(saturation[g]):
+                continue  # Outdated entry
+            free_colours = (c for c in range(1, self.max_colours + 1)
+                            if c not in saturation[g])
+            colour = next(free_colours, 0)
+            if not colour:
+                neighbour_colours = collections.Counter(
+                    colours[n] for n in self.adjacency[g])
+                colour = min(range(1, self.max_colours + 1),
+                             key=lambda c: neighbour_colours[c])
+                self.conflicts += 1
+            colours[g] = colour
+            for n in self.adjacency[g]:
+                if not colours[n] and colour not in saturation[n]:
+                    saturation[n].add(colour)
+                    heapq.heappush(heap, (-len(saturation[n]),
+                                          -len(self.adjacency[n]), n))
+        return colours
+
     def calc_smooth_groups(self, blen_mesh):
-        """Get a valid number of """
+        """Get a list of smoothgroups (powers of two), one per face."""
         group_ids, group_cnt = blen_mesh.calc_smooth_groups(use_bitflags=False)
-        group_polys = [[fid for fid, g in enumerate(group_ids) if g==gid] for gid in range(1,group_cnt+1)]   
-        group_verts = [set([v for vl in [p.vertices[:] for pid, p in enumerate(blen_mesh.polygons) if pid in pid_list] for v in vl]) for pid_list in group_polys]
-        
-        self.graph = [[not g1.isdisjoint(g2) for g1 in group_verts] for g2 in group_verts]
-        self.V = group_cnt     
-                
-        # Get a graph colorization
-        colour_list = [0] * self.V
-        if self.create_colourization(colour_list, 0) == None:
-            return []
-        
-        # Map colourization to faces
-        #colour_list = [2**c for c in colour_list]
-        smoothgroups = list([(face_idx, 2**(colour-1)) for face_idx in goup_face] for goup_face, colour in zip(group_polys, colour_list))     
-        smoothgroups = [item for sublist in smoothgroups for item in sublist]
-        smoothgroups.sort(key=lambda x: x[0])
-        smoothgroups = [sgi for (fi, sgi) in smoothgroups]
-        
-        return smoothgroups 
+        group_ids = np.array(group_ids, dtype=np.int64)
+        self.create_adjacency(blen_mesh, group_ids, group_cnt)
+        colours = self.create_colourization()
+        if self.conflicts:
+            print("Neverblender: WARNING - " + str(self.conflicts) +
+                  " smoothgroup(s) of " + blen_mesh.name +
+                  " share vertices with groups of the same id, " +
+                  str(self.max_colours) + " groups are not enough.")
+        # Map colourization to faces, faces without group get 0
+        smoothgroups = [2**(c-1) if c else 0 for c in colours]
+        smoothgroups[0] = 0
+        return [smoothgroups[g] for g in group_ids.tolist()]
 
 
 def is_mdl_base(obj):
@@ -186,6 +224,39 @@ def get_fcurve(action, data_path, index=0, group_name=None):
     return fcu
 
 
+# Values of the keyframe interpolation enum, for foreach_set
+interpolation_modes = {'CONSTANT': 0, 'LINEAR': 1, 'BEZIER': 2}
+
+
+def insert_keyframes(fcurves, frames, values, interpolation='LINEAR'):
+    """Append keyframes to fcurves (one per dimension) in bulk.
+
+    values holds one row per frame with one column per fcurve. Coordinates
+    and interpolation are written with foreach_set, existing keyframes
+    are kept.
+    """
+    frames = np.asarray(frames, dtype=np.float32)
+    if not len(frames):
+        return
+    values = np.asarray(values, dtype=np.float32).reshape(len(frames), -1)
+    new_cnt = len(frames)
+    for dim, fcu in enumerate(fcurves):
+        kfp = fcu.keyframe_points
+        kfp_cnt = len(kfp)
+        co = np.empty(2 * (kfp_cnt + new_cnt), dtype=np.float32)
+        ipo = np.empty(kfp_cnt + new_cnt, dtype=np.int32)
+        if kfp_cnt:
+            kfp.foreach_get('co', co[:2 * kfp_cnt])
+            kfp.foreach_get('interpolation', ipo[:kfp_cnt])
+        co[2 * kfp_cnt::2] = frames
+        co[2 * kfp_cnt + 1::2] = values[:, dim]
+        ipo[kfp_cnt:] = interpolation_modes[interpolation]
+        kfp.add(new_cnt)
+        kfp.foreach_set('co', co)
+        kfp.foreach_set('interpolation', ipo)
+        fcu.update()
+
+
 def get_action(target, action_name):
     """Get the active action or create one."""
     # Get animation data, create if needed
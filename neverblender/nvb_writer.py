@@ -0,0 +1,305 @@
+"""Stream generated ASCII lines to files."""
+
+import concurrent.futures
+import contextlib
+import multiprocessing
+import os
+import re
+
+import numpy as np
+
+from . import nvb_parse
+from . import nvb_binmdl
+
+
+class AsciiWriter():
+    """Writes lines to a text file as soon as they are generated.
+
+    Can be used in place of the list of lines passed to the generate_ascii
+    functions. Lines are separated by '\\n', exactly like '\\n'.join() would
+    do, the file object takes care of newline conversion.
+    """
+
+    chunk_size = 4096  # Rows per chunk for numeric blocks
+
+    def __init__(self, file):
+        """TODO: DOC."""
+        self.file = file
+        self.line_cnt = 0
+
+    def __len__(self):
+        """Return the number of lines written so far."""
+        return self.line_cnt
+
+    def __bool__(self):
+        """Return true if lines have been written."""
+        return self.line_cnt > 0
+
+    def write_text(self, text, line_cnt):
+        """Write a block of line_cnt lines, already joined by '\\n'."""
+        if not line_cnt:
+            return
+        if self.line_cnt:
+            self.file.write('\n')
+        self.file.write(text)
+        self.line_cnt += line_cnt
+
+    def append(self, line):
+        """Write a single line."""
+        self.write_text(line, 1)
+
+    def extend(self, lines):
+        """Write multiple lines."""
+        if not isinstance(lines, (list, tuple)):
+            lines = list(lines)
+        self.write_text('\n'.join(lines), len(lines))
+
+    def extend_rows(self, fstr, rows):
+        """Write rows of a numeric array, formatted in chunks."""
+        for text, row_cnt in format_rows(fstr, rows):
+            self.write_text(text, row_cnt)
+
+
+class AsciiSnapshot():
+    """Collects lines, numeric blocks are kept as arrays.
+
+    Used in place of the list of lines to move formatting of the numeric
+    blocks to another process. Holds plain data only, can be pickled.
+    """
+
+    def __init__(self):
+        """TODO: DOC."""
+        self.blocks = []  # Lines or (format, rows) tuples
+        self.line_cnt = 0
+
+    def __len__(self):
+        """Return the number of lines."""
+        return self.line_cnt
+
+    def __bool__(self):
+        """Return true if there are lines."""
+        return self.line_cnt > 0
+
+    def append(self, line):
+        """Add a single line."""
+        self.blocks.append(line)
+        self.line_cnt += 1
+
+    def extend(self, lines):
+        """Add multiple lines."""
+        lines = list(lines)
+        self.blocks.extend(lines)
+        self.line_cnt += len(lines)
+
+    def extend_rows(self, fstr, rows):
+        """Add rows of a numeric array (a copy), formatted later."""
+        rows = np.array(rows)
+        self.blocks.append((fstr, rows))
+        self.line_cnt += len(rows)
+
+    def write_to(self, ascii_lines):
+        """Add all lines to a list of lines or an AsciiWriter."""
+        for block in self.blocks:
+            if isinstance(block, str):
+                ascii_lines.append(block)
+            else:
+                extend_rows(ascii_lines, *block)
+
+    def lines(self):
+        """Yield all lines."""
+        for block in self.blocks:
+            if isinstance(block, str):
+                yield block
+            else:
+                for text, _ in format_rows(*block):
+                    yield from text.split('\n')
+
+
+class RecordWriter():
+    """Collects records for the compiled mdl writer instead of lines.
+
+    Used in place of the list of lines when exporting compiled mdls.
+    Numeric blocks are kept as arrays and never formatted, only the other
+    lines are tokenized. Expects complete node and animation blocks, as
+    generated on export.
+    """
+
+    record_types = {'node': nvb_parse.Recordtype.NODE,
+                    'endnode': nvb_parse.Recordtype.ENDNODE,
+                    'newanim': nvb_parse.Recordtype.NEWANIM,
+                    'doneanim': nvb_parse.Recordtype.DONEANIM}
+
+    def __init__(self):
+        """TODO: DOC."""
+        self.records = []  # (type, tokens, rows), rows may be an array
+        self.line_cnt = 0
+
+    def __len__(self):
+        """Return the number of lines."""
+        return self.line_cnt
+
+    def __bool__(self):
+        """Return true if there are lines."""
+        return self.line_cnt > 0
+
+    def append(self, line):
+        """Add a single line."""
+        self.line_cnt += 1
+        tokens = line.split()
+        if not tokens or tokens[0].startswith('#'):
+            return
+        if nvb_parse.ascii_is_row(tokens):
+            if self.records:
+                self.add_rows([tokens])
+            return
+        record_type = RecordWriter.record_types.get(
+            tokens[0].lower(), nvb_parse.Recordtype.LINE)
+        self.records.append((record_type, tokens, []))
+
+    def extend(self, lines):
+        """Add multiple lines."""
+        for line in lines:
+            self.append(line)
+
+    def extend_rows(self, fstr, rows):
+        """Add rows of a numeric array (a copy) to the last record."""
+        rows = np.array(rows)
+        if rows.ndim == 1:
+            rows = rows.reshape(-1, 1)
+        self.line_cnt += len(rows)
+        if self.records and len(rows):
+            self.add_rows(rows)
+
+    def add_rows(self, rows):
+        """Add rows to the last record, keep arrays as they are."""
+        record_type, tokens, record_rows = self.records[-1]
+        if not len(record_rows):
+            record_rows = rows
+        elif isinstance(record_rows, list) and isinstance(rows, list):
+            record_rows.extend(rows)
+        else:  # Mixed text and numbers
+            record_rows = [*record_rows, *rows]
+        self.records[-1] = (record_type, tokens, record_rows)
+
+
+def format_rows(fstr, rows):
+    """Format rows of a numeric array, yield '\\n' joined chunks.
+
+    fstr is a %-style format for a single row. Yields (text, row count).
+    """
+    rows = np.asarray(rows)
+    if rows.ndim == 1:
+        rows = rows.reshape(-1, 1)
+    chunk_size = AsciiWriter.chunk_size
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start+chunk_size]
+        text = ('\n' + fstr) * len(chunk) % tuple(chunk.ravel().tolist())
+        yield text[1:], len(chunk)
+
+
+def percent_format(fstr):
+    """Convert a str.format style row format to %-style.
+
+    Only simple fields are supported, e.g. ' {:> 6.5f}' becomes ' % 6.5f'.
+    """
+    return re.sub(r'\{:(?: ?>)?([^}]*)\}', r'%\1', fstr)
+
+
+def extend_rows(ascii_lines, fstr, rows):
+    """Add one line per row of rows, formatted with the %-style fstr.
+
+    Works on a list of lines as well as on an AsciiWriter, AsciiSnapshot
+    or RecordWriter.
+    """
+    if isinstance(ascii_lines, (AsciiWriter, AsciiSnapshot, RecordWriter)):
+        ascii_lines.extend_rows(fstr, rows)
+        return
+    for text, _ in format_rows(fstr, rows):
+        ascii_lines.extend(text.split('\n'))
+
+
+@contextlib.contextmanager
+def open_ascii(filepath, buffer_size=1 << 20):
+    """Open an AsciiWriter for a file with '\\r\\n' newlines.
+
+    Output goes to a temporary file first, the existing file is only
+    replaced if writing succeeds and at least one line was written.
+    """
+    filepath = os.fsencode(filepath)
+    tmp_path = filepath + os.fsencode('.{:d}.tmp'.format(os.getpid()))
+    try:
+        with open(tmp_path, 'w', newline='\r\n',
+                  buffering=buffer_size) as f:
+            ascii_writer = AsciiWriter(f)
+            yield ascii_writer
+        if ascii_writer:
+            os.replace(tmp_path, filepath)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def write_file(filepath, ascii_lines, binary=False):
+    """Write a list of lines or an AsciiSnapshot to an (binary) mdl file.
+
+    Compiled mdls can also be written from a RecordWriter.
+    """
+    if not ascii_lines:
+        return
+    if binary:
+        if not isinstance(ascii_lines, RecordWriter):
+            record_writer = RecordWriter()
+            if isinstance(ascii_lines, AsciiSnapshot):
+                ascii_lines.write_to(record_writer)
+            else:
+                record_writer.extend(ascii_lines)
+            ascii_lines = record_writer
+        mdl_data = nvb_binmdl.write_records(ascii_lines.records)
+        with open(os.fsencode(filepath), 'wb') as f:
+            f.write(mdl_data)
+    else:
+        with open_ascii(filepath) as ascii_writer:
+            if isinstance(ascii_lines, AsciiSnapshot):
+                ascii_lines.write_to(ascii_writer)
+            else:
+                ascii_writer.extend(ascii_lines)
+
+
+def write_files(jobs, max_workers=1):
+    """Generate and write files for (filepath, generate, binary) jobs.
+
+    generate(ascii_lines) adds the lines of a file, it always runs in the
+    calling process, jobs may be a generator. With more than one worker the
+    numeric blocks are formatted and files are written in a process pool,
+    while the caller is generating the next files. Workers are forked,
+    without fork (Windows) files are written sequentially and ASCII files
+    are streamed to disk while generating. Forking blender is not safe in
+    general (threads, GPU and audio state), so this is opt-in.
+    """
+    if max_workers < 1:
+        max_workers = os.cpu_count() or 1
+    if max_workers <= 1 or \
+       'fork' not in multiprocessing.get_all_start_methods():
+        for filepath, generate, binary in jobs:
+            if binary:
+                record_writer = RecordWriter()
+                generate(record_writer)
+                write_file(filepath, record_writer, True)
+            else:
+                with open_ascii(filepath) as ascii_writer:
+                    generate(ascii_writer)
+        return
+    executor = concurrent.futures.ProcessPoolExecutor(
+        max_workers, mp_context=multiprocessing.get_context('fork'))
+    try:
+        futures = []
+        for filepath, generate, binary in jobs:
+            snapshot = AsciiSnapshot()
+            generate(snapshot)
+            if snapshot:
+                futures.append(executor.submit(write_file, filepath,
+                                               snapshot, binary))
+        for future in futures:
+            future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,18 @@
+"""Make the blender independent modules of the addon importable.
+
+The package __init__ registers the addon with blender. The tests only
+cover modules working on plain python and numpy data, so the package is
+set up without running it.
+"""
+
+import os
+import sys
+import types
+
+addon_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         os.pardir, 'neverblender')
+
+if 'neverblender' not in sys.modules:
+    package = types.ModuleType('neverblender')
+    package.__path__ = [os.path.normpath(addon_dir)]
+    sys.modules['neverblender'] = package
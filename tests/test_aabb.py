@@ -0,0 +1,171 @@
+"""Tests for the walkmesh aabb tree."""
+
+import numpy as np
+import pytest
+
+from neverblender import nvb_aabb
+
+
+def random_faces(face_cnt, seed):
+    """Small random triangles spread over a tile sized area."""
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(-5.0, 5.0, (face_cnt, 1, 3))
+    return (centers + rng.uniform(-0.5, 0.5, (face_cnt, 3, 3))).astype(
+        np.float32)
+
+
+def grid_faces(size):
+    """Flat grid of triangles, all centroids coplanar."""
+    faces = []
+    for x in range(size):
+        for y in range(size):
+            faces.append([(x, y, 0), (x + 1, y, 0), (x + 1, y + 1, 0)])
+            faces.append([(x, y, 0), (x + 1, y + 1, 0), (x, y + 1, 0)])
+    return np.array(faces, dtype=np.float32)
+
+
+def reference_tree(aabb_tree, face_list, rlevel=0):
+    """Previous recursive builder (splits at the average centroid).
+
+    Copied from nvb_aabb.generate_tree before the SAH builder replaced it,
+    numpy arrays instead of mathutils vectors. face_list contains
+    (face_idx, face vertices, face centroid) tuples.
+    """
+    if rlevel > 255:
+        raise RecursionError('Recursion level exceeds 255')
+    if not face_list:
+        return
+    face_vertices = np.array([face[1] for face in face_list])
+    bb_min = face_vertices.min(axis=(0, 1))
+    bb_max = face_vertices.max(axis=(0, 1))
+    bb_avgcentroid = sum(face[2] for face in face_list) / len(face_list)
+
+    if len(face_list) == 1:
+        aabb_tree.append([*bb_min.tolist(), *bb_max.tolist(),
+                          face_list[0][0]])
+        return
+    aabb_tree.append([*bb_min.tolist(), *bb_max.tolist(), -1])
+    # Longest axis of bounding box
+    bb_size = bb_max - bb_min
+    split_axis = 0
+    if bb_size[1] > bb_size[0]:
+        split_axis = 1
+    if bb_size[2] > bb_size[1]:
+        split_axis = 2
+    # Change axis in case points are coplanar with the split plane
+    if all(face[2][split_axis] == bb_avgcentroid[split_axis]
+           for face in face_list):
+        split_axis = (split_axis + 1) % 3
+    for _ in range(3):
+        face_list_left = [face for face in face_list
+                          if face[2][split_axis] < bb_avgcentroid[split_axis]]
+        face_list_right = [face for face in face_list
+                           if face[2][split_axis] >=
+                           bb_avgcentroid[split_axis]]
+        if face_list_left and face_list_right:
+            break
+        split_axis = (split_axis + 1) % 3
+    else:
+        raise ValueError('Split problem')
+    reference_tree(aabb_tree, face_list_left, rlevel + 1)
+    reference_tree(aabb_tree, face_list_right, rlevel + 1)
+
+
+def leaf_bounds(aabb_tree):
+    """Map the face of each leaf to its box."""
+    return {node[6]: node[:6] for node in aabb_tree if node[6] >= 0}
+
+
+def check_subtree(aabb_tree, node_idx, face_verts, leaf_faces, depth=0):
+    """Check a node and its children, return index after the subtree.
+
+    Inner nodes are followed by their left and right subtree (pre-order).
+    """
+    node = aabb_tree[node_idx]
+    bb_min, bb_max, face_idx = np.array(node[:3]), np.array(node[3:6]), node[6]
+    if face_idx >= 0:
+        # Leaf: box of exactly this face
+        leaf_faces.append(face_idx)
+        np.testing.assert_allclose(bb_min, face_verts[face_idx].min(axis=0))
+        np.testing.assert_allclose(bb_max, face_verts[face_idx].max(axis=0))
+        return node_idx + 1, depth
+    assert face_idx == -1
+    end_idx = node_idx + 1
+    max_depth = depth
+    for _ in range(2):
+        child = aabb_tree[end_idx]
+        # Child boxes are nested in the parent box
+        assert np.all(np.array(child[:3]) >= bb_min)
+        assert np.all(np.array(child[3:6]) <= bb_max)
+        end_idx, child_depth = check_subtree(aabb_tree, end_idx, face_verts,
+                                             leaf_faces, depth + 1)
+        max_depth = max(max_depth, child_depth)
+    return end_idx, max_depth
+
+
+def check_tree(aabb_tree, face_verts):
+    """Check the whole tree, return its depth."""
+    leaf_faces = []
+    end_idx, depth = check_subtree(aabb_tree, 0, face_verts, leaf_faces)
+    assert end_idx == len(aabb_tree)
+    # Every face is in exactly one leaf
+    assert sorted(leaf_faces) == list(range(len(face_verts)))
+    assert len(aabb_tree) == 2 * len(face_verts) - 1
+    # Root box contains all faces
+    np.testing.assert_allclose(aabb_tree[0][:3], face_verts.min(axis=(0, 1)))
+    np.testing.assert_allclose(aabb_tree[0][3:6], face_verts.max(axis=(0, 1)))
+    return depth
+
+
+def test_empty():
+    assert nvb_aabb.generate_tree_sah(np.zeros((0, 3, 3))) == []
+
+
+def test_single_face():
+    face_verts = random_faces(1, 0)
+    aabb_tree = nvb_aabb.generate_tree_sah(face_verts)
+    assert len(aabb_tree) == 1
+    assert aabb_tree[0][6] == 0
+
+
+@pytest.mark.parametrize('face_cnt, seed', [(2, 1), (3, 2), (17, 3),
+                                            (1000, 4)])
+def test_random_faces(face_cnt, seed):
+    face_verts = random_faces(face_cnt, seed)
+    check_tree(nvb_aabb.generate_tree_sah(face_verts), face_verts)
+
+
+def test_coplanar_grid():
+    face_verts = grid_faces(16)
+    check_tree(nvb_aabb.generate_tree_sah(face_verts), face_verts)
+
+
+def test_identical_faces():
+    face_verts = np.repeat(random_faces(1, 5), 9, axis=0)
+    depth = check_tree(nvb_aabb.generate_tree_sah(face_verts), face_verts)
+    assert depth <= 4
+
+
+@pytest.mark.parametrize('face_verts', [random_faces(2, 7),
+                                        random_faces(100, 8),
+                                        random_faces(2000, 9),
+                                        grid_faces(12)])
+def test_same_as_reference(face_verts):
+    reference = []
+    reference_tree(reference, [(i, verts, verts.mean(axis=0))
+                               for i, verts in enumerate(face_verts)])
+    aabb_tree = nvb_aabb.generate_tree_sah(face_verts)
+    # Different splits, but both are valid trees over the same faces
+    check_tree(reference, face_verts)
+    check_tree(aabb_tree, face_verts)
+    assert len(aabb_tree) == len(reference)
+    assert aabb_tree[0][:6] == reference[0][:6]
+    assert leaf_bounds(aabb_tree) == leaf_bounds(reference)
+
+
+def test_large_mesh_depth():
+    # Deep recursion broke the previous builder, this one has no limit
+    # but should stay balanced on evenly spread faces
+    face_verts = random_faces(5000, 6)
+    depth = check_tree(nvb_aabb.generate_tree_sah(face_verts), face_verts)
+    assert depth < 64
@@ -0,0 +1,404 @@
+"""Round trip tests for the compiled mdl writer and reader."""
+
+import io
+
+import numpy as np
+import pytest
+
+from neverblender import nvb_binmdl
+from neverblender import nvb_parse
+from neverblender import nvb_rotation
+from neverblender import nvb_writer
+
+Recordtype = nvb_parse.Recordtype
+
+sample_mdl = """\
+newmodel sample
+setsupermodel sample null
+classification character
+setanimationscale 1.5
+beginmodelgeom sample
+node dummy sample
+  parent null
+endnode
+node trimesh body
+  parent sample
+  position 1.0 2.0 3.0
+  orientation 0.0 0.0 1.0 1.5
+  ambient 0.5 0.5 0.5
+  diffuse 0.8 0.8 0.8
+  specular 0.0 0.0 0.0
+  shininess 10
+  bitmap bodytex
+  verts 4
+    0.0 0.0 0.0
+    1.0 0.0 0.0
+    1.0 1.0 0.0
+    0.0 1.0 0.5
+  tverts 4
+    0.0 0.0 0
+    1.0 0.0 0
+    1.0 1.0 0
+    0.0 1.0 0
+  faces 2
+    0 1 2 1 0 1 2 3
+    0 2 3 1 0 2 3 4
+endnode
+node trimesh seam
+  parent body
+  position 0.0 0.0 1.0
+  bitmap seamtex
+  verts 3
+    0.0 0.0 0.0
+    2.0 0.0 0.0
+    0.0 2.0 0.0
+  tverts 4
+    0.0 0.0 0
+    1.0 0.0 0
+    0.0 1.0 0
+    0.5 0.5 0
+  faces 2
+    0 1 2 1 0 1 2 1
+    2 1 0 1 3 1 0 2
+endnode
+node danglymesh cape
+  parent body
+  bitmap capetex
+  displacement 0.5
+  tightness 2.0
+  period 3.0
+  verts 3
+    0.0 0.0 0.0
+    1.0 0.0 0.0
+    0.0 0.0 -1.0
+  tverts 3
+    0.0 0.0 0
+    1.0 0.0 0
+    0.0 1.0 0
+  faces 1
+    0 1 2 1 0 1 2 1
+  constraints 3
+    0.0
+    128.0
+    255.0
+endnode
+node light lamp
+  parent sample
+  position 0.0 0.0 2.0
+  color 1.0 0.5 0.25
+  radius 5.0
+  lightpriority 3
+endnode
+endmodelgeom sample
+newanim walk sample
+  length 1.0
+  transtime 0.25
+  animroot sample
+  event 0.5 step
+  node dummy sample
+    parent null
+  endnode
+  node trimesh body
+    parent sample
+    positionkey 2
+      0.0 1.0 2.0 3.0
+      1.0 1.0 2.0 4.0
+    orientationkey 3
+      0.0 0.0 0.0 1.0 1.5
+      0.5 0.0 1.0 0.0 0.0
+      1.0 1.0 0.0 0.0 0.5
+  endnode
+  node light lamp
+    parent sample
+    colorkey 2
+      0.0 1.0 0.5 0.25
+      1.0 0.0 0.0 1.0
+  endnode
+doneanim walk sample
+donemodel sample
+"""
+
+
+def group_records(records):
+    """Return header lines and {(animation, node): {label: record}}."""
+    header = dict()
+    nodes = dict()
+    anim_name = ''
+    node_props = None
+    for rtype, tokens, rows in records:
+        label = tokens[0].lower()
+        if rtype == Recordtype.NEWANIM:
+            anim_name = tokens[1]
+        elif rtype == Recordtype.DONEANIM:
+            anim_name = ''
+        elif rtype == Recordtype.NODE:
+            node_props = {'type': (tokens, rows)}
+            nodes[(anim_name, tokens[2])] = node_props
+        elif rtype == Recordtype.ENDNODE:
+            node_props = None
+        elif node_props is not None:
+            node_props[label] = (tokens, rows)
+        elif anim_name:
+            header[(anim_name, label)] = tokens[1:]
+        else:
+            header[label] = tokens[1:]
+    return header, nodes
+
+
+def block(props, label, dim, dtype=np.float32):
+    """Numeric block of a node as array."""
+    tokens, rows = props[label]
+    return nvb_parse.ascii_array(rows, nvb_parse.ascii_int(tokens[1]), dim,
+                                 dtype)
+
+
+def values(props, label):
+    """Values of a single line property as array."""
+    return np.array([float(v) for v in props[label][0][1:]])
+
+
+def same_rotation(axisangles1, axisangles2):
+    """Compare axis-angles by their quaternions (sign does not matter)."""
+    dots = np.abs(np.sum(nvb_rotation.axisangle_to_quat(axisangles1) *
+                         nvb_rotation.axisangle_to_quat(axisangles2), axis=1))
+    np.testing.assert_allclose(dots, 1.0, atol=1.0e-6)
+
+
+@pytest.fixture(scope='module')
+def round_trip(tmp_path_factory):
+    """Records of the sample and the records read back after compiling."""
+    records = list(nvb_parse.ascii_records(io.StringIO(sample_mdl)))
+    mdl_path = tmp_path_factory.mktemp('binmdl') / 'sample.mdl'
+    mdl_path.write_bytes(nvb_binmdl.write_records(records))
+    return (group_records(records),
+            group_records(nvb_binmdl.read_records(str(mdl_path))),
+            str(mdl_path))
+
+
+def test_header(round_trip):
+    (header, _), (read_header, _), _ = round_trip
+    assert read_header['newmodel'] == ['sample']
+    assert read_header['setsupermodel'] == ['sample', 'null']
+    assert read_header['classification'] == ['character']
+    assert float(read_header['setanimationscale'][0]) == 1.5
+    assert read_header[('walk', 'animroot')] == ['sample']
+    assert read_header[('walk', 'event')] == ['0.5', 'step']
+    for label in ['length', 'transtime']:
+        assert float(read_header[('walk', label)][0]) == \
+            float(header[('walk', label)][0])
+
+
+def test_nodes(round_trip):
+    (_, nodes), (_, read_nodes), _ = round_trip
+    assert list(read_nodes) == list(nodes)
+    for key, props in nodes.items():
+        read_props = read_nodes[key]
+        assert read_props['type'][0][1] == props['type'][0][1]
+        assert read_props['parent'][0][1] == props['parent'][0][1]
+
+
+def test_controllers(round_trip):
+    (_, nodes), (_, read_nodes), _ = round_trip
+    for key, label in [(('', 'body'), 'position'), (('', 'lamp'), 'color'),
+                       (('', 'lamp'), 'radius'), (('', 'lamp'), 'position')]:
+        np.testing.assert_allclose(values(read_nodes[key], label),
+                                   values(nodes[key], label), rtol=1.0e-6)
+    same_rotation(values(read_nodes[('', 'body')], 'orientation')[None],
+                  values(nodes[('', 'body')], 'orientation')[None])
+
+
+def test_animation_keys(round_trip):
+    (_, nodes), (_, read_nodes), _ = round_trip
+    body = nodes[('walk', 'body')]
+    read_body = read_nodes[('walk', 'body')]
+    np.testing.assert_allclose(block(read_body, 'positionkey', 4),
+                               block(body, 'positionkey', 4))
+    orientations = block(body, 'orientationkey', 5)
+    read_orientations = block(read_body, 'orientationkey', 5)
+    np.testing.assert_allclose(read_orientations[:, 0], orientations[:, 0])
+    same_rotation(read_orientations[:, 1:], orientations[:, 1:])
+    np.testing.assert_allclose(
+        block(read_nodes[('walk', 'lamp')], 'colorkey', 4),
+        block(nodes[('walk', 'lamp')], 'colorkey', 4))
+
+
+def test_mesh_arrays(round_trip):
+    (_, nodes), (_, read_nodes), _ = round_trip
+    # One tvert per vertex, vertices stay as they are
+    body = nodes[('', 'body')]
+    read_body = read_nodes[('', 'body')]
+    for label, dim in [('verts', 3), ('tverts', 2)]:
+        np.testing.assert_allclose(block(read_body, label, dim),
+                                   block(body, label, dim))
+    np.testing.assert_array_equal(block(read_body, 'faces', 8, np.int32),
+                                  block(body, 'faces', 8, np.int32))
+    assert read_body['bitmap'][0][1] == 'bodytex'
+    np.testing.assert_allclose(values(read_body, 'diffuse'),
+                               values(body, 'diffuse'), rtol=1.0e-6)
+    # Normals are generated when writing, per vertex and unit length
+    normals = block(read_body, 'normals', 3)
+    np.testing.assert_allclose(np.linalg.norm(normals, axis=1), 1.0,
+                               rtol=1.0e-6)
+
+
+def test_split_vertices(round_trip):
+    (_, nodes), (_, read_nodes), _ = round_trip
+    # Vertices with different tverts per face are split, face corners
+    # keep their positions and uvs
+    seam = nodes[('', 'seam')]
+    read_seam = read_nodes[('', 'seam')]
+    faces = block(seam, 'faces', 8, np.int32)
+    read_faces = block(read_seam, 'faces', 8, np.int32)
+    read_verts = block(read_seam, 'verts', 3)
+    assert len(read_verts) == 4
+    np.testing.assert_allclose(read_verts[read_faces[:, 0:3]],
+                               block(seam, 'verts', 3)[faces[:, 0:3]])
+    np.testing.assert_allclose(block(read_seam, 'tverts', 2)[
+        read_faces[:, 4:7]], block(seam, 'tverts', 2)[faces[:, 4:7]])
+
+
+def test_dangly(round_trip):
+    (_, nodes), (_, read_nodes), _ = round_trip
+    cape = nodes[('', 'cape')]
+    read_cape = read_nodes[('', 'cape')]
+    for label in ['displacement', 'tightness', 'period']:
+        np.testing.assert_allclose(values(read_cape, label),
+                                   values(cape, label))
+    np.testing.assert_allclose(block(read_cape, 'constraints', 1),
+                               block(cape, 'constraints', 1))
+
+
+def test_lazy_animations(round_trip):
+    _, (_, read_nodes), mdl_path = round_trip
+    offsets = nvb_binmdl.read_anim_offsets(mdl_path)
+    assert len(offsets) == 1
+    _, anim_nodes = group_records(
+        nvb_binmdl.read_anim_records(mdl_path, offsets[0]))
+    np.testing.assert_allclose(
+        block(anim_nodes[('walk', 'body')], 'positionkey', 4),
+        block(read_nodes[('walk', 'body')], 'positionkey', 4))
+    assert nvb_binmdl.is_supported(mdl_path)
+
+
+def export_sample(ascii_lines, verts, keys):
+    """Add lines and numeric blocks the same way the exporter does."""
+    ascii_lines.append('newmodel precise')
+    ascii_lines.append('beginmodelgeom precise')
+    ascii_lines.append('node dummy precise')
+    ascii_lines.append('  parent null')
+    ascii_lines.append('endnode')
+    ascii_lines.append('node trimesh mesh')
+    ascii_lines.append('  parent precise')
+    ascii_lines.append('  verts ' + str(len(verts)))
+    nvb_writer.extend_rows(ascii_lines, '   ' + 3 * ' % 8.5f', verts)
+    ascii_lines.append('  tverts ' + str(len(verts)))
+    nvb_writer.extend_rows(ascii_lines, '    % 7.4f % 7.4f  0',
+                           verts[:, :2])
+    faces = np.array([[0, 1, 2, 1, 0, 1, 2, 0], [1, 2, 3, 1, 1, 2, 3, 0]])
+    ascii_lines.append('  faces ' + str(len(faces)))
+    nvb_writer.extend_rows(ascii_lines, '   ' + 8 * ' %d', faces)
+    ascii_lines.append('endnode')
+    ascii_lines.append('endmodelgeom precise')
+    ascii_lines.append('newanim move precise')
+    ascii_lines.append('  length 1.0')
+    ascii_lines.append('  node trimesh mesh')
+    ascii_lines.append('    parent precise')
+    ascii_lines.append('    positionkey ' + str(len(keys)))
+    nvb_writer.extend_rows(ascii_lines, '      % 6.3f' + 3 * ' % 6.5f', keys)
+    ascii_lines.append('    endlist')
+    ascii_lines.append('  endnode')
+    ascii_lines.append('doneanim move precise')
+    ascii_lines.append('donemodel precise')
+
+
+@pytest.mark.parametrize('snapshot', [False, True])
+def test_export_precision(tmp_path, snapshot):
+    # Values are written as they are in memory, not as formatted text
+    rng = np.random.default_rng(0)
+    verts = rng.uniform(-10.0, 10.0, (4, 3)).astype(np.float32)
+    keys = np.column_stack((np.linspace(0.0, 1.0, 5),
+                            rng.uniform(-10.0, 10.0, (5, 3))))
+    if snapshot:  # Generated in this process, written in another one
+        ascii_lines = nvb_writer.AsciiSnapshot()
+    else:
+        ascii_lines = nvb_writer.RecordWriter()
+    export_sample(ascii_lines, verts, keys)
+    mdl_path = tmp_path / 'precise.mdl'
+    nvb_writer.write_file(str(mdl_path), ascii_lines, True)
+    _, nodes = group_records(nvb_binmdl.read_records(str(mdl_path)))
+    mesh = nodes[('', 'mesh')]
+    np.testing.assert_array_equal(block(mesh, 'verts', 3), verts)
+    np.testing.assert_array_equal(block(mesh, 'tverts', 2), verts[:, :2])
+    np.testing.assert_array_equal(
+        block(nodes[('move', 'mesh')], 'positionkey', 4),
+        keys.astype(np.float32))
+
+
+skin_mdl = """\
+newmodel skinned
+beginmodelgeom skinned
+node dummy skinned
+  parent null
+endnode
+node dummy bone1
+  parent skinned
+  position 1.0 0.5 0.2
+endnode
+node skin body
+  parent skinned
+  bitmap bodytex
+  verts 3
+    0.0 0.0 0.0
+    1.0 0.0 0.0
+    0.0 1.0 0.0
+  tverts 3
+    0.0 0.0 0
+    1.0 0.0 0
+    0.0 1.0 0
+  faces 1
+    0 1 2 1 0 1 2 1
+  weights 3
+    bone1 1.0
+    skinned 0.0
+    skinned 0.25 bone1 0.75
+endnode
+endmodelgeom skinned
+donemodel skinned
+"""
+
+
+@pytest.fixture(scope='module')
+def skin_path(tmp_path_factory):
+    """Compiled skinmesh, one vertex has no (positive) weights."""
+    records = list(nvb_parse.ascii_records(io.StringIO(skin_mdl)))
+    mdl_path = tmp_path_factory.mktemp('binskin') / 'skinned.mdl'
+    mdl_path.write_bytes(nvb_binmdl.write_records(records))
+    return str(mdl_path)
+
+
+def test_skin_weights(skin_path, tmp_path):
+    records = nvb_binmdl.read_records(skin_path)
+    # Weights are rows of the weights record, one per vertex
+    assert all(tokens for _, tokens, _ in records)
+    _, nodes = group_records(records)
+    tokens, rows = nodes[('', 'body')]['weights']
+    assert tokens == ['weights', '3']
+    assert [r[0::2] for r in rows] == [['bone1'], [], ['skinned', 'bone1']]
+    np.testing.assert_allclose([float(w) for w in rows[2][1::2]],
+                               [0.25, 0.75])
+    # Compile again from the decoded records
+    mdl_path = tmp_path / 'again.mdl'
+    mdl_path.write_bytes(nvb_binmdl.write_records(records))
+    _, read_nodes = group_records(nvb_binmdl.read_records(str(mdl_path)))
+    assert read_nodes[('', 'body')]['weights'] == (tokens, rows)
+
+
+@pytest.mark.parametrize('node_names, node_types', [('!body', ''),
+                                                    ('', 'dummy')])
+def test_skin_filtered(skin_path, node_names, node_types):
+    block_filter = nvb_parse.BlockFilter(node_names, node_types)
+    records = list(nvb_parse.filter_records(
+        nvb_binmdl.read_records(skin_path), block_filter))
+    skipped = [r for r in records if r[0] == Recordtype.SKIPNODE]
+    assert [r[1][2] for r in skipped] == ['body']
+    assert skipped[0][2] == [['parent', 'skinned']]
@@ -0,0 +1,126 @@
+"""Tests for running external compilers, using a python script as compiler."""
+
+import sys
+import time
+
+import pytest
+
+from neverblender import nvb_compiler
+
+CompilerRun = nvb_compiler.CompilerRun
+
+fake_compiler = """\
+import sys
+import time
+
+mode = sys.argv[1]
+print('compiling ' + mode)
+sys.stdout.flush()
+if mode == 'sleep':
+    time.sleep(30)
+elif mode == 'fail':
+    sys.stderr.write('bad model\\n')
+    sys.exit(3)
+elif mode == 'rewrite':
+    with open(sys.argv[2], 'w') as f:
+        f.write('decompiled')
+"""
+
+
+@pytest.fixture
+def compiler(tmp_path):
+    """Command prefix running the fake compiler."""
+    script_path = tmp_path / 'fakecomp.py'
+    script_path.write_text(fake_compiler)
+    return [sys.executable, str(script_path)]
+
+
+def wait_for(condition, timeout=10.0):
+    """Poll until condition() is true."""
+    end_time = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end_time, 'Timed out waiting'
+        time.sleep(0.01)
+
+
+def test_success(compiler, tmp_path):
+    mdl_path = tmp_path / 'model.mdl'
+    mdl_path.write_text('binary')
+    result = nvb_compiler.run(compiler + ['rewrite', str(mdl_path)],
+                              str(tmp_path))
+    assert result.status == CompilerRun.OK
+    assert result.returncode == 0
+    assert result.output == [('stdout', 'compiling rewrite')]
+    assert mdl_path.read_text() == 'decompiled'
+
+
+def test_nonzero_exit(compiler, tmp_path, capsys):
+    result = nvb_compiler.run(compiler + ['fail'], str(tmp_path))
+    assert result.status == CompilerRun.FAILED
+    assert result.returncode == 3
+    assert ('stderr', 'bad model') in result.output
+    # The log including the compiler output is printed for failed runs
+    printed = capsys.readouterr().out
+    assert 'ERROR - Decompiler failed' in printed
+    assert 'stderr: bad model' in printed
+
+
+def test_missing_compiler(tmp_path):
+    result = nvb_compiler.run([str(tmp_path / 'missing')], str(tmp_path))
+    assert result.status == CompilerRun.FAILED
+    assert result.output[0][0] == 'error'
+
+
+def test_timeout(compiler, tmp_path):
+    start_time = time.monotonic()
+    result = nvb_compiler.run(compiler + ['sleep'], str(tmp_path), 0.5)
+    assert result.status == CompilerRun.TIMEOUT
+    assert result.returncode is not None  # Killed and waited for
+    assert ('stdout', 'compiling sleep') in result.output
+    assert time.monotonic() - start_time < 10.0
+
+
+def test_cancel(compiler, tmp_path):
+    pool = nvb_compiler.CompilerPool(
+        [compiler + ['sleep'] for _ in range(3)], str(tmp_path), 1)
+    pool.start()
+    wait_for(lambda: pool.runs[0].status == CompilerRun.RUNNING)
+    assert pool.finished_count() == 0
+    start_time = time.monotonic()
+    pool.cancel()
+    pool.join()
+    assert time.monotonic() - start_time < 10.0
+    assert pool.is_done()
+    assert [r.status for r in pool.runs] == [CompilerRun.CANCELLED] * 3
+    # The running process was killed, the others never started
+    assert pool.runs[0].returncode is not None
+    assert pool.runs[1].returncode is None
+
+
+def test_pool_mixed_results(compiler, tmp_path):
+    pool = nvb_compiler.CompilerPool(
+        [compiler + ['ok'], compiler + ['fail'], compiler + ['ok']],
+        str(tmp_path), 2)
+    pool.start()
+    pool.join()
+    assert pool.finished_count() == 3
+    assert [r.status for r in pool.runs] == \
+        [CompilerRun.OK, CompilerRun.FAILED, CompilerRun.OK]
+
+
+def test_pool_pop_finished(compiler, tmp_path):
+    pool = nvb_compiler.CompilerPool(
+        [compiler + ['sleep'], compiler + ['ok'], compiler + ['fail']],
+        str(tmp_path), 3)
+    pool.start()
+    # Runs are collected as they finish, not in order
+    finished = []
+    while len(finished) < 2:
+        finished.extend(pool.pop_finished(True))
+    assert sorted(finished) == [1, 2]
+    assert pool.runs[0].status == CompilerRun.RUNNING
+    pool.cancel()
+    pool.join()
+    assert pool.pop_finished() == [0]
+    assert pool.pop_finished() == []
+    assert pool.runs[0].status == CompilerRun.CANCELLED
@@ -0,0 +1,166 @@
+"""Tests for per loop to per vertex conversion on export."""
+
+import collections
+import time
+
+import numpy as np
+import pytest
+
+from neverblender import nvb_meshdata
+from neverblender import nvb_writer
+
+Loop = collections.namedtuple('Loop', ['vertex_index', 'normal', 'tangent',
+                                       'bitangent_sign'])
+ColorLoop = collections.namedtuple('ColorLoop', ['index', 'vertex_index'])
+
+
+def make_loops(vert_cnt, loop_cnt, seed):
+    """Random loops with float32 data, every vertex used at least once."""
+    rng = np.random.default_rng(seed)
+    loop_vert_ids = np.concatenate([rng.permutation(vert_cnt),
+                                    rng.integers(0, vert_cnt,
+                                                 loop_cnt - vert_cnt)])
+    rng.shuffle(loop_vert_ids)
+    normals = rng.uniform(-1.0, 1.0, (loop_cnt, 3)).astype(np.float32)
+    tangents = rng.uniform(-1.0, 1.0, (loop_cnt, 3)).astype(np.float32)
+    signs = rng.choice([-1.0, 1.0], loop_cnt).astype(np.float32)
+    loops = [Loop(int(v), tuple(n.tolist()), tuple(t.tolist()), float(s))
+             for v, n, t, s in zip(loop_vert_ids, normals, tangents, signs)]
+    return loops, loop_vert_ids, normals, tangents, signs
+
+
+def gather_per_vertex(loops, vert_cnt):
+    """Per vertex gather and formatting as done before vectorising."""
+    per_loop_data = [(lp.vertex_index, lp.normal, lp.tangent,
+                      lp.bitangent_sign) for lp in loops]
+    per_vertex_data = [[(n, t, b) for i, n, t, b in per_loop_data
+                        if i == vidx] for vidx in range(vert_cnt)]
+    normals = [d[0][0] for d in per_vertex_data]
+    tangents = [[*d[0][1]] + [d[0][2]] for d in per_vertex_data]
+    fstr = '   ' + 3 * ' {: 8.5f}'
+    normal_lines = [fstr.format(*n) for n in normals]
+    fstr = '   ' + 3 * ' {: 8.5f}' + ' {: 3.1f}'
+    tangent_lines = [fstr.format(*t) for t in tangents]
+    return normal_lines, tangent_lines
+
+
+def gather_vectorised(loop_vert_ids, vert_cnt, normals, tangents, signs):
+    """Per vertex gather and formatting as done on export."""
+    loop_tangents = np.empty((len(loop_vert_ids), 4), dtype=np.float32)
+    loop_tangents[:, :3] = tangents
+    loop_tangents[:, 3] = signs
+    normal_lines = []
+    nvb_writer.extend_rows(normal_lines, '   ' + 3 * ' % 8.5f',
+                           nvb_meshdata.first_loop_data(
+                               loop_vert_ids, vert_cnt, normals))
+    tangent_lines = []
+    nvb_writer.extend_rows(tangent_lines, '   ' + 3 * ' % 8.5f' + ' % 3.1f',
+                           nvb_meshdata.first_loop_data(
+                               loop_vert_ids, vert_cnt, loop_tangents))
+    return normal_lines, tangent_lines
+
+
+@pytest.mark.parametrize('vert_cnt, loop_cnt, seed',
+                         [(1, 3, 0), (8, 36, 1), (500, 3000, 2)])
+def test_normals_match_per_vertex_gather(vert_cnt, loop_cnt, seed):
+    loops, loop_vert_ids, normals, tangents, signs = \
+        make_loops(vert_cnt, loop_cnt, seed)
+    expected = gather_per_vertex(loops, vert_cnt)
+    result = gather_vectorised(loop_vert_ids, vert_cnt,
+                               normals, tangents, signs)
+    assert result == expected
+
+
+def loop_colors_per_loop(loops, vcolors, color_dim):
+    """Per loop colors set through a vertex => loops dict as done before."""
+    cmap_data = [[0.0] * color_dim for _ in loops]
+    vert_loop_map = {}
+    for lp in loops:
+        if lp.vertex_index in vert_loop_map:
+            vert_loop_map[lp.vertex_index].append(lp.index)
+        else:
+            vert_loop_map[lp.vertex_index] = [lp.index]
+    if color_dim > 3:
+        for vidx in vert_loop_map:
+            for lidx in vert_loop_map[vidx]:
+                cmap_data[lidx] = (*vcolors[vidx], *[0]*(color_dim-3))
+    else:
+        for vidx in vert_loop_map:
+            for lidx in vert_loop_map[vidx]:
+                cmap_data[lidx] = vcolors[vidx]
+    return np.array(cmap_data, dtype=np.float32)
+
+
+def make_color_loops(vert_cnt, loop_cnt, seed):
+    """Random loops and per vertex colors."""
+    loops, loop_vert_ids, _, _, _ = make_loops(vert_cnt, loop_cnt, seed)
+    loops = [ColorLoop(i, lp.vertex_index) for i, lp in enumerate(loops)]
+    vcolors = np.random.default_rng(seed).uniform(0.0, 1.0, (vert_cnt, 3))
+    return loops, loop_vert_ids, vcolors
+
+
+@pytest.mark.parametrize('color_dim', [3, 4])
+@pytest.mark.parametrize('vert_cnt, loop_cnt, seed',
+                         [(1, 3, 3), (8, 36, 4), (500, 3000, 5)])
+def test_colors_match_per_loop_dict(vert_cnt, loop_cnt, seed, color_dim):
+    loops, loop_vert_ids, vcolors = make_color_loops(vert_cnt, loop_cnt,
+                                                     seed)
+    expected = loop_colors_per_loop(loops, vcolors.tolist(), color_dim)
+    result = nvb_meshdata.vertex_loop_data(loop_vert_ids, vcolors, color_dim)
+    assert result.dtype == np.float32
+    np.testing.assert_array_equal(result, expected)
+
+
+def test_colors_timing():
+    # Synthetic mesh with 100k loops
+    loops, loop_vert_ids, vcolors = make_color_loops(25000, 100000, 6)
+    vcolor_list = vcolors.tolist()
+    start_time = time.perf_counter()
+    expected = loop_colors_per_loop(loops, vcolor_list, 4)
+    per_loop_time = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    result = nvb_meshdata.vertex_loop_data(loop_vert_ids, vcolors, 4)
+    vectorised_time = time.perf_counter() - start_time
+    print('100k loops: per loop {:.4f}s, vectorised {:.4f}s'.format(
+        per_loop_time, vectorised_time))
+    np.testing.assert_array_equal(result, expected)
+    assert vectorised_time < per_loop_time
+
+
+def test_first_loop_wins():
+    loop_data = np.array([[1.0], [2.0], [3.0], [4.0]], dtype=np.float32)
+    vert_data = nvb_meshdata.first_loop_data([2, 0, 2, 0], 3, loop_data)
+    assert vert_data.tolist() == [[2.0], [0.0], [1.0]]
+    assert vert_data.dtype == np.float32
+
+
+def test_duplicate_bones_keep_first_weight():
+    # (vertex, bone, weight), bone 0 listed twice for vertex 0 and 2
+    weights = [(0, 0, 0.25), (0, 1, 0.75), (0, 0, 0.5),
+               (1, 1, 1.0), (2, 0, 0.1), (2, 0, 0.9), (2, 2, 0.3)]
+    vert_ids, bone_ids, _ = zip(*weights)
+    ids = nvb_meshdata.first_pair_ids(vert_ids, bone_ids, 3)
+    assert [weights[i] for i in ids] == \
+        [(0, 0, 0.25), (0, 1, 0.75), (1, 1, 1.0), (2, 0, 0.1), (2, 2, 0.3)]
+
+
+def test_duplicate_bones_empty():
+    assert len(nvb_meshdata.first_pair_ids([], [], 0)) == 0
+
+
+def test_absolute_key_weights():
+    # Key blocks at frames 0, 10, 20 (not in order), eval times on the
+    # keys, in between and outside
+    kb_frames = [0.0, 20.0, 10.0]
+    eval_times = [0.0, 10.0, 12.0, 15.0, 20.0, -5.0, 30.0]
+    kb0, kb1, factor = nvb_meshdata.absolute_key_weights(kb_frames,
+                                                         eval_times)
+    assert kb0.tolist() == [0, 2, 2, 2, 1, 0, 1]
+    assert kb1.tolist() == [0, 2, 1, 1, 1, 0, 1]
+    np.testing.assert_allclose(factor, [0.0, 0.0, 0.2, 0.5, 0.0, 0.0, 0.0])
+    # Linear blend of the key coordinates
+    kb_coords = np.array([[0.0], [4.0], [2.0]])
+    blended = kb_coords[kb0] + factor[:, None] * (kb_coords[kb1] -
+                                                  kb_coords[kb0])
+    np.testing.assert_allclose(blended[:, 0],
+                               [0.0, 2.0, 2.4, 3.0, 4.0, 0.0, 4.0])
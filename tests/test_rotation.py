@@ -0,0 +1,234 @@
+"""Tests for the batched rotation conversions."""
+
+import math
+
+import numpy as np
+import pytest
+
+from neverblender import nvb_binmdl
+from neverblender import nvb_rotation
+
+
+def random_quats(cnt, seed):
+    """Random unit (w, x, y, z) quaternions."""
+    rng = np.random.default_rng(seed)
+    return nvb_rotation.normalize_quat(rng.normal(size=(cnt, 4)))
+
+
+def assert_same_quats(quats1, quats2, atol=1.0e-9):
+    """Quaternions describe the same rotations (sign does not matter)."""
+    dots = np.abs(np.sum(quats1 * quats2, axis=1))
+    np.testing.assert_allclose(dots, 1.0, atol=atol)
+
+
+def test_known_values():
+    quats = nvb_rotation.axisangle_to_quat([0.0, 0.0, 2.0, math.pi / 2])
+    half = math.sqrt(0.5)
+    np.testing.assert_allclose(quats, [[half, 0.0, 0.0, half]])
+    # Rotates x onto y
+    np.testing.assert_allclose(
+        nvb_rotation.quat_rotate(quats, [1.0, 0.0, 0.0]), [[0.0, 1.0, 0.0]],
+        atol=1.0e-12)
+    np.testing.assert_allclose(nvb_rotation.quat_to_matrix(quats)[0],
+                               [[0.0, -1.0, 0.0],
+                                [1.0, 0.0, 0.0],
+                                [0.0, 0.0, 1.0]], atol=1.0e-12)
+
+
+def test_zero_axis():
+    # No axis or zero angle is no rotation
+    quats = nvb_rotation.axisangle_to_quat([[0.0, 0.0, 0.0, 1.5],
+                                            [0.0, 0.0, 1.0, 0.0]])
+    np.testing.assert_allclose(quats, [[1.0, 0.0, 0.0, 0.0]] * 2)
+    axisangles = nvb_rotation.quat_to_axisangle([[1.0, 0.0, 0.0, 0.0],
+                                                 [0.0, 0.0, 0.0, 0.0]])
+    np.testing.assert_allclose(axisangles, [[0.0, 1.0, 0.0, 0.0]] * 2)
+
+
+def test_axisangle_round_trip():
+    quats = random_quats(500, 0)
+    axisangles = nvb_rotation.quat_to_axisangle(quats)
+    np.testing.assert_allclose(np.linalg.norm(axisangles[:, :3], axis=1),
+                               1.0)
+    assert np.all((axisangles[:, 3] >= -math.pi) &
+                  (axisangles[:, 3] < math.pi))
+    assert_same_quats(nvb_rotation.axisangle_to_quat(axisangles), quats)
+
+
+def mathutils_axis_angle(quat):
+    """Quaternion(quat).axis and .angle, as implemented in blender."""
+    length = math.sqrt(sum(v * v for v in quat))
+    w, x, y, z = [v / length for v in quat]
+    half_angle = math.acos(max(-1.0, min(1.0, w)))
+    sin_half = math.sin(half_angle)
+    if abs(sin_half) < 0.0005:
+        sin_half = 1.0
+    axis = [x / sin_half, y / sin_half, z / sin_half]
+    if not any(axis):
+        axis[1] = 1.0
+    # angle_wrap_rad
+    angle = math.fmod(2.0 * half_angle + math.pi, 2.0 * math.pi) - math.pi
+    return axis + [angle]
+
+
+def test_axisangle_mathutils():
+    # Values of mathutils for w < 0: angle wrapped, axis not flipped
+    np.testing.assert_allclose(
+        nvb_rotation.quat_to_axisangle([-0.5, 0.5, 0.5, 0.5]),
+        [[0.57735027, 0.57735027, 0.57735027, -2.0943951]], rtol=1.0e-6)
+    quats = random_quats(500, 9)
+    expected = [mathutils_axis_angle(q) for q in quats.tolist()]
+    np.testing.assert_allclose(nvb_rotation.quat_to_axisangle(quats),
+                               expected, atol=1.0e-9)
+
+
+def test_axisangle_canonical():
+    # Matrix.to_quaternion() has w >= 0, so exported angles are >= 0
+    quats = random_quats(500, 10)
+    canonical = nvb_rotation.canonical_quat(quats)
+    assert np.all(canonical[:, 0] >= 0.0)
+    assert_same_quats(canonical, quats)
+    axisangles = nvb_rotation.quat_to_axisangle(canonical)
+    assert np.all(axisangles[:, 3] >= 0.0)
+    np.testing.assert_allclose(
+        axisangles, [mathutils_axis_angle(q) for q in canonical.tolist()],
+        atol=1.0e-9)
+
+
+def test_axisangle_wrap():
+    # Angles beyond a full turn are the same rotation
+    rng = np.random.default_rng(1)
+    axisangles = rng.uniform(-1.0, 1.0, (200, 4))
+    wrapped = axisangles.copy()
+    wrapped[:, 3] += 2.0 * math.pi * rng.integers(-3, 4, 200)
+    assert_same_quats(nvb_rotation.axisangle_to_quat(wrapped),
+                      nvb_rotation.axisangle_to_quat(axisangles))
+
+
+def test_matrix_round_trip():
+    quats = random_quats(500, 2)
+    mats = nvb_rotation.quat_to_matrix(quats)
+    # Orthonormal, no reflection
+    np.testing.assert_allclose(mats @ mats.transpose(0, 2, 1),
+                               np.broadcast_to(np.eye(3), mats.shape),
+                               atol=1.0e-12)
+    np.testing.assert_allclose(np.linalg.det(mats), 1.0)
+    result = nvb_rotation.matrix_to_quat(mats)
+    assert np.all(result[:, 0] >= 0.0)
+    assert_same_quats(result, quats)
+    # Scale is removed
+    scaled = mats * np.array([2.0, 0.5, 3.0])
+    assert_same_quats(nvb_rotation.matrix_to_quat(scaled), quats)
+
+
+def test_euler_round_trip():
+    rng = np.random.default_rng(3)
+    eulers = rng.uniform(-math.pi, math.pi, (500, 3))
+    eulers[:, 1] /= 2.0  # Avoid gimbal lock
+    quats = nvb_rotation.euler_to_quat(eulers)
+    np.testing.assert_allclose(nvb_rotation.quat_to_matrix(quats),
+                               nvb_rotation.euler_to_matrix(eulers),
+                               atol=1.0e-9)
+    eul1, eul2 = nvb_rotation.matrix_to_euler_pair(
+        nvb_rotation.quat_to_matrix(quats))
+    for eul in (eul1, eul2):
+        assert_same_quats(nvb_rotation.euler_to_quat(eul), quats)
+
+
+def test_euler_gimbal_lock():
+    eulers = [[0.3, math.pi / 2, -0.4], [0.1, -math.pi / 2, 0.2]]
+    eul1, _ = nvb_rotation.matrix_to_euler_pair(
+        nvb_rotation.euler_to_matrix(eulers))
+    np.testing.assert_allclose(eul1[:, 2], 0.0)
+    np.testing.assert_allclose(nvb_rotation.euler_to_matrix(eul1),
+                               nvb_rotation.euler_to_matrix(eulers),
+                               atol=1.0e-7)
+
+
+def test_euler_filter_continuity():
+    # Two full turns around z, sampled finely
+    angles = np.linspace(0.0, 4.0 * math.pi, 200)
+    axisangles = np.zeros((200, 4))
+    axisangles[:, 2] = 1.0
+    axisangles[:, 3] = angles
+    eulers = nvb_rotation.quat_to_euler(
+        nvb_rotation.axisangle_to_quat(axisangles))
+    assert np.max(np.abs(np.diff(eulers, axis=0))) < 0.1
+    np.testing.assert_allclose(eulers[:, 2], angles, atol=1.0e-9)
+    np.testing.assert_allclose(eulers[:, :2], 0.0, atol=1.0e-9)
+
+
+def test_euler_filter_pole():
+    # Turning around y passes the poles, where the first solution jumps
+    angles = np.linspace(0.0, 4.0 * math.pi, 300)
+    axisangles = np.zeros((300, 4))
+    axisangles[:, 1] = 1.0
+    axisangles[:, 3] = angles
+    quats = nvb_rotation.axisangle_to_quat(axisangles)
+    eulers = nvb_rotation.quat_to_euler(quats)
+    assert np.max(np.abs(np.diff(eulers, axis=0))) < 0.2
+    assert_same_quats(nvb_rotation.euler_to_quat(eulers), quats)
+
+
+def test_euler_filter_random_path():
+    # Small random steps stay small steps
+    rng = np.random.default_rng(11)
+    steps = np.zeros((1000, 4))
+    steps[:, 0] = 1.0
+    steps[:, 1:] = rng.normal(0.0, 0.02, (1000, 3))
+    quats = [np.array([1.0, 0.0, 0.0, 0.0])]
+    for step in steps:
+        quats.append(nvb_rotation.quat_mul(quats[-1], step)[0])
+    quats = nvb_rotation.normalize_quat(quats)
+    eulers = nvb_rotation.quat_to_euler(quats)
+    assert_same_quats(nvb_rotation.euler_to_quat(eulers), quats, 1.0e-7)
+    locked = np.abs(np.abs(eulers[:, 1]) - math.pi / 2) < 0.1
+    assert np.max(np.abs(np.diff(eulers[~locked], axis=0))) < 0.5
+
+
+def test_euler_filter_empty():
+    assert nvb_rotation.quat_to_euler(np.zeros((0, 4))).shape == (0, 3)
+
+
+def test_euler_filter_prev():
+    # Continues close to the previous rotation
+    eulers = nvb_rotation.quat_to_euler(
+        nvb_rotation.euler_to_quat([[0.0, 0.0, 0.1]]),
+        prev_eul=(0.0, 0.0, 2.0 * math.pi))
+    np.testing.assert_allclose(eulers, [[0.0, 0.0, 0.1 + 2.0 * math.pi]])
+
+
+def test_quat_mul():
+    quats1 = random_quats(100, 4)
+    quats2 = random_quats(100, 5)
+    np.testing.assert_allclose(
+        nvb_rotation.quat_to_matrix(nvb_rotation.quat_mul(quats1, quats2)),
+        nvb_rotation.quat_to_matrix(quats1) @
+        nvb_rotation.quat_to_matrix(quats2), atol=1.0e-12)
+    # Conjugate is the inverse rotation
+    assert_same_quats(
+        nvb_rotation.quat_mul(quats1, nvb_rotation.quat_conjugate(quats1)),
+        np.array([[1.0, 0.0, 0.0, 0.0]]))
+    # A single quaternion is applied to all rows
+    np.testing.assert_allclose(nvb_rotation.quat_mul(quats1[0], quats2),
+                               nvb_rotation.quat_mul(
+                                   np.repeat(quats1[:1], 100, axis=0),
+                                   quats2))
+
+
+def test_quat_rotate():
+    quats = random_quats(100, 6)
+    vectors = np.random.default_rng(7).normal(size=(100, 3))
+    expected = np.einsum('nij,nj->ni', nvb_rotation.quat_to_matrix(quats),
+                         vectors)
+    np.testing.assert_allclose(nvb_rotation.quat_rotate(quats, vectors),
+                               expected, atol=1.0e-12)
+
+
+@pytest.mark.parametrize('quats', [[[1.0, 0.0, 0.0, 0.0]],
+                                   random_quats(10, 8)])
+def test_compiled_mdl_order(quats):
+    mdl_quats = nvb_binmdl.quat_to_mdl(quats)
+    # Compiled mdls store w last
+    np.testing.assert_array_equal(mdl_quats[:, 3], np.asarray(quats)[:, 0])
+    np.testing.assert_array_equal(nvb_binmdl.quat_from_mdl(mdl_quats), quats)